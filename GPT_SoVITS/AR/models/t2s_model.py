@@ -1,6 +1,7 @@
 # modified from https://github.com/yangdongchao/SoundStorm/blob/master/soundstorm/s1/AR/models/t2s_model.py
 # reference: https://github.com/lifeiteng/vall-e
 import math
+import time
 from typing import List, Optional
 import torch
 from tqdm import tqdm
@@ -9,6 +10,7 @@ from AR.models.utils import make_pad_mask
 from AR.models.utils import (
     topk_sampling,
     sample,
+    sample_fused,
     logits_to_probs,
     multinomial_sample_one_no_sync,
     dpo_loss,
@@ -23,6 +25,7 @@ from AR.modules.transformer import TransformerEncoderLayer
 from torch import nn
 from torch.nn import functional as F
 from torchmetrics.classification import MulticlassAccuracy
+from tts_metrics import metrics, record_t2s
 
 default_config = {
     "embedding_dim": 512,
@@ -113,6 +116,12 @@ class T2SBlock:
 
         self.false = torch.tensor(False, dtype=torch.bool)
 
+    def qkv_proj(self, x:torch.Tensor):
+        return F.linear(x, self.qkv_w, self.qkv_b)
+
+    def out_proj(self, x:torch.Tensor):
+        return F.linear(x, self.out_w, self.out_b)
+
     @torch.jit.ignore
     def to_mask(self, x:torch.Tensor, padding_mask:Optional[torch.Tensor]):
         if padding_mask is None:
@@ -126,7 +135,7 @@ class T2SBlock:
     def process_prompt(self, x:torch.Tensor, attn_mask : torch.Tensor, padding_mask:Optional[torch.Tensor]=None, torch_sdpa:bool=True):
 
             
-        q, k, v = F.linear(self.to_mask(x, padding_mask), self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+        q, k, v = self.qkv_proj(self.to_mask(x, padding_mask)).chunk(3, dim=-1)
 
         batch_size = q.shape[0]
         q_len = q.shape[1]
@@ -147,7 +156,7 @@ class T2SBlock:
 
         attn = attn.permute(2, 0, 1, 3).reshape(batch_size*q_len, self.hidden_dim)
         attn = attn.view(q_len, batch_size, self.hidden_dim).transpose(1, 0)
-        attn = F.linear(self.to_mask(attn, padding_mask), self.out_w, self.out_b)
+        attn = self.out_proj(self.to_mask(attn, padding_mask))
 
         if padding_mask is not None:
             for i in range(batch_size):
@@ -187,11 +196,37 @@ class T2SBlock:
         return x, k_cache, v_cache
     
     def decode_next_token(self, x:torch.Tensor, k_cache:torch.Tensor, v_cache:torch.Tensor, attn_mask:Optional[torch.Tensor]=None, torch_sdpa:bool=True):
-        q, k, v = F.linear(x, self.qkv_w, self.qkv_b).chunk(3, dim=-1)
+        q, k, v = self.qkv_proj(x).chunk(3, dim=-1)
 
         k_cache = torch.cat([k_cache, k], dim=1)
         v_cache = torch.cat([v_cache, v], dim=1)
-        
+
+        x = self.decode_attention(x, q, k_cache, v_cache, attn_mask, torch_sdpa)
+        return x, k_cache, v_cache
+
+    def decode_next_token_static(self, x:torch.Tensor, k_cache:torch.Tensor, v_cache:torch.Tensor, cache_len:int, attn_mask:Optional[torch.Tensor]=None, torch_sdpa:bool=True):
+        # k_cache/v_cache 是预分配的 [batch, max_kv_len, hidden] 缓冲区，前 cache_len 个位置有效
+        # 新token的KV原地写入，不再每步 torch.cat 重新分配和拷贝整个缓存
+        q, k, v = self.qkv_proj(x).chunk(3, dim=-1)
+
+        kv_len = cache_len + q.shape[1]
+        k_cache[:, cache_len:kv_len] = k
+        v_cache[:, cache_len:kv_len] = v
+
+        return self.decode_attention(x, q, k_cache[:, :kv_len], v_cache[:, :kv_len], attn_mask, torch_sdpa)
+
+    def decode_next_token_indexed(self, x:torch.Tensor, k_cache:torch.Tensor, v_cache:torch.Tensor, positions:torch.Tensor, kv_len:int, attn_mask:Optional[torch.Tensor]=None, torch_sdpa:bool=True):
+        # 连续批处理时每行的序列长度不同，新token的KV按各行自己的 positions 原地写入
+        # attn_mask 为 True 的位置（各行 positions 之后的空位）不参与注意力
+        q, k, v = self.qkv_proj(x).chunk(3, dim=-1)
+
+        batch_index = torch.arange(q.shape[0], device=q.device)
+        k_cache[batch_index, positions] = k[:, 0]
+        v_cache[batch_index, positions] = v[:, 0]
+
+        return self.decode_attention(x, q, k_cache[:, :kv_len], v_cache[:, :kv_len], attn_mask, torch_sdpa)
+
+    def decode_attention(self, x:torch.Tensor, q:torch.Tensor, k_cache:torch.Tensor, v_cache:torch.Tensor, attn_mask:Optional[torch.Tensor]=None, torch_sdpa:bool=True):
         batch_size = q.shape[0]
         q_len = q.shape[1]
         kv_len = k_cache.shape[1]
@@ -202,13 +237,16 @@ class T2SBlock:
 
 
         if torch_sdpa:
-            attn = F.scaled_dot_product_attention(q, k, v)
+            if attn_mask is None:
+                attn = F.scaled_dot_product_attention(q, k, v)
+            else:
+                attn = F.scaled_dot_product_attention(q, k, v, ~attn_mask)
         else:
             attn = scaled_dot_product_attention(q, k, v, attn_mask)
 
         attn = attn.permute(2, 0, 1, 3).reshape(batch_size*q_len, self.hidden_dim)
         attn = attn.view(q_len, batch_size, self.hidden_dim).transpose(1, 0)
-        attn = F.linear(attn, self.out_w, self.out_b)
+        attn = self.out_proj(attn)
 
         x = x + attn
         x = F.layer_norm(
@@ -222,7 +260,7 @@ class T2SBlock:
             self.norm_b2,
             self.norm_eps2,
         )
-        return x, k_cache, v_cache
+        return x
 
 
 @torch.jit.script
@@ -255,6 +293,67 @@ class T2STransformer:
             x, k_cache[i], v_cache[i] = self.blocks[i].decode_next_token(x, k_cache[i], v_cache[i], attn_mask, torch_sdpa)
         return x, k_cache, v_cache
 
+    def decode_next_token_static(
+        self, x:torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        cache_len: int,
+        attn_mask : Optional[torch.Tensor]=None,
+        torch_sdpa:bool=True
+    ):
+        for i in range(self.num_blocks):
+            x = self.blocks[i].decode_next_token_static(x, k_cache[i], v_cache[i], cache_len, attn_mask, torch_sdpa)
+        return x
+
+    def decode_next_token_indexed(
+        self, x:torch.Tensor,
+        k_cache: List[torch.Tensor],
+        v_cache: List[torch.Tensor],
+        positions: torch.Tensor,
+        kv_len: int,
+        attn_mask : Optional[torch.Tensor]=None,
+        torch_sdpa:bool=True
+    ):
+        for i in range(self.num_blocks):
+            x = self.blocks[i].decode_next_token_indexed(x, k_cache[i], v_cache[i], positions, kv_len, attn_mask, torch_sdpa)
+        return x
+
+
+def _dynamic_int8_linear(weight:torch.Tensor, bias:Optional[torch.Tensor]):
+    linear = nn.Linear(weight.shape[1], weight.shape[0], bias=bias is not None)
+    with torch.no_grad():
+        linear.weight.copy_(weight)
+        if bias is not None:
+            linear.bias.copy_(bias)
+    return torch.ao.quantization.quantize_dynamic(
+        nn.Sequential(linear), {nn.Linear}, dtype=torch.qint8
+    )[0]
+
+
+# 以下两个类不做 torch.jit.script，只在Python里按鸭子类型替换 T2SMLP/T2SBlock，
+# 权重换成int8动态量化的Linear（仅CPU，fp32激活）
+class T2SMLPDynamicInt8(T2SMLP):
+    def __init__(self, mlp:T2SMLP):
+        self.fc1 = _dynamic_int8_linear(mlp.w1, mlp.b1)
+        self.fc2 = _dynamic_int8_linear(mlp.w2, mlp.b2)
+
+    def forward(self, x):
+        return self.fc2(F.relu(self.fc1(x)))
+
+
+class T2SBlockDynamicInt8(T2SBlock):
+    def __init__(self, block:T2SBlock):
+        self.__dict__.update(block.__dict__)
+        self.mlp = T2SMLPDynamicInt8(block.mlp)
+        self.qkv = _dynamic_int8_linear(block.qkv_w, block.qkv_b)
+        self.out = _dynamic_int8_linear(block.out_w, block.out_b)
+
+    def qkv_proj(self, x:torch.Tensor):
+        return self.qkv(x)
+
+    def out_proj(self, x:torch.Tensor):
+        return self.out(x)
+
 
 class Text2SemanticDecoder(nn.Module):
     def __init__(self, config, norm_first=False, top_k=3):
@@ -340,6 +439,63 @@ class Text2SemanticDecoder(nn.Module):
             blocks.append(block)
         
         self.t2s_transformer = T2STransformer(self.num_layers, blocks)
+        # 解码时使用预分配的定长KV缓存，可通过 infer_panel(..., static_kv_cache=False) 关闭
+        self.static_kv_cache = True
+
+    def quantize_dynamic_int8(self):
+        """
+        CPU only: int8 dynamic quantization of the decoder's Linear weights (the QKV,
+        output and MLP projections of every block plus ar_predict_layer). Activations
+        stay fp32, so callers and the KV cache are unchanged.
+        """
+        blocks = [T2SBlockDynamicInt8(block) for block in self.t2s_transformer.blocks]
+        self.t2s_transformer = T2STransformer(self.num_layers, blocks)
+        torch.ao.quantization.quantize_dynamic(
+            self, {"ar_predict_layer"}, dtype=torch.qint8, inplace=True
+        )
+        return self
+
+    def get_max_kv_len(self, prompt_len:int, early_stop_num:int):
+        """KV缓存最多需要容纳的长度：prompt 加上最多的解码步数"""
+        max_decode_steps = 1500 - 1
+        if early_stop_num != -1:
+            max_decode_steps = min(max_decode_steps, int(early_stop_num))
+        return prompt_len + max_decode_steps
+
+    def get_prefix_cache(self, prefix_phones:torch.LongTensor, prefix_bert:torch.Tensor, prompts:torch.LongTensor):
+        """
+        参考音频部分（参考文本的音素+BERT特征、参考音频的语义token）的输入嵌入只与音色有关，每个音色算一次复用。
+        文本部分在T2S里是双向注意力，参考文本在各层的KV依赖目标文本，所以能严格复用的只到嵌入层为止。
+        prefix_phones: [1, P]  prefix_bert: [1, 1024, P]  prompts: [1, S]
+        """
+        x = self.ar_text_embedding(prefix_phones)
+        x = x + self.bert_proj(prefix_bert.transpose(1, 2))
+        x = self.ar_text_position(x)
+        y_pos = self.ar_audio_position(self.ar_audio_embedding(prompts))
+        return {"x_len": x.shape[1], "x": x, "y_pos": y_pos}
+
+    def embed_with_prefix(self, x:torch.LongTensor, bert_feature:torch.Tensor, prefix_cache:dict):
+        """只对目标文本部分做嵌入，位置编码接着参考文本的长度往后排，再拼上缓存的参考文本嵌入"""
+        prefix_len = prefix_cache["x_len"]
+        x_target = self.ar_text_embedding(x[:, prefix_len:])
+        x_target = x_target + self.bert_proj(bert_feature[:, :, prefix_len:].transpose(1, 2))
+        position = self.ar_text_position
+        pe = position.pe[:, prefix_len:prefix_len + x_target.shape[1]].to(dtype=x_target.dtype, device=x_target.device)
+        x_target = position.dropout(x_target * position.x_scale + position.alpha * pe)
+        return torch.concat([prefix_cache["x"], x_target], dim=1)
+
+    def init_static_kv_cache(self, k_cache:List[torch.Tensor], v_cache:List[torch.Tensor], max_kv_len:int):
+        """把 process_prompt 得到的各层KV拷贝进 [batch, max_kv_len, hidden] 的预分配缓冲区"""
+        k_static = []
+        v_static = []
+        for k, v in zip(k_cache, v_cache):
+            k_buf = k.new_zeros((k.shape[0], max_kv_len, k.shape[2]))
+            v_buf = v.new_zeros((v.shape[0], max_kv_len, v.shape[2]))
+            k_buf[:, :k.shape[1]] = k
+            v_buf[:, :v.shape[1]] = v
+            k_static.append(k_buf)
+            v_static.append(v_buf)
+        return k_static, v_static
 
     def make_input_data(self, x, x_lens, y, y_lens, bert_feature):
         x = self.ar_text_embedding(x)
@@ -665,12 +821,24 @@ class Text2SemanticDecoder(nn.Module):
         xy_padding_mask = xy_padding_mask.view(bsz, src_len, 1).expand(-1, -1, self.model_dim)
 
         ###### decode #####
+        static_kv_cache = kwargs.get("static_kv_cache", self.static_kv_cache)
+        max_kv_len = self.get_max_kv_len(src_len, early_stop_num)
+        cache_len = 0
+        # EOS 在设备上用掩码记录（eos_step 为各行首次生成EOS的步数，-1 表示未结束），
+        # 每 eos_check_interval 步才同步一次到CPU并移除已结束的行，避免逐token的设备同步
+        eos_check_interval = max(1, int(kwargs.get("eos_check_interval", 4)))
+        eos_step = torch.full((y.shape[0],), -1, dtype=torch.long, device=y.device)
         y_list = [None]*y.shape[0]
         batch_idx_map = list(range(y.shape[0]))
         idx_list = [None]*y.shape[0]
+        t_start = t_prefill = time.perf_counter()
+        num_tokens = 0
         for idx in tqdm(range(1500)):
             if idx == 0:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, xy_padding_mask, False)
+            elif static_kv_cache:
+                xy_dec = self.t2s_transformer.decode_next_token_static(xy_pos, k_cache, v_cache, cache_len, xy_attn_mask[:, :, :, :cache_len + 1], False)
+                cache_len += 1
             else:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache, xy_attn_mask, False)
             logits = self.ar_predict_layer(
@@ -680,37 +848,50 @@ class Text2SemanticDecoder(nn.Module):
             if idx == 0:
                 xy_attn_mask = F.pad(xy_attn_mask[:,:,-1].unsqueeze(-2),(0,1),value=False)
                 logits = logits[:, :-1]
-            else:
+                if static_kv_cache:
+                    # mask 同样预分配到 max_kv_len，新位置全为 False，解码时按 cache_len 切片
+                    k_cache, v_cache = self.init_static_kv_cache(k_cache, v_cache, max_kv_len)
+                    xy_attn_mask = F.pad(xy_attn_mask, (0, max_kv_len - xy_attn_mask.shape[-1]), value=False)
+                    cache_len = src_len
+            elif not static_kv_cache:
                 xy_attn_mask = F.pad(xy_attn_mask,(0,1),value=False)
 
-            samples = sample(
+            samples = sample_fused(
                     logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
                 )[0]
 
             y = torch.concat([y, samples], dim=1)
+            num_tokens += samples.shape[0]
+            metrics.observe("tts_t2s_batch_size", samples.shape[0])
+            if idx == 0:
+                t_prefill = time.perf_counter()
             
             ####### 移除batch中已经生成完毕的序列,进一步优化计算量
             tokens = torch.argmax(logits, dim=-1)
+            l = (samples[:, 0]==self.EOS).logical_or(tokens==self.EOS)  ###如果生成到EOS，则停止
+            eos_step.masked_fill_(l.logical_and(eos_step < 0), idx)
+
+            early_stop = (early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num) or idx==1499
             reserved_idx_of_batch_for_y = None
-            if (self.EOS in samples[:, 0]) or \
-                (self.EOS in tokens):  ###如果生成到EOS，则停止
-                    l1 = samples[:, 0]==self.EOS
-                    l2 = tokens==self.EOS
-                    l = l1.logical_or(l2)
-                    removed_idx_of_batch_for_y = torch.where(l==True)[0].tolist()
-                    reserved_idx_of_batch_for_y = torch.where(l==False)[0]
-                    # batch_indexs = torch.tensor(batch_idx_map, device=y.device)[removed_idx_of_batch_for_y]
+            if (idx + 1) % eos_check_interval == 0 or early_stop:
+                eos_step_list = eos_step.tolist()
+                removed_idx_of_batch_for_y = [i for i, step in enumerate(eos_step_list) if step >= 0]
+                if len(removed_idx_of_batch_for_y) > 0:
+                    # 已结束的行在检查前可能多解码了几步，按各自的EOS步数截断
                     for i in removed_idx_of_batch_for_y:
                         batch_index = batch_idx_map[i]
-                        idx_list[batch_index] = idx - 1
-                        y_list[batch_index] = y[i, :-1]
-                
-                    batch_idx_map = [batch_idx_map[i] for i in reserved_idx_of_batch_for_y.tolist()]
+                        idx_list[batch_index] = eos_step_list[i] - 1
+                        y_list[batch_index] = y[i, :prefix_len + eos_step_list[i]]
+
+                    reserved = [i for i, step in enumerate(eos_step_list) if step < 0]
+                    reserved_idx_of_batch_for_y = torch.LongTensor(reserved).to(y.device)
+                    batch_idx_map = [batch_idx_map[i] for i in reserved]
                 
             # 只保留batch中未生成完毕的序列 
             if reserved_idx_of_batch_for_y is not None:
                 # index = torch.LongTensor(batch_idx_map).to(y.device)
                 y = torch.index_select(y, dim=0, index=reserved_idx_of_batch_for_y)
+                eos_step = torch.index_select(eos_step, dim=0, index=reserved_idx_of_batch_for_y)
                 xy_attn_mask = torch.index_select(xy_attn_mask, dim=0, index=reserved_idx_of_batch_for_y)
                 if k_cache is not None :
                     for i in range(len(k_cache)):
@@ -718,7 +899,7 @@ class Text2SemanticDecoder(nn.Module):
                         v_cache[i] = torch.index_select(v_cache[i], dim=0, index=reserved_idx_of_batch_for_y)
                 
                 
-            if (early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num) or idx==1499:
+            if early_stop:
                 print("use early stop num:", early_stop_num)
                 stop = True
                 for i, batch_index in enumerate(batch_idx_map):
@@ -740,6 +921,8 @@ class Text2SemanticDecoder(nn.Module):
             y_emb = self.ar_audio_embedding(y[:, -1:])
             xy_pos = y_emb * self.ar_audio_position.x_scale + self.ar_audio_position.alpha * self.ar_audio_position.pe[:, y_len + idx].to( dtype= y_emb.dtype,device=y_emb.device)            
 
+        record_t2s(t_prefill - t_start, time.perf_counter() - t_prefill, idx, num_tokens)
+
         if (None in idx_list):
             for i in range(x.shape[0]):
                 if idx_list[i] is None:
@@ -793,9 +976,42 @@ class Text2SemanticDecoder(nn.Module):
         repetition_penalty: float = 1.35,
         **kwargs
     ):
-        x = self.ar_text_embedding(x)
-        x = x + self.bert_proj(bert_feature.transpose(1, 2))
-        x = self.ar_text_position(x)
+        stream = self.infer_panel_naive_stream(
+            x, x_lens, prompts, bert_feature, top_k, top_p, early_stop_num, temperature, repetition_penalty, **kwargs
+        )
+        while True:
+            try:
+                next(stream)
+            except StopIteration as result:
+                return result.value
+
+    def infer_panel_naive_stream(
+        self,
+        x:torch.LongTensor,  #####全部文本token
+        x_lens:torch.LongTensor,
+        prompts:torch.LongTensor,  ####参考音频token
+        bert_feature:torch.LongTensor,
+        top_k: int = -100,
+        top_p: int = 100,
+        early_stop_num: int = -1,
+        temperature: float = 1.0,
+        repetition_penalty: float = 1.35,
+        **kwargs
+    ):
+        """
+        Generator form of infer_panel_naive for one sequence. Yields each semantic token
+        ([1, 1]) that ends up in the returned idx slice as soon as it is sampled, and
+        returns (y, idx) like infer_panel_naive when decoding stops.
+        """
+        # 同一音色的参考部分嵌入可由 get_prefix_cache 预先算好传入
+        prefix_cache = kwargs.get("prefix_cache", None)
+        if prefix_cache is not None and prompts is not None:
+            x = self.embed_with_prefix(x, bert_feature, prefix_cache)
+        else:
+            prefix_cache = None
+            x = self.ar_text_embedding(x)
+            x = x + self.bert_proj(bert_feature.transpose(1, 2))
+            x = self.ar_text_position(x)
 
         # AR Decoder
         y = prompts
@@ -809,10 +1025,14 @@ class Text2SemanticDecoder(nn.Module):
         v_cache = None
         ###################  first step ##########################
         if y is not None:
-            y_emb = self.ar_audio_embedding(y)
-            y_len = y_emb.shape[1]
+            if prefix_cache is not None:
+                y_pos = prefix_cache["y_pos"]
+                y_len = y_pos.shape[1]
+            else:
+                y_emb = self.ar_audio_embedding(y)
+                y_len = y_emb.shape[1]
+                y_pos = self.ar_audio_position(y_emb)
             prefix_len = y.shape[1]
-            y_pos = self.ar_audio_position(y_emb)
             xy_pos = torch.concat([x, y_pos], dim=1)
             ref_free = False
         else:
@@ -842,9 +1062,19 @@ class Text2SemanticDecoder(nn.Module):
                                                 .view(bsz, self.num_head, src_len, src_len)\
                                                 .to(device=x.device, dtype=torch.bool)
 
+        static_kv_cache = kwargs.get("static_kv_cache", self.static_kv_cache)
+        max_kv_len = self.get_max_kv_len(src_len, early_stop_num)
+        cache_len = 0
+        t_start = t_prefill = time.perf_counter()
         for idx in tqdm(range(1500)):
             if xy_attn_mask is not None:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+                if static_kv_cache:
+                    k_cache, v_cache = self.init_static_kv_cache(k_cache, v_cache, max_kv_len)
+                    cache_len = src_len
+            elif static_kv_cache:
+                xy_dec = self.t2s_transformer.decode_next_token_static(xy_pos, k_cache, v_cache, cache_len)
+                cache_len += 1
             else:
                 xy_dec, k_cache, v_cache = self.t2s_transformer.decode_next_token(xy_pos, k_cache, v_cache)
 
@@ -856,11 +1086,13 @@ class Text2SemanticDecoder(nn.Module):
                 xy_attn_mask = None
                 logits = logits[:, :-1]
 
-            samples = sample(
+            samples = sample_fused(
                 logits, y, top_k=top_k, top_p=top_p, repetition_penalty=repetition_penalty, temperature=temperature
             )[0]
 
             y = torch.concat([y, samples], dim=1)
+            if idx == 0:
+                t_prefill = time.perf_counter()
 
             if early_stop_num != -1 and (y.shape[1] - prefix_len) > early_stop_num:
                 print("use early stop num:", early_stop_num)
@@ -875,10 +1107,16 @@ class Text2SemanticDecoder(nn.Module):
                 print(f"T2S Decoding EOS [{prefix_len} -> {y.shape[1]}]")
                 break
 
+            # 有参考时返回的 y[-(idx-1):] 不含第一步采样的token, 流式输出与之保持一致
+            if ref_free or idx > 0:
+                yield samples
+
             ####################### update next step ###################################
             y_emb = self.ar_audio_embedding(y[:, -1:])
             xy_pos = y_emb * self.ar_audio_position.x_scale + self.ar_audio_position.alpha * self.ar_audio_position.pe[:, y_len + idx].to(dtype=y_emb.dtype,device=y_emb.device)
 
+        record_t2s(t_prefill - t_start, time.perf_counter() - t_prefill, idx, (y.shape[1] - prefix_len) * y.shape[0])
+
         if ref_free:
             return y[:, :-1], 0
         return y[:, :-1], idx - 1
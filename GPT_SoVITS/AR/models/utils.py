@@ -161,6 +161,50 @@ def sample(
     idx_next = multinomial_sample_one_no_sync(probs)
     return idx_next, probs
 
+def sample_fused(
+    logits,
+    previous_tokens: Optional[torch.Tensor] = None,
+    temperature: float = 1.0,
+    top_k: Optional[int] = None,
+    top_p: Optional[int] = None,
+    repetition_penalty: float = 1.0,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    # Batched repetition penalty + top-k + top-p + temperature in one pass over the
+    # top-k candidates only. top-p is evaluated on the k largest logits normalized by
+    # the full-vocabulary logsumexp, which gives the same cumulative probabilities as
+    # sorting the whole vocabulary. Falls back to `sample` when top-k is disabled.
+    if top_k is None or top_k <= 0 or top_k >= logits.size(-1):
+        return sample(
+            logits,
+            previous_tokens,
+            temperature=temperature,
+            top_k=None,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+        )
+
+    if previous_tokens is not None and repetition_penalty != 1.0:
+        previous_tokens = previous_tokens.long()
+        score = torch.gather(logits, dim=1, index=previous_tokens)
+        score = torch.where(
+            score < 0, score * repetition_penalty, score / repetition_penalty
+        )
+        logits.scatter_(dim=1, index=previous_tokens, src=score)
+
+    values, indices = torch.topk(logits, top_k)
+    if top_p is not None and top_p < 1.0:
+        cum_probs = torch.cumsum(
+            torch.exp(values - torch.logsumexp(logits, dim=-1, keepdim=True)), dim=-1
+        )
+        to_remove = cum_probs > top_p
+        to_remove[:, 0] = False  # keep at least one option
+        values = values.masked_fill(to_remove, -float("Inf"))
+
+    probs = torch.nn.functional.softmax(values / max(temperature, 1e-5), dim=-1)
+    choice = multinomial_sample_one_no_sync(probs)
+    idx_next = torch.gather(indices, dim=1, index=choice.long()).to(dtype=torch.int)
+    return idx_next, probs
+
 def dpo_loss(policy_chosen_logps: torch.FloatTensor,
              policy_rejected_logps: torch.FloatTensor,
              reference_chosen_logps: torch.FloatTensor,
@@ -0,0 +1,369 @@
+# ONNX Runtime 推理后端: T2S 和 VITS 运行 onnx_export.py 导出的图，BERT 和 CNHuBERT 仍然用 PyTorch
+import hashlib
+import json
+import os
+import traceback
+from time import time as ttime
+from typing import Dict, List
+
+import numpy as np
+import onnxruntime as ort
+import torch
+
+from .TTS import TTS, i18n
+from .text_segmentation_method import splits
+from tts_metrics import metrics, record_synthesis, record_t2s
+
+ONNX_PARTS = ["t2s_encoder", "t2s_fsdec", "t2s_sdec", "vits"]
+# 与 onnx_export.T2SModel.forward 的解码上限一致
+MAX_DECODE_STEPS = 1500
+
+
+def _optimized_model_path(model_path:str, providers:List[str], cache_dir:str)->str:
+    # 优化后的图与硬件和 ORT 版本相关，模型文件变化或换了 provider 都要重新优化
+    stat = os.stat(model_path)
+    key = "|".join([os.path.abspath(model_path), str(stat.st_size), str(stat.st_mtime_ns),
+                    ort.__version__, ",".join(providers)])
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f"{name}.{digest}.onnx")
+
+
+def create_session(model_path:str, providers:List[str], intra_op_threads:int=0,
+                   inter_op_threads:int=0, cache_dir:str=None)->ort.InferenceSession:
+    """
+    InferenceSession of model_path with the given thread pools. With a cache_dir, the
+    graph optimized for these providers is written there on the first load and later
+    loads read it back with optimizations disabled, skipping the optimization passes.
+    """
+    sess_options = ort.SessionOptions()
+    sess_options.intra_op_num_threads = intra_op_threads
+    sess_options.inter_op_num_threads = inter_op_threads
+    if inter_op_threads > 1:
+        sess_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if cache_dir in [None, ""]:
+        return ort.InferenceSession(model_path, sess_options, providers=providers)
+
+    cached_path = _optimized_model_path(model_path, providers, cache_dir)
+    if os.path.exists(cached_path):
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            return ort.InferenceSession(cached_path, sess_options, providers=providers)
+        except Exception as e:
+            print(f"Error loading optimized ONNX model {cached_path}, optimizing again: {e}")
+            sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # 先写临时文件，进程中断不会留下半个模型
+    tmp_path = cached_path + ".tmp.onnx"
+    sess_options.optimized_model_filepath = tmp_path
+    session = ort.InferenceSession(model_path, sess_options, providers=providers)
+    if os.path.exists(tmp_path):
+        os.replace(tmp_path, cached_path)
+        print(f"Saved optimized ONNX model to {cached_path}")
+    return session
+
+
+class OnnxTTS(TTS):
+    """
+    TTS pipeline running the T2S encoder, first-stage decoder, stage decoder and VITS
+    graphs exported by onnx_export.py on ONNX Runtime, with the same run(inputs)
+    interface as TTS. BERT and CNHuBERT features still come from PyTorch.
+
+    The graphs are batch 1 and sample inside the stage decoder with the top_k and
+    repetition penalty fixed at export, so segments are decoded one by one and the
+    sampling and speed inputs of run are ignored. With ort_io_binding the KV cache
+    stays in ORT-owned buffers between decode steps instead of round-tripping
+    through numpy.
+    """
+
+    def __init__(self, configs):
+        self.sessions:Dict[str, ort.InferenceSession] = {}
+        self.onnx_conf:dict = None
+        super().__init__(configs)
+        # 导出的图都是fp32
+        self.precision = torch.float32
+        self.prompt_cache["ssl_content"] = None
+        self.prompt_cache["ref_audio"] = None
+
+    def _init_models(self,):
+        self.init_onnx_sessions(self.configs.onnx_dir)
+        self.init_bert_weights(self.configs.bert_base_path)
+        self.init_cnhuhbert_weights(self.configs.cnhuhbert_base_path)
+
+    def init_onnx_sessions(self, onnx_dir:str):
+        if onnx_dir in [None, ""] or not os.path.isdir(onnx_dir):
+            raise FileNotFoundError(f"onnx_dir {onnx_dir} not found, export the model with GPT_SoVITS/onnx_export.py first")
+        name = os.path.basename(os.path.normpath(onnx_dir))
+        conf_path = os.path.join(onnx_dir, f"{name}_infer.json")
+        if not os.path.exists(conf_path):
+            raise FileNotFoundError(f"{conf_path} not found, re-export the model with GPT_SoVITS/onnx_export.py")
+        print(f"Loading ONNX models from {onnx_dir}")
+        with open(conf_path, "r", encoding="utf-8") as f:
+            conf = json.load(f)
+        self.configs.onnx_dir = onnx_dir
+        self.configs.version = conf["version"]
+        self.configs.sampling_rate = conf["sampling_rate"]
+        self.configs.filter_length = conf["filter_length"]
+        self.configs.hop_length = conf["hop_length"]
+        self.configs.win_length = conf["win_length"]
+        self.configs.hz = conf["hz"]
+        self.configs.max_sec = conf["max_sec"]
+        self.configs.save_configs()
+
+        providers = ["CPUExecutionProvider"]
+        self.ort_device = "cpu"
+        if "cuda" in str(self.configs.device):
+            if "CUDAExecutionProvider" in ort.get_available_providers():
+                providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+                self.ort_device = "cuda"
+            else:
+                print("CUDAExecutionProvider is not available, running the ONNX models on CPU")
+        sessions = {}
+        for part in ONNX_PARTS:
+            sessions[part] = create_session(
+                os.path.join(onnx_dir, f"{name}_{part}.onnx"),
+                providers,
+                intra_op_threads=self.configs.ort_intra_op_threads,
+                inter_op_threads=self.configs.ort_inter_op_threads,
+                cache_dir=self.configs.ort_cache_dir,
+            )
+        self.sessions = sessions
+        self.onnx_conf = conf
+
+    def init_t2s_weights(self, weights_path: str):
+        raise ValueError("The onnx backend runs exported graphs, export the weights with onnx_export.py and set onnx_dir")
+
+    def init_vits_weights(self, weights_path: str):
+        raise ValueError("The onnx backend runs exported graphs, export the weights with onnx_export.py and set onnx_dir")
+
+    def set_ref_audio(self, ref_audio_path:str):
+        '''
+            To set the reference audio for the ONNX graphs:
+                the CNHuBERT features for the T2S encoder and the waveform for VITS.
+            Args:
+                ref_audio_path: str, the path of the reference audio.
+        '''
+        with self._prompt_lock:
+            self.prompt_cache["ssl_content"] = self._get_ssl_content(ref_audio_path).float().cpu().numpy()
+            self.prompt_cache["ref_audio"] = self._load_ref_audio(ref_audio_path).numpy()
+            self._set_ref_audio_path(ref_audio_path)
+
+    def _feed(self, array:np.ndarray):
+        array = np.ascontiguousarray(array)
+        if not self.configs.ort_io_binding:
+            return array
+        return ort.OrtValue.ortvalue_from_numpy(array, self.ort_device, 0)
+
+    @staticmethod
+    def _numpy(value)->np.ndarray:
+        return value.numpy() if isinstance(value, ort.OrtValue) else value
+
+    @staticmethod
+    def _shape(value)->list:
+        return value.shape() if isinstance(value, ort.OrtValue) else value.shape
+
+    def _run(self, part:str, inputs:dict)->dict:
+        session = self.sessions[part]
+        output_names = [output.name for output in session.get_outputs()]
+        if not self.configs.ort_io_binding:
+            return dict(zip(output_names, session.run(output_names, inputs)))
+        # 输入直接绑定上一步输出的 OrtValue，输出由ORT在目标设备上分配
+        binding = session.io_binding()
+        for name, value in inputs.items():
+            binding.bind_ortvalue_input(name, value)
+        for name in output_names:
+            binding.bind_output(name, self.ort_device)
+        session.run_with_iobinding(binding)
+        return dict(zip(output_names, binding.get_outputs()))
+
+    def infer_semantic(self, ref_seq, text_seq, ref_bert, text_bert, ssl_content)->np.ndarray:
+        """Semantic tokens [1, 1, T] of one segment, following onnx_export.T2SModel.forward"""
+        t0 = ttime()
+        encoded = self._run("t2s_encoder", {
+            "ref_seq": self._feed(ref_seq),
+            "text_seq": self._feed(text_seq),
+            "ref_bert": self._feed(ref_bert),
+            "text_bert": self._feed(text_bert),
+            "ssl_content": self._feed(ssl_content),
+        })
+        prefix_len = self._shape(encoded["prompts"])[1]
+        state = self._run("t2s_fsdec", {"x": encoded["x"], "prompts": encoded["prompts"]})
+        x_example = state["x_example"]
+        t1 = ttime()
+
+        eos = self.onnx_conf["EOS"]
+        early_stop_num = self.configs.hz * self.configs.max_sec
+        for idx in range(1, MAX_DECODE_STEPS):
+            state = self._run("t2s_sdec", {
+                "iy": state["y"],
+                "ik": state["k"],
+                "iv": state["v"],
+                "iy_emb": state["y_emb"],
+                "ix_example": x_example,
+            })
+            if early_stop_num != -1 and (self._shape(state["y"])[1] - prefix_len) > early_stop_num:
+                break
+            if np.argmax(self._numpy(state["logits"]), axis=-1)[0] == eos or self._numpy(state["samples"])[0, 0] == eos:
+                break
+        y = self._numpy(state["y"]).copy()
+        y[0, -1] = 0
+        record_t2s(t1 - t0, ttime() - t1, idx, idx)
+        return y[:, -idx:][np.newaxis]
+
+    def synthesize_segment(self, phones:list, bert_features:torch.Tensor, prompt_data:dict)->torch.Tensor:
+        ref_seq = np.array([prompt_data["phones"]], dtype=np.int64)
+        text_seq = np.array([phones], dtype=np.int64)
+        ref_bert = prompt_data["bert_features"].float().cpu().numpy().T
+        text_bert = bert_features.float().cpu().numpy().T
+        pred_semantic = self.infer_semantic(ref_seq, text_seq, ref_bert, text_bert, prompt_data["ssl_content"])
+        t0 = ttime()
+        audio = self._run("vits", {
+            "text_seq": self._feed(text_seq),
+            "pred_semantic": self._feed(pred_semantic),
+            "ref_audio": self._feed(prompt_data["ref_audio"]),
+        })["audio"]
+        metrics.observe("tts_stage_seconds", ttime() - t0, stage="vits_decode")
+        return torch.from_numpy(self._numpy(audio).copy()).to(self.configs.device)
+
+    def _warn_fixed_inputs(self, inputs:dict):
+        fixed = {
+            "top_k": self.onnx_conf["top_k"],
+            "top_p": 1,
+            "temperature": 1,
+            "repetition_penalty": self.onnx_conf.get("repetition_penalty", 1.35),
+            "speed_factor": 1.0,
+            "streaming_decode": False,
+        }
+        ignored = [key for key, value in fixed.items() if key in inputs and inputs[key] != value]
+        if len(ignored) > 0:
+            print(f"The onnx backend fixes sampling at export time, ignoring {', '.join(ignored)} "
+                  f"(exported with top_k={fixed['top_k']}, repetition_penalty={fixed['repetition_penalty']})")
+        if inputs.get("aux_ref_audio_paths"):
+            print("The onnx backend takes a single reference audio, ignoring aux_ref_audio_paths")
+
+    @torch.no_grad()
+    def run(self, inputs:dict):
+        """
+        Text to speech inference on the ONNX graphs.
+
+        Args:
+            inputs (dict): same keys as TTS.run. prompt_text is required, and top_k, top_p,
+                temperature, repetition_penalty, speed_factor, batch_size, parallel_infer and
+                seed have no effect.
+        returns:
+            Tuple[int, np.ndarray]: sampling rate and audio data.
+        """
+        stop_epoch = self._stop_epoch
+        text:str = inputs.get("text", "")
+        text_lang:str = inputs.get("text_lang", "")
+        ref_audio_path:str = inputs.get("ref_audio_path", "")
+        prompt_text:str = inputs.get("prompt_text", "")
+        prompt_lang:str = inputs.get("prompt_lang", "")
+        text_split_method:str = inputs.get("text_split_method", "cut0")
+        return_fragment = inputs.get("return_fragment", False)
+        fragment_interval = inputs.get("fragment_interval", 0.3)
+        self._warn_fixed_inputs(inputs)
+
+        if fragment_interval<0.01:
+            fragment_interval = 0.01
+            print(i18n("分段间隔过小，已自动设置为0.01"))
+
+        # 导出的T2S编码器总是拼接参考文本，没有无参考文本模式
+        if prompt_text in [None, ""]:
+            raise ValueError("prompt_text cannot be empty with the onnx backend")
+        assert text_lang in self.configs.languages
+        assert prompt_lang in self.configs.languages
+
+        t0 = ttime()
+        with self._prompt_lock:
+            if ref_audio_path in [None, ""] and self.prompt_cache["ssl_content"] is None:
+                raise ValueError("ref_audio_path cannot be empty, when the reference audio is not set using set_ref_audio()")
+
+            if (ref_audio_path not in [None, ""]) and (ref_audio_path != self.prompt_cache["ref_audio_path"]):
+                if not os.path.exists(ref_audio_path):
+                    raise ValueError(f"{ref_audio_path} not exists")
+                self.set_ref_audio(ref_audio_path)
+
+            prompt_text = prompt_text.strip("\n")
+            if (prompt_text[-1] not in splits): prompt_text += "。" if prompt_lang != "en" else "."
+            print(i18n("实际输入的参考文本:"), prompt_text)
+            if self.prompt_cache["prompt_text"] != prompt_text:
+                phones, bert_features, norm_text = \
+                    self.text_preprocessor.segment_and_extract_feature_for_text(
+                                                                        prompt_text,
+                                                                        prompt_lang,
+                                                                        self.configs.version)
+                self.prompt_cache["prompt_text"] = prompt_text
+                self.prompt_cache["prompt_lang"] = prompt_lang
+                self.prompt_cache["phones"] = phones
+                self.prompt_cache["bert_features"] = bert_features
+                self.prompt_cache["norm_text"] = norm_text
+            # 本请求用这份副本合成，其他请求随后更换参考音频/文本不会影响它
+            prompt_data = self._snapshot_prompt()
+
+        t1 = ttime()
+        metrics.observe("tts_stage_seconds", t1 - t0, stage="ref_feature")
+        if return_fragment:
+            # 分段返回时逐段提取BERT特征，首段不用等整段文本处理完
+            texts = self.text_preprocessor.pre_seg_text(text, text_lang, text_split_method)
+        else:
+            data = self.text_preprocessor.preprocess(text, text_lang, text_split_method, self.configs.version)
+            texts = [None] * len(data)
+
+        try:
+            print("############ 推理 ############")
+            audio = []
+            for i, segment_text in enumerate(texts):
+                t2 = ttime()
+                if return_fragment:
+                    phones, bert_features, norm_text = self.text_preprocessor.segment_and_extract_feature_for_text(
+                        segment_text, text_lang, self.configs.version)
+                    if phones is None:
+                        continue
+                else:
+                    phones, bert_features, norm_text = data[i]["phones"], data[i]["bert_features"], data[i]["norm_text"]
+                print(i18n("前端处理后的文本(每句):"), norm_text)
+                audio_fragment = self.synthesize_segment(phones, bert_features, prompt_data)
+
+                if return_fragment:
+                    sr, fragment = self.audio_postprocess([[audio_fragment]],
+                                                    self.configs.sampling_rate,
+                                                    None,
+                                                    1.0,
+                                                    False,
+                                                    fragment_interval
+                                                    )
+                    record_synthesis(ttime() - t2, fragment.shape[0] / sr)
+                    yield sr, fragment
+                else:
+                    audio.append([audio_fragment])
+
+                if self._stop_epoch != stop_epoch:
+                    yield self.configs.sampling_rate, np.zeros(int(self.configs.sampling_rate),
+                                                            dtype=np.int16)
+                    return
+
+            if not return_fragment:
+                if len(audio) == 0:
+                    yield self.configs.sampling_rate, np.zeros(int(self.configs.sampling_rate),
+                                                                dtype=np.int16)
+                    return
+                sr, audio = self.audio_postprocess(audio,
+                                                self.configs.sampling_rate,
+                                                None,
+                                                1.0,
+                                                False,
+                                                fragment_interval
+                                                )
+                record_synthesis(ttime() - t0, audio.shape[0] / sr)
+                yield sr, audio
+
+        except Exception as e:
+            traceback.print_exc()
+            yield self.configs.sampling_rate, np.zeros(int(self.configs.sampling_rate),
+                                                            dtype=np.int16)
+            raise e
+        finally:
+            self.empty_cache()
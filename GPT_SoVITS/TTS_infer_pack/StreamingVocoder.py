@@ -0,0 +1,80 @@
+# 流式声码: T2S 每生成一段语义token就解码出对应的音频，首段音频的延迟由块大小决定，而不是整句长度
+import math
+from typing import List
+
+import torch
+
+
+class StreamingVocoder:
+    """
+    Incremental SoVITS decode of one segment's semantic tokens.
+
+    Tokens are pushed as the T2S decoder samples them. Once chunk_size tokens plus
+    overlap and lookahead tokens are available, a window of left_context already
+    emitted tokens, the chunk, the overlap and the lookahead is decoded and the audio
+    of the chunk is returned. The overlap audio is held back and cross-faded into the
+    start of the next chunk, so the seam between windows decoded with different
+    context and noise stays inaudible. Lookahead tokens only provide right context
+    and are decoded again as part of the next chunk.
+
+    Only speed 1.0 is supported: the token to sample mapping must be exact.
+    """
+
+    def __init__(self, vits_model, phones:torch.LongTensor, refer_spec:List[torch.Tensor],
+                 chunk_size:int=20, lookahead:int=6, overlap:int=2, left_context:int=20):
+        self.vits_model = vits_model
+        self.phones = phones
+        self.refer_spec = refer_spec
+        # 音色embedding每个窗口都一样，只算一次
+        self.ge = vits_model.get_ge(refer_spec)
+        self.chunk_size = max(1, int(chunk_size))
+        self.lookahead = max(0, int(lookahead))
+        self.overlap = max(0, int(overlap))
+        self.left_context = max(0, int(left_context))
+        upsample_rate = math.prod(vits_model.upsample_rates)
+        self.samples_per_token = upsample_rate * 2 if vits_model.semantic_frame_rate == "25hz" else upsample_rate
+        self.tokens:List[torch.Tensor] = []
+        self.emitted:int = 0
+        self.tail:torch.Tensor = None
+
+    def push(self, token:torch.Tensor)->List[torch.Tensor]:
+        """Add a newly sampled token, returning the audio chunks that became ready"""
+        self.tokens.append(token.reshape(-1))
+        chunks = []
+        while len(self.tokens) - self.emitted >= self.chunk_size + self.overlap + self.lookahead:
+            chunks.append(self._decode(self.emitted + self.chunk_size, final=False))
+        return chunks
+
+    def flush(self)->List[torch.Tensor]:
+        """Audio of every token not emitted yet, called once the segment has finished decoding"""
+        if len(self.tokens) <= self.emitted:
+            return []
+        return [self._decode(len(self.tokens), final=True)]
+
+    def _decode(self, end:int, final:bool)->torch.Tensor:
+        start = self.emitted
+        win_start = max(0, start - self.left_context)
+        win_end = len(self.tokens) if final else end + self.overlap + self.lookahead
+        codes = torch.cat(self.tokens[win_start:win_end]).view(1, 1, -1)
+        audio = self.vits_model.decode(codes, self.phones, self.refer_spec, ge=self.ge).detach()[0, 0, :]
+
+        out_end = end if final else end + self.overlap
+        audio = audio[(start - win_start) * self.samples_per_token:(out_end - win_start) * self.samples_per_token]
+        if self.tail is not None:
+            audio = self._cross_fade(self.tail, audio)
+        if final:
+            chunk, self.tail = audio, None
+        else:
+            keep = (end - start) * self.samples_per_token
+            chunk, self.tail = audio[:keep], audio[keep:]
+            if self.tail.shape[0] == 0:
+                self.tail = None
+        self.emitted = end
+        return chunk
+
+    @staticmethod
+    def _cross_fade(tail:torch.Tensor, audio:torch.Tensor)->torch.Tensor:
+        length = min(tail.shape[0], audio.shape[0])
+        fade_in = torch.linspace(0, 1, length, dtype=audio.dtype, device=audio.device)
+        head = tail[:length] * (1 - fade_in) + audio[:length] * fade_in
+        return torch.cat([head, audio[length:]])
@@ -0,0 +1,326 @@
+import time
+import threading
+import traceback
+from concurrent.futures import Future
+from typing import List, Optional
+
+import torch
+import torch.nn.functional as F
+
+from AR.models.utils import sample_fused
+from tts_metrics import metrics
+
+
+class T2SRequest:
+    '''
+        One text segment waiting for, or taking part in, continuous-batched T2S decoding.
+    '''
+    def __init__(self, x:torch.LongTensor, bert_feature:torch.Tensor, prompt:Optional[torch.LongTensor],
+                 top_k:int, top_p:float, temperature:float, repetition_penalty:float, early_stop_num:int):
+        self.x = x
+        self.bert_feature = bert_feature
+        self.prompt = prompt
+        self.top_k = top_k
+        self.top_p = top_p
+        self.temperature = temperature
+        self.repetition_penalty = repetition_penalty
+        self.early_stop_num = early_stop_num
+        self.future:Future = Future()
+
+        # decoding state, set by the scheduler at prefill
+        self.y:torch.Tensor = None
+        self.prefix_len:int = 0
+        self.y_len:int = 0
+        self.pos:int = 0
+        self.step:int = 0
+
+
+class T2SScheduler:
+    '''
+        Continuous batching for the Text2SemanticDecoder across concurrent TTS.run calls.
+
+        A single worker thread owns the decode loop. Segments submitted by any
+        request are prefilled and joined into the running batch between two
+        decode steps, and a row that reaches EOS (or early_stop_num) leaves the
+        batch immediately and resolves its Future, so results go straight back
+        to the generator that submitted them.
+    '''
+    def __init__(self, model, max_batch_size:int=16, max_steps:int=1500):
+        # model: Text2SemanticDecoder
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_steps = max_steps
+        self.pending:List[T2SRequest] = []
+        self.cond = threading.Condition()
+        self.closed = False
+        self.worker:threading.Thread = None
+
+    def submit(self, x:torch.LongTensor, bert_feature:torch.Tensor, prompt:Optional[torch.LongTensor]=None,
+               top_k:int=-100, top_p:float=100, temperature:float=1.0,
+               repetition_penalty:float=1.35, early_stop_num:int=-1)->Future:
+        '''
+            Queue one segment for decoding.
+            Args:
+                x: LongTensor [L], phoneme ids of the prompt text and the target text.
+                bert_feature: Tensor [1024, L].
+                prompt: LongTensor [P], semantic tokens of the reference audio, or None.
+            Returns:
+                Future resolving to (pred_semantic, idx), like one row of infer_panel_batch_infer.
+        '''
+        request = T2SRequest(x, bert_feature, prompt, top_k, top_p, temperature, repetition_penalty, early_stop_num)
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("T2SScheduler is closed")
+            self.pending.append(request)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._loop, name="t2s-scheduler", daemon=True)
+                self.worker.start()
+            self.cond.notify()
+        return request.future
+
+    def infer_panel(
+        self,
+        x:List[torch.LongTensor],
+        x_lens:torch.LongTensor,
+        prompts:torch.LongTensor,
+        bert_feature:List[torch.Tensor],
+        top_k:int=-100,
+        top_p:int=100,
+        early_stop_num:int=-1,
+        temperature:float=1.0,
+        repetition_penalty:float=1.35,
+        **kwargs
+    ):
+        '''
+            Drop-in replacement for Text2SemanticDecoder.infer_panel_batch_infer:
+            submits every row and blocks until all of them are decoded.
+        '''
+        futures = [
+            self.submit(
+                x[i][:x_lens[i]],
+                bert_feature[i],
+                prompts[i] if prompts is not None else None,
+                top_k=top_k,
+                top_p=top_p,
+                temperature=temperature,
+                repetition_penalty=repetition_penalty,
+                early_stop_num=early_stop_num,
+            )
+            for i in range(len(x))
+        ]
+        results = [future.result() for future in futures]
+        return [item[0] for item in results], [item[1] for item in results]
+
+    def close(self):
+        '''Stop the worker once the running batch and the queue are drained.'''
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def _loop(self):
+        rows:List[T2SRequest] = []
+        k_cache:List[torch.Tensor] = None
+        v_cache:List[torch.Tensor] = None
+        while True:
+            with self.cond:
+                while not rows and not self.pending:
+                    if self.closed:
+                        self.worker = None
+                        return
+                    self.cond.wait()
+                admitted = self.pending[:self.max_batch_size - len(rows)]
+                del self.pending[:len(admitted)]
+
+            try:
+                with torch.no_grad():
+                    ###### 新请求在token边界加入正在解码的batch ######
+                    for request in admitted:
+                        k, v = self._prefill(request)
+                        if request.future.done():
+                            continue
+                        rows.append(request)
+                        k_cache, v_cache = self._join(k_cache, v_cache, k, v)
+
+                    if not rows:
+                        continue
+
+                    finished = self._decode_step(rows, k_cache, v_cache)
+
+                    ###### 生成完毕的行立即移出batch ######
+                    if finished:
+                        keep = [i for i in range(len(rows)) if i not in finished]
+                        rows = [rows[i] for i in keep]
+                        if rows:
+                            index = torch.LongTensor(keep).to(k_cache[0].device)
+                            k_cache = [torch.index_select(item, dim=0, index=index) for item in k_cache]
+                            v_cache = [torch.index_select(item, dim=0, index=index) for item in v_cache]
+                        else:
+                            k_cache = v_cache = None
+            except Exception as e:
+                traceback.print_exc()
+                for request in rows + admitted:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                rows = []
+                k_cache = v_cache = None
+
+    def _prefill(self, request:T2SRequest):
+        '''Run process_prompt for one new segment and sample its first token.'''
+        t_start = time.perf_counter()
+        model = self.model
+        x = model.ar_text_embedding(request.x.unsqueeze(0))
+        x = x + model.bert_proj(request.bert_feature.transpose(0, 1).unsqueeze(0))
+        x = model.ar_text_position(x)
+        x_len = x.shape[1]
+
+        if request.prompt is not None:
+            y = request.prompt.unsqueeze(0)
+            y_emb = model.ar_audio_embedding(y)
+            y_len = y_emb.shape[1]
+            xy_pos = torch.concat([x, model.ar_audio_position(y_emb)], dim=1)
+        else:
+            y = torch.zeros(1, 0, dtype=torch.int, device=x.device)
+            y_len = 0
+            xy_pos = x
+
+        src_len = x_len + y_len
+        x_attn_mask = F.pad(
+            torch.zeros((x_len, x_len), dtype=torch.bool),
+            (0, y_len),
+            value=True,
+        )
+        y_attn_mask = F.pad(
+            torch.triu(torch.ones(y_len, y_len, dtype=torch.bool), diagonal=1),
+            (x_len, 0),
+            value=False,
+        )
+        xy_attn_mask = torch.concat([x_attn_mask, y_attn_mask], dim=0)\
+                                    .unsqueeze(0)\
+                                    .expand(model.num_head, -1, -1)\
+                                    .view(1, model.num_head, src_len, src_len)\
+                                    .to(device=x.device, dtype=torch.bool)
+
+        xy_dec, k_cache, v_cache = model.t2s_transformer.process_prompt(xy_pos, xy_attn_mask, None)
+        logits = model.ar_predict_layer(xy_dec[:, -1])[:, :-1]
+
+        request.y = y
+        request.prefix_len = y.shape[1]
+        request.y_len = y_len
+        request.pos = src_len
+        request.step = 0
+        samples, eos = self._sample([request], logits)
+        self._accept(request, samples, eos[0])
+        prefill_seconds = time.perf_counter() - t_start
+        metrics.observe("tts_stage_seconds", prefill_seconds, stage="t2s_prefill")
+        metrics.inc("tts_t2s_tokens_total")
+        metrics.inc("tts_t2s_seconds_total", prefill_seconds)
+        return k_cache, v_cache
+
+    def _join(self, k_cache, v_cache, k, v):
+        '''Append one prefilled row to the batch KV buffers, padding along the sequence axis.'''
+        if k_cache is None:
+            return k, v
+        capacity = max(k_cache[0].shape[1], k[0].shape[1])
+        k_cache = [torch.cat([F.pad(a, (0, 0, 0, capacity - a.shape[1])), F.pad(b, (0, 0, 0, capacity - b.shape[1]))], dim=0)
+                   for a, b in zip(k_cache, k)]
+        v_cache = [torch.cat([F.pad(a, (0, 0, 0, capacity - a.shape[1])), F.pad(b, (0, 0, 0, capacity - b.shape[1]))], dim=0)
+                   for a, b in zip(v_cache, v)]
+        return k_cache, v_cache
+
+    def _decode_step(self, rows:List[T2SRequest], k_cache:List[torch.Tensor], v_cache:List[torch.Tensor])->List[int]:
+        '''Decode one token for every row; returns the indexes of rows that finished.'''
+        t_start = time.perf_counter()
+        model = self.model
+        device = k_cache[0].device
+
+        kv_len = max(request.pos for request in rows) + 1
+        capacity = k_cache[0].shape[1]
+        if kv_len > capacity:
+            # 容量翻倍，摊销后每个token的扩容拷贝为O(1)
+            grow = max(kv_len, capacity * 2) - capacity
+            for i in range(len(k_cache)):
+                k_cache[i] = F.pad(k_cache[i], (0, 0, 0, grow))
+                v_cache[i] = F.pad(v_cache[i], (0, 0, 0, grow))
+
+        last_tokens = torch.cat([request.y[:, -1:] for request in rows], dim=0)
+        y_emb = model.ar_audio_embedding(last_tokens)
+        pe_index = torch.LongTensor([request.y_len + request.step for request in rows]).to(device)
+        pe = model.ar_audio_position.pe[0, pe_index].unsqueeze(1).to(dtype=y_emb.dtype, device=device)
+        xy_pos = y_emb * model.ar_audio_position.x_scale + model.ar_audio_position.alpha * pe
+
+        positions = torch.LongTensor([request.pos for request in rows]).to(device)
+        attn_mask = (torch.arange(kv_len, device=device).unsqueeze(0) > positions.unsqueeze(1))\
+                        .view(len(rows), 1, 1, kv_len)\
+                        .expand(-1, model.num_head, -1, -1)
+
+        xy_dec = model.t2s_transformer.decode_next_token_indexed(xy_pos, k_cache, v_cache, positions, kv_len, attn_mask)
+        logits = model.ar_predict_layer(xy_dec[:, -1])
+
+        samples, eos = self._sample(rows, logits)
+
+        finished = []
+        for i, request in enumerate(rows):
+            request.pos += 1
+            request.step += 1
+            if self._accept(request, samples[i:i+1], eos[i]):
+                finished.append(i)
+
+        step_seconds = time.perf_counter() - t_start
+        metrics.observe("tts_stage_seconds", step_seconds, stage="t2s_decode_token")
+        metrics.observe("tts_t2s_batch_size", len(rows))
+        metrics.inc("tts_t2s_tokens_total", len(rows))
+        metrics.inc("tts_t2s_seconds_total", step_seconds)
+        metrics.set("tts_tokens_per_second", round(len(rows) / step_seconds, 3))
+        return finished
+
+    def _sample(self, rows:List[T2SRequest], logits:torch.Tensor):
+        '''
+            Sample the next token for all rows, batched per group of identical sampling
+            parameters. Returns (samples [B, 1], eos flags); the flags are the only
+            host sync of the step.
+        '''
+        groups = {}
+        for i, request in enumerate(rows):
+            params = (request.top_k, request.top_p, request.temperature, request.repetition_penalty)
+            groups.setdefault(params, []).append(i)
+
+        samples = torch.empty((len(rows), 1), dtype=torch.int, device=logits.device)
+        eos = torch.empty((len(rows),), dtype=torch.bool, device=logits.device)
+        for (top_k, top_p, temperature, repetition_penalty), index in groups.items():
+            # 各行历史长度不同，用各自最后一个token补齐：重复的位置在重复惩罚里只会被写入相同的值
+            max_len = max(rows[i].y.shape[1] for i in index)
+            previous_tokens = torch.cat([
+                torch.cat([rows[i].y, rows[i].y[:, -1:].expand(-1, max_len - rows[i].y.shape[1])], dim=1)
+                if rows[i].y.shape[1] > 0 else rows[i].y
+                for i in index
+            ], dim=0)
+            index_tensor = torch.LongTensor(index).to(logits.device)
+            group_logits = logits[index_tensor]
+            group_samples = sample_fused(
+                group_logits, previous_tokens, top_k=top_k, top_p=top_p,
+                repetition_penalty=repetition_penalty, temperature=temperature
+            )[0]
+            samples[index_tensor] = group_samples
+            eos[index_tensor] = (group_samples[:, 0] == self.model.EOS).logical_or(
+                torch.argmax(group_logits, dim=-1) == self.model.EOS
+            )
+        return samples, eos.tolist()
+
+    def _accept(self, request:T2SRequest, samples:torch.Tensor, eos:bool)->bool:
+        '''Append the sampled token to one row and resolve its Future if it is done.'''
+        request.y = torch.concat([request.y, samples], dim=1)
+
+        idx = None
+        if eos:
+            idx = request.step - 1
+        elif (request.early_stop_num != -1 and (request.y.shape[1] - request.prefix_len) > request.early_stop_num) \
+                or request.step == self.max_steps - 1:
+            idx = request.step
+        if idx is None:
+            return False
+
+        print(f"T2S Decoding EOS [{request.prefix_len} -> {request.y.shape[1]}]")
+        if request.prompt is None:
+            idx = 0
+        request.future.set_result((request.y[0, :-1], idx))
+        return True
@@ -2,6 +2,7 @@ from copy import deepcopy
 import math
 import os, sys, gc
 import random
+import threading
 import traceback
 
 from tqdm import tqdm
@@ -14,11 +15,12 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 import yaml
-from transformers import AutoModelForMaskedLM, AutoTokenizer
+from transformers import AutoTokenizer
 
 from AR.models.t2s_lightning_module import Text2SemanticLightningModule
 from feature_extractor.cnhubert import CNHubert
-from module.models import SynthesizerTrn
+from feature_extractor.bert import BertFeatureExtractor
+from module.models import SynthesizerTrn, load_sovits_for_inference
 import librosa
 from time import time as ttime
 from tools.i18n.i18n import I18nAuto, scan_language_list
@@ -26,6 +28,10 @@ from tools.my_utils import load_audio
 from module.mel_processing import spectrogram_torch
 from TTS_infer_pack.text_segmentation_method import splits
 from TTS_infer_pack.TextPreprocessor import TextPreprocessor
+from TTS_infer_pack.T2SScheduler import T2SScheduler
+from TTS_infer_pack.StreamingVocoder import StreamingVocoder
+from tts_metrics import metrics, record_synthesis
+from int8_quantization import use_int8, quantize_linear_int8, quantize_t2s_int8
 language=os.environ.get("language","Auto")
 language=sys.argv[-1] if sys.argv[-1] in scan_language_list() else language
 i18n = I18nAuto(language=language)
@@ -151,6 +157,18 @@ class TTS_Config:
         self.vits_weights_path = self.configs.get("vits_weights_path", None)
         self.bert_base_path = self.configs.get("bert_base_path", None)
         self.cnhuhbert_base_path = self.configs.get("cnhuhbert_base_path", None)
+        # 跨请求的T2S连续批处理，见 TTS_infer_pack/T2SScheduler.py
+        self.continuous_batching = self.configs.get("continuous_batching", False)
+        self.max_batch_size = self.configs.get("max_batch_size", 16)
+        # CPU上的精度: fp32 或 int8（T2S、BERT、CNHuBERT的Linear做动态量化），见 int8_quantization.py
+        self.cpu_precision = self.configs.get("cpu_precision", "fp32")
+        # 推理后端: torch 或 onnx（T2S和VITS由onnx_export.py导出的图在ONNX Runtime上运行），见 TTS_infer_pack/OnnxTTS.py
+        self.backend = self.configs.get("backend", "torch")
+        self.onnx_dir = self.configs.get("onnx_dir", None)
+        self.ort_intra_op_threads = self.configs.get("ort_intra_op_threads", 0)
+        self.ort_inter_op_threads = self.configs.get("ort_inter_op_threads", 0)
+        self.ort_io_binding = self.configs.get("ort_io_binding", True)
+        self.ort_cache_dir = self.configs.get("ort_cache_dir", "GPT_SoVITS/configs/ort_cache")
         self.languages = self.v2_languages if self.version=="v2" else self.v1_languages
 
         
@@ -206,6 +224,15 @@ class TTS_Config:
             "vits_weights_path"  : self.vits_weights_path,
             "bert_base_path"     : self.bert_base_path,
             "cnhuhbert_base_path": self.cnhuhbert_base_path,
+            "continuous_batching": self.continuous_batching,
+            "max_batch_size"     : self.max_batch_size,
+            "cpu_precision"      : self.cpu_precision,
+            "backend"            : self.backend,
+            "onnx_dir"           : self.onnx_dir,
+            "ort_intra_op_threads": self.ort_intra_op_threads,
+            "ort_inter_op_threads": self.ort_inter_op_threads,
+            "ort_io_binding"     : self.ort_io_binding,
+            "ort_cache_dir"      : self.ort_cache_dir,
         }
         return self.config
             
@@ -235,9 +262,10 @@ class TTS:
             self.configs:TTS_Config = TTS_Config(configs)
         
         self.t2s_model:Text2SemanticLightningModule = None
+        self.t2s_scheduler:T2SScheduler = None
         self.vits_model:SynthesizerTrn = None
         self.bert_tokenizer:AutoTokenizer = None
-        self.bert_model:AutoModelForMaskedLM = None
+        self.bert_model:BertFeatureExtractor = None
         self.cnhuhbert_model:CNHubert = None
         
         self._init_models()
@@ -261,7 +289,12 @@ class TTS:
         }
         
         
-        self.stop_flag:bool = False
+        # 多个请求可能在线程池里并发执行 run: 参考音频/参考文本的设置串行进行，
+        # 每个请求解码时用自己的一份 prompt_cache 副本; stop() 只停止调用时已开始的请求
+        self._prompt_lock = threading.RLock()
+        self._stop_epoch:int = 0
+        self._runs_lock = threading.Lock()
+        self._active_runs:int = 0
         self.precision:torch.dtype = torch.float16 if self.configs.is_half else torch.float32
 
     def _init_models(self,):
@@ -280,17 +313,21 @@ class TTS:
         self.cnhuhbert_model = self.cnhuhbert_model.to(self.configs.device)
         if self.configs.is_half and str(self.configs.device)!="cpu":
             self.cnhuhbert_model = self.cnhuhbert_model.half()
+        elif use_int8(self.configs.cpu_precision, self.configs.device):
+            self.cnhuhbert_model = quantize_linear_int8(self.cnhuhbert_model)
         
         
         
     def init_bert_weights(self, base_path: str):
         print(f"Loading BERT weights from {base_path}")
         self.bert_tokenizer = AutoTokenizer.from_pretrained(base_path)
-        self.bert_model = AutoModelForMaskedLM.from_pretrained(base_path)
+        self.bert_model = BertFeatureExtractor(base_path)
         self.bert_model=self.bert_model.eval()
         self.bert_model = self.bert_model.to(self.configs.device)
         if self.configs.is_half and str(self.configs.device)!="cpu":
             self.bert_model = self.bert_model.half()
+        elif use_int8(self.configs.cpu_precision, self.configs.device):
+            self.bert_model = quantize_linear_int8(self.bert_model)
         
     def init_vits_weights(self, weights_path: str):
         print(f"Loading VITS weights from {weights_path}")
@@ -311,19 +348,15 @@ class TTS:
         self.configs.n_speakers = hps["data"]["n_speakers"]
         self.configs.semantic_frame_rate = "25hz"
         kwargs = hps["model"]
-        vits_model = SynthesizerTrn(
+        # 推理形态: 去掉enc_q, weight norm折叠进权重; 导出的推理权重可直接加载
+        vits_model = load_sovits_for_inference(
+            dict_s2,
             self.configs.filter_length // 2 + 1,
             self.configs.segment_size // self.configs.hop_length,
             n_speakers=self.configs.n_speakers,
             **kwargs
         )
-
-        if hasattr(vits_model, "enc_q"):
-            del vits_model.enc_q
-            
         vits_model = vits_model.to(self.configs.device)
-        vits_model = vits_model.eval()
-        vits_model.load_state_dict(dict_s2["weight"], strict=False)
         self.vits_model = vits_model
         if self.configs.is_half and str(self.configs.device)!="cpu":
             self.vits_model = self.vits_model.half()
@@ -344,6 +377,13 @@ class TTS:
         self.t2s_model = t2s_model
         if self.configs.is_half and str(self.configs.device)!="cpu":
             self.t2s_model = self.t2s_model.half()
+        elif use_int8(self.configs.cpu_precision, self.configs.device):
+            self.t2s_model = quantize_t2s_int8(self.t2s_model)
+        if self.t2s_scheduler is not None:
+            self.t2s_scheduler.close()
+            self.t2s_scheduler = None
+        if self.configs.continuous_batching:
+            self.t2s_scheduler = T2SScheduler(self.t2s_model.model, self.configs.max_batch_size)
         
     def enable_half_precision(self, enable: bool = True, save: bool = True):
         '''
@@ -404,9 +444,10 @@ class TTS:
             Args:
                 ref_audio_path: str, the path of the reference audio.
         '''
-        self._set_prompt_semantic(ref_audio_path)
-        self._set_ref_spec(ref_audio_path)
-        self._set_ref_audio_path(ref_audio_path)
+        with self._prompt_lock:
+            self._set_prompt_semantic(ref_audio_path)
+            self._set_ref_spec(ref_audio_path)
+            self._set_ref_audio_path(ref_audio_path)
         
     def _set_ref_audio_path(self, ref_audio_path):
         self.prompt_cache["ref_audio_path"] = ref_audio_path 
@@ -418,13 +459,15 @@ class TTS:
         else:
             self.prompt_cache["refer_spec"][0] = spec
 
-    def _get_ref_spec(self, ref_audio_path):
+    def _load_ref_audio(self, ref_audio_path):
         audio = load_audio(ref_audio_path, int(self.configs.sampling_rate))
         audio = torch.FloatTensor(audio)
         maxx=audio.abs().max()
         if(maxx>1):audio/=min(2,maxx)
-        audio_norm = audio
-        audio_norm = audio_norm.unsqueeze(0)
+        return audio.unsqueeze(0)
+
+    def _get_ref_spec(self, ref_audio_path):
+        audio_norm = self._load_ref_audio(ref_audio_path)
         spec = spectrogram_torch(
             audio_norm,
             self.configs.filter_length,
@@ -439,6 +482,14 @@ class TTS:
         return spec
 
     def _set_prompt_semantic(self, ref_wav_path:str):
+        with torch.no_grad():
+            hubert_feature = self._get_ssl_content(ref_wav_path)
+            codes = self.vits_model.extract_latent(hubert_feature)
+    
+            prompt_semantic = codes[0, 0].to(self.configs.device)
+            self.prompt_cache["prompt_semantic"] = prompt_semantic
+
+    def _get_ssl_content(self, ref_wav_path:str):
         zero_wav = np.zeros(
             int(self.configs.sampling_rate * 0.3),
             dtype=np.float16 if self.configs.is_half else np.float32,
@@ -461,10 +512,7 @@ class TTS:
             ].transpose(
                 1, 2
             )  # .float()
-            codes = self.vits_model.extract_latent(hubert_feature)
-    
-            prompt_semantic = codes[0, 0].to(self.configs.device)
-            self.prompt_cache["prompt_semantic"] = prompt_semantic
+        return hubert_feature
     
     def batch_sequences(self, sequences: List[torch.Tensor], axis: int = 0, pad_value: int = 0, max_length:int=None):
         seq = sequences[0]
@@ -622,9 +670,16 @@ class TTS:
 
     def stop(self,):
         '''
-        Stop the inference process.
+        Stop the inference processes that are running.
         '''
-        self.stop_flag = True
+        self._stop_epoch += 1
+
+    def _snapshot_prompt(self)->dict:
+        '''Copy of prompt_cache for one request; the caller holds _prompt_lock.'''
+        prompt_data = dict(self.prompt_cache)
+        # refer_spec 会被原地修改(_set_ref_spec)，列表也要复制
+        prompt_data["refer_spec"] = list(self.prompt_cache["refer_spec"])
+        return prompt_data
     
     @torch.no_grad()
     def run(self, inputs:dict):
@@ -652,13 +707,17 @@ class TTS:
                     "fragment_interval":0.3,      # float. to control the interval of the audio fragment.
                     "seed": -1,                   # int. random seed for reproducibility.
                     "parallel_infer": True,       # bool. whether to use parallel inference.
-                    "repetition_penalty": 1.35    # float. repetition penalty for T2S model.
+                    "repetition_penalty": 1.35,   # float. repetition penalty for T2S model.
+                    "streaming_decode": False,    # bool. vocode semantic tokens in chunks while the T2S model generates them (implies return_fragment).
+                    "stream_chunk_size": 20,      # int. semantic tokens per streamed chunk (25 tokens per second).
+                    "stream_lookahead": 6,        # int. future tokens decoded as right context of each chunk.
+                    "stream_overlap": 2,          # int. tokens cross-faded between consecutive chunks.
                 }
         returns:
             Tuple[int, np.ndarray]: sampling rate and audio data.
         """
         ########## variables initialization ###########
-        self.stop_flag:bool = False
+        stop_epoch = self._stop_epoch
         text:str = inputs.get("text", "")
         text_lang:str = inputs.get("text_lang", "")
         ref_audio_path:str = inputs.get("ref_audio_path", "")
@@ -677,16 +736,34 @@ class TTS:
         fragment_interval = inputs.get("fragment_interval", 0.3)
         seed = inputs.get("seed", -1)
         seed = -1 if seed in ["", None] else seed
+        # 随机种子是进程全局的，请求并发执行时指定的seed不保证可复现
         actual_seed = set_seed(seed)
         parallel_infer = inputs.get("parallel_infer", True)
         repetition_penalty = inputs.get("repetition_penalty", 1.35)
+        streaming_decode = inputs.get("streaming_decode", False)
+        stream_kwargs = {
+            "chunk_size": inputs.get("stream_chunk_size", 20),
+            "lookahead": inputs.get("stream_lookahead", 6),
+            "overlap": inputs.get("stream_overlap", 2),
+        }
 
-        if parallel_infer:
+        # 选用的推理函数放在局部变量里，而不是改写模型属性，多个请求并发执行 run 时互不干扰
+        if parallel_infer and self.t2s_scheduler is not None:
             print(i18n("并行推理模式已开启"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_batch_infer
+            infer_panel = self.t2s_scheduler.infer_panel
+        elif parallel_infer:
+            print(i18n("并行推理模式已开启"))
+            infer_panel = self.t2s_model.model.infer_panel_batch_infer
         else:
             print(i18n("并行推理模式已关闭"))
-            self.t2s_model.model.infer_panel = self.t2s_model.model.infer_panel_naive_batched
+            infer_panel = self.t2s_model.model.infer_panel_naive_batched
+
+        if streaming_decode and speed_factor != 1.0:
+            streaming_decode = False
+            print(i18n("流式声码不支持语速调节，已自动关闭流式声码"))
+        if streaming_decode:
+            print(i18n("流式声码模式已开启"))
+            return_fragment = True
 
         if return_fragment:
             print(i18n("分段返回模式已开启"))
@@ -714,50 +791,52 @@ class TTS:
         if not no_prompt_text:
             assert prompt_lang in self.configs.languages
 
-        if ref_audio_path in [None, ""] and \
-            ((self.prompt_cache["prompt_semantic"] is None) or (self.prompt_cache["refer_spec"] in [None, []])):
-            raise ValueError("ref_audio_path cannot be empty, when the reference audio is not set using set_ref_audio()")
-
-        ###### setting reference audio and prompt text preprocessing ########
         t0 = ttime()
-        if (ref_audio_path is not None) and (ref_audio_path != self.prompt_cache["ref_audio_path"]):
-            if not os.path.exists(ref_audio_path):
-                raise ValueError(f"{ref_audio_path} not exists")
-            self.set_ref_audio(ref_audio_path)
+        with self._prompt_lock:
+            if ref_audio_path in [None, ""] and \
+                ((self.prompt_cache["prompt_semantic"] is None) or (self.prompt_cache["refer_spec"] in [None, []])):
+                raise ValueError("ref_audio_path cannot be empty, when the reference audio is not set using set_ref_audio()")
+
+            ###### setting reference audio and prompt text preprocessing ########
+            if (ref_audio_path is not None) and (ref_audio_path != self.prompt_cache["ref_audio_path"]):
+                if not os.path.exists(ref_audio_path):
+                    raise ValueError(f"{ref_audio_path} not exists")
+                self.set_ref_audio(ref_audio_path)
             
-        aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
-        paths = set(aux_ref_audio_paths)&set(self.prompt_cache["aux_ref_audio_paths"])
-        if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
-            self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
-            self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
-            for path in aux_ref_audio_paths:
-                if path in [None, ""]:
-                    continue
-                if not os.path.exists(path):
-                    print(i18n("音频文件不存在，跳过：{}").format(path))
-                    continue
-                self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
+            aux_ref_audio_paths = aux_ref_audio_paths if aux_ref_audio_paths is not None else []
+            paths = set(aux_ref_audio_paths)&set(self.prompt_cache["aux_ref_audio_paths"])
+            if not (len(list(paths)) == len(aux_ref_audio_paths) == len(self.prompt_cache["aux_ref_audio_paths"])):
+                self.prompt_cache["aux_ref_audio_paths"] = aux_ref_audio_paths
+                self.prompt_cache["refer_spec"] = [self.prompt_cache["refer_spec"][0]]
+                for path in aux_ref_audio_paths:
+                    if path in [None, ""]:
+                        continue
+                    if not os.path.exists(path):
+                        print(i18n("音频文件不存在，跳过：{}").format(path))
+                        continue
+                    self.prompt_cache["refer_spec"].append(self._get_ref_spec(path))
                 
-        if not no_prompt_text:
-            prompt_text = prompt_text.strip("\n")
-            if (prompt_text[-1] not in splits): prompt_text += "。" if prompt_lang != "en" else "."
-            print(i18n("实际输入的参考文本:"), prompt_text)
-            if self.prompt_cache["prompt_text"] != prompt_text:
-                self.prompt_cache["prompt_text"] = prompt_text
-                self.prompt_cache["prompt_lang"] = prompt_lang
-                phones, bert_features, norm_text = \
-                    self.text_preprocessor.segment_and_extract_feature_for_text(
-                                                                        prompt_text, 
-                                                                        prompt_lang)
-                self.prompt_cache["phones"] = phones
-                self.prompt_cache["bert_features"] = bert_features
-                self.prompt_cache["norm_text"] = norm_text
-
-
+            if not no_prompt_text:
+                prompt_text = prompt_text.strip("\n")
+                if (prompt_text[-1] not in splits): prompt_text += "。" if prompt_lang != "en" else "."
+                print(i18n("实际输入的参考文本:"), prompt_text)
+                if self.prompt_cache["prompt_text"] != prompt_text:
+                    self.prompt_cache["prompt_text"] = prompt_text
+                    self.prompt_cache["prompt_lang"] = prompt_lang
+                    phones, bert_features, norm_text = \
+                        self.text_preprocessor.segment_and_extract_feature_for_text(
+                                                                            prompt_text, 
+                                                                            prompt_lang)
+                    self.prompt_cache["phones"] = phones
+                    self.prompt_cache["bert_features"] = bert_features
+                    self.prompt_cache["norm_text"] = norm_text
 
+            # 本请求用这份副本合成，其他请求随后更换参考音频/文本不会影响它
+            prompt_data = self._snapshot_prompt()
 
         ###### text preprocessing ########
         t1 = ttime()
+        metrics.observe("tts_stage_seconds", t1 - t0, stage="ref_feature")
         data:list = None
         if not return_fragment:
             data = self.text_preprocessor.preprocess(text, text_lang, text_split_method)
@@ -768,7 +847,7 @@ class TTS:
 
             batch_index_list:list = None
             data, batch_index_list = self.to_batch(data, 
-                                prompt_data=self.prompt_cache if not no_prompt_text else None, 
+                                prompt_data=prompt_data if not no_prompt_text else None, 
                                 batch_size=batch_size, 
                                 threshold=batch_threshold,
                                 split_bucket=split_bucket,
@@ -800,7 +879,7 @@ class TTS:
                 if len(batch_data) == 0:
                     return None
                 batch, _ = self.to_batch(batch_data, 
-                            prompt_data=self.prompt_cache if not no_prompt_text else None, 
+                            prompt_data=prompt_data if not no_prompt_text else None, 
                             batch_size=batch_size, 
                             threshold=batch_threshold,
                             split_bucket=False,
@@ -811,11 +890,14 @@ class TTS:
 
 
         t2 = ttime()
+        with self._runs_lock:
+            self._active_runs += 1
         try:
             print("############ 推理 ############")
             ###### inference ######
             t_34 = 0.0
             t_45 = 0.0
+            t_first_audio = None
             audio = []
             for item in data:
                 t3 = ttime()
@@ -837,10 +919,29 @@ class TTS:
                 if no_prompt_text :
                     prompt = None
                 else:
-                    prompt = self.prompt_cache["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
+                    prompt = prompt_data["prompt_semantic"].expand(len(all_phoneme_ids), -1).to(self.configs.device)
 
+                if streaming_decode:
+                    sampling_kwargs = {
+                        "top_k": top_k,
+                        "top_p": top_p,
+                        "temperature": temperature,
+                        "early_stop_num": self.configs.hz * self.configs.max_sec,
+                        "repetition_penalty": repetition_penalty,
+                    }
+                    for sr, fragment in self.stream_decode_batch(item, prompt, prompt_data["refer_spec"], sampling_kwargs,
+                                                                 stream_kwargs, fragment_interval, stop_epoch):
+                        if t_first_audio is None:
+                            t_first_audio = ttime()
+                            metrics.observe("tts_first_audio_seconds", t_first_audio - t0)
+                        yield sr, fragment
+                    if self._stop_epoch != stop_epoch:
+                        yield self.configs.sampling_rate, np.zeros(int(self.configs.sampling_rate),
+                                                                dtype=np.int16)
+                        return
+                    continue
 
-                pred_semantic_list, idx_list = self.t2s_model.model.infer_panel(
+                pred_semantic_list, idx_list = infer_panel(
                     all_phoneme_ids,
                     all_phoneme_lens,
                     prompt,
@@ -856,64 +957,36 @@ class TTS:
                 t4 = ttime()
                 t_34 += t4 - t3
 
-                refer_audio_spec:torch.Tensor = [item.to(dtype=self.precision, device=self.configs.device) for item in self.prompt_cache["refer_spec"]]
+                refer_audio_spec:torch.Tensor = [item.to(dtype=self.precision, device=self.configs.device) for item in prompt_data["refer_spec"]]
                                                     
 
-                batch_audio_fragment = []
-            
-                # ## vits并行推理 method 1
-                # pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
-                # pred_semantic_len = torch.LongTensor([item.shape[0] for item in pred_semantic_list]).to(self.configs.device)
-                # pred_semantic = self.batch_sequences(pred_semantic_list, axis=0, pad_value=0).unsqueeze(0)
-                # max_len = 0
-                # for i in range(0, len(batch_phones)):
-                #     max_len = max(max_len, batch_phones[i].shape[-1])
-                # batch_phones = self.batch_sequences(batch_phones, axis=0, pad_value=0, max_length=max_len)
-                # batch_phones = batch_phones.to(self.configs.device)
-                # batch_audio_fragment = (self.vits_model.batched_decode(
-                #         pred_semantic, pred_semantic_len, batch_phones, batch_phones_len,refer_audio_spec
-                #     ))
-
-                if speed_factor == 1.0:
-                    # ## vits并行推理 method 2
-                    pred_semantic_list = [item[-idx:] for item, idx in zip(pred_semantic_list, idx_list)]
-                    upsample_rate = math.prod(self.vits_model.upsample_rates)
-                    audio_frag_idx = [pred_semantic_list[i].shape[0]*2*upsample_rate for i in range(0, len(pred_semantic_list))]
-                    audio_frag_end_idx = [ sum(audio_frag_idx[:i+1]) for i in range(0, len(audio_frag_idx))]
-                    all_pred_semantic = torch.cat(pred_semantic_list).unsqueeze(0).unsqueeze(0).to(self.configs.device)
-                    _batch_phones = torch.cat(batch_phones).unsqueeze(0).to(self.configs.device)
-                    _batch_audio_fragment = (self.vits_model.decode(
-                            all_pred_semantic, _batch_phones, refer_audio_spec, speed=speed_factor
-                        ).detach()[0, 0, :])
-                    audio_frag_end_idx.insert(0, 0)
-                    batch_audio_fragment= [_batch_audio_fragment[audio_frag_end_idx[i-1]:audio_frag_end_idx[i]] for i in range(1, len(audio_frag_end_idx))]
-                else:
-                # ## vits串行推理
-                    for i, idx in enumerate(idx_list):
-                        phones = batch_phones[i].unsqueeze(0).to(self.configs.device)
-                        _pred_semantic = (pred_semantic_list[i][-idx:].unsqueeze(0).unsqueeze(0))   # .unsqueeze(0)#mq要多unsqueeze一次
-                        audio_fragment =(self.vits_model.decode(
-                                _pred_semantic, phones, refer_audio_spec, speed=speed_factor
-                            ).detach()[0, 0, :])
-                        batch_audio_fragment.append(
-                            audio_fragment
-                        )  ###试试重建不带上prompt部分
+                # 各分段补齐到同一长度组成一个batch解码, 按长度mask, 语速逐条生效
+                pred_semantic_list = [item[-idx:].to(self.configs.device) for item, idx in zip(pred_semantic_list, idx_list)]
+                batch_audio_fragment = self.vits_model.batched_decode(
+                        pred_semantic_list,
+                        [phones.to(self.configs.device) for phones in batch_phones],
+                        refer_audio_spec,
+                        speed=speed_factor
+                    )
 
                 t5 = ttime()
                 t_45 += t5 - t4
+                metrics.observe("tts_stage_seconds", t5 - t4, stage="vits_decode")
                 if return_fragment:
                     print("%.3f\t%.3f\t%.3f\t%.3f" % (t1 - t0, t2 - t1, t4 - t3, t5 - t4))
-                    yield self.audio_postprocess([batch_audio_fragment], 
+                    sr, fragment = self.audio_postprocess([batch_audio_fragment], 
                                                     self.configs.sampling_rate, 
                                                     None, 
                                                     speed_factor, 
                                                     False,
                                                     fragment_interval
                                                     )
+                    record_synthesis(t5 - t3, fragment.shape[0] / sr)
+                    yield sr, fragment
                 else:
                     audio.append(batch_audio_fragment)
 
-                if self.stop_flag:
+                if self._stop_epoch != stop_epoch:
                     yield self.configs.sampling_rate, np.zeros(int(self.configs.sampling_rate),
                                                             dtype=np.int16)
                     return
@@ -924,30 +997,86 @@ class TTS:
                     yield self.configs.sampling_rate, np.zeros(int(self.configs.sampling_rate),
                                                                 dtype=np.int16)
                     return
-                yield self.audio_postprocess(audio, 
+                sr, audio = self.audio_postprocess(audio, 
                                                 self.configs.sampling_rate, 
                                                 batch_index_list, 
                                                 speed_factor, 
                                                 split_bucket,
                                                 fragment_interval
                                                 )
+                record_synthesis(ttime() - t0, audio.shape[0] / sr)
+                yield sr, audio
 
         except Exception as e:
             traceback.print_exc()
             # 必须返回一个空音频, 否则会导致显存不释放。
             yield self.configs.sampling_rate, np.zeros(int(self.configs.sampling_rate),
                                                             dtype=np.int16)
-            # 重置模型, 否则会导致显存释放不完全。
-            del self.t2s_model
-            del self.vits_model
-            self.t2s_model = None
-            self.vits_model = None
-            self.init_t2s_weights(self.configs.t2s_weights_path)
-            self.init_vits_weights(self.configs.vits_weights_path)
+            # 重置模型, 否则会导致显存释放不完全。其他请求还在用模型时不重置
+            with self._runs_lock:
+                reset = self._active_runs == 1
+            if reset:
+                del self.t2s_model
+                del self.vits_model
+                self.t2s_model = None
+                self.vits_model = None
+                self.init_t2s_weights(self.configs.t2s_weights_path)
+                self.init_vits_weights(self.configs.vits_weights_path)
             raise e
         finally:
+            with self._runs_lock:
+                self._active_runs -= 1
             self.empty_cache()
     
+    def stream_decode_batch(self, item:dict, prompt:torch.LongTensor, refer_spec:List[torch.Tensor], sampling_kwargs:dict,
+                            stream_kwargs:dict, fragment_interval:float, stop_epoch:int):
+        '''
+            Decode the segments of a batch one by one, vocoding each in chunks with
+            StreamingVocoder while the T2S model samples its tokens.
+            Yields (sampling rate, int16 audio chunk); the last chunk of a segment
+            carries the fragment_interval silence.
+        '''
+        refer_audio_spec = [spec.to(dtype=self.precision, device=self.configs.device) for spec in refer_spec]
+        for i in range(len(item["all_phones"])):
+            t_start = ttime()
+            token_stream = self.t2s_model.model.infer_panel_naive_stream(
+                item["all_phones"][i].unsqueeze(0),
+                item["all_phones_len"][i],
+                prompt[i].unsqueeze(0) if prompt is not None else None,
+                item["all_bert_features"][i].unsqueeze(0),
+                **sampling_kwargs,
+            )
+            phones = item["phones"][i].unsqueeze(0).to(self.configs.device)
+            vocoder = StreamingVocoder(self.vits_model, phones, refer_audio_spec, **stream_kwargs)
+            for token in token_stream:
+                t_decode = ttime()
+                chunks = [self._clamp_stream_chunk(chunk) for chunk in vocoder.push(token)]
+                if len(chunks) > 0:
+                    metrics.observe("tts_stage_seconds", ttime() - t_decode, stage="vits_decode")
+                for chunk in chunks:
+                    sr, fragment = self.audio_postprocess([[chunk]], self.configs.sampling_rate, None, 1.0, False, 0)
+                    record_synthesis(ttime() - t_start, fragment.shape[0] / sr)
+                    t_start = ttime()
+                    yield sr, fragment
+                if self._stop_epoch != stop_epoch:
+                    return
+            t_decode = ttime()
+            chunks = [self._clamp_stream_chunk(chunk) for chunk in vocoder.flush()]
+            metrics.observe("tts_stage_seconds", ttime() - t_decode, stage="vits_decode")
+            # 句末的块才补上分段间隔的静音
+            if len(chunks) > 0:
+                sr, fragment = self.audio_postprocess([chunks], self.configs.sampling_rate, None, 1.0, False, fragment_interval)
+            else:
+                sr, fragment = self.configs.sampling_rate, np.zeros(int(self.configs.sampling_rate * fragment_interval), dtype=np.int16)
+            record_synthesis(ttime() - t_start, fragment.shape[0] / sr)
+            yield sr, fragment
+
+    @staticmethod
+    def _clamp_stream_chunk(chunk:torch.Tensor)->torch.Tensor:
+        # audio_postprocess对峰值>1的片段整体缩放，逐块缩放会让块与块之间音量跳变；
+        # 流式解码改为削波，上限取32767/32768，避免转int16时溢出
+        return chunk.clamp(-1.0, 32767 / 32768)
+
     def empty_cache(self):
         try:
             gc.collect() # 触发gc的垃圾回收。避免内存一直增长。
@@ -966,6 +1095,17 @@ class TTS:
                           split_bucket:bool=True,
                           fragment_interval:float=0.3
                           )->Tuple[int, np.ndarray]:
+        with metrics.timer("tts_stage_seconds", stage="postprocess"):
+            return self._audio_postprocess(audio, sr, batch_index_list, speed_factor, split_bucket, fragment_interval)
+
+    def _audio_postprocess(self, 
+                          audio:List[torch.Tensor], 
+                          sr:int, 
+                          batch_index_list:list=None, 
+                          speed_factor:float=1.0, 
+                          split_bucket:bool=True,
+                          fragment_interval:float=0.3
+                          )->Tuple[int, np.ndarray]:
         zero_wav = torch.zeros(
                         int(self.configs.sampling_rate * fragment_interval),
                         dtype=self.precision,
@@ -1000,7 +1140,21 @@ class TTS:
             
         
         
-       
+
+
+def create_tts(configs: Union[dict, str, TTS_Config]) -> TTS:
+    """TTS pipeline of the backend chosen by the `backend` config key (torch or onnx)"""
+    if not isinstance(configs, TTS_Config):
+        configs = TTS_Config(configs)
+    if configs.backend == "onnx":
+        from .OnnxTTS import OnnxTTS
+        return OnnxTTS(configs)
+    if configs.backend != "torch":
+        print(f"Unknown backend {configs.backend}, falling back to torch")
+        configs.backend = "torch"
+    return TTS(configs)
+
+
 def speed_change(input_audio:np.ndarray, speed:float, sr:int):
     # 将 NumPy 数组转换为原始 PCM 流
     raw_audio = input_audio.astype(np.int16).tobytes()
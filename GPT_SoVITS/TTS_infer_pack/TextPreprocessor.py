@@ -6,14 +6,18 @@ now_dir = os.getcwd()
 sys.path.append(now_dir)
 
 import re
+import threading
 import torch
+from contextlib import nullcontext
 import LangSegment
 from text import chinese
 from typing import Dict, List, Tuple
-from text.cleaner import clean_text
+from text.cleaner import clean_text, g2p_cache
 from text import cleaned_text_to_sequence
-from transformers import AutoModelForMaskedLM, AutoTokenizer
+from transformers import AutoTokenizer
+from feature_extractor.bert import BertFeatureExtractor, get_phone_level_features
 from TTS_infer_pack.text_segmentation_method import split_big_text, splits, get_method as get_seg_method
+from tts_metrics import metrics
 
 from tools.i18n.i18n import I18nAuto, scan_language_list
 
@@ -22,6 +26,14 @@ language=sys.argv[-1] if sys.argv[-1] in scan_language_list() else language
 i18n = I18nAuto(language=language)
 punctuation = set(['!', '?', '…', ',', '.', '-'," "])
 
+# LangSegment 的过滤语言是全局状态，多个请求并发切分时 setfilters 和 getTexts 要一起加锁
+_lang_segment_lock = threading.Lock()
+
+def lang_segments(text:str, filters:List[str]) -> List[dict]:
+    with _lang_segment_lock:
+        LangSegment.setfilters(filters)
+        return list(LangSegment.getTexts(text))
+
 def get_first(text:str) -> str:
     pattern = "[" + "".join(re.escape(sep) for sep in splits) + "]"
     text = re.split(pattern, text)[0].strip()
@@ -49,30 +61,52 @@ def merge_short_text_in_array(texts:str, threshold:int) -> list:
 
 
 class TextPreprocessor:
-    def __init__(self, bert_model:AutoModelForMaskedLM, 
-                 tokenizer:AutoTokenizer, device:torch.device):
+    def __init__(self, bert_model:BertFeatureExtractor, 
+                 tokenizer:AutoTokenizer, device:torch.device, bert_batch_size:int=32):
         self.bert_model = bert_model
         self.tokenizer = tokenizer
         self.device = device
+        # 一次BERT前向最多处理的文本段数，限制长文本时padding后的显存/内存占用
+        self.bert_batch_size = bert_batch_size
         
     def preprocess(self, text:str, lang:str, text_split_method:str, version:str="v1")->List[Dict]:
         print(i18n("############ 切分文本 ############"))
         text = self.replace_consecutive_punctuation(text) # 变量命名应该是写错了
         texts = self.pre_seg_text(text, lang, text_split_method)
-        result = []
+        segments = []
+        with self.prefetch_g2pw(texts, lang, version):
+            for text in tqdm(texts):
+                phones, norm_text, bert_pieces = self.get_phones_and_bert_pieces(text, lang, version)
+                if phones is None or norm_text=="":
+                    continue
+                segments.append((phones, norm_text, bert_pieces))
         print(i18n("############ 提取文本Bert特征 ############"))
-        for text in tqdm(texts):
-            phones, bert_features, norm_text = self.segment_and_extract_feature_for_text(text, lang, version)
-            if phones is None or norm_text=="":
-                continue
+        # 所有分段的中文部分合并成一个batch做BERT前向，而不是每段各跑一次
+        bert_features = self.build_bert_features([pieces for _, _, pieces in segments])
+        result = []
+        for (phones, norm_text, _), bert_feature in zip(segments, bert_features):
             res={
                 "phones": phones,
-                "bert_features": bert_features,
+                "bert_features": bert_feature,
                 "norm_text": norm_text,
             }
             result.append(res)
         return result
 
+    def prefetch_g2pw(self, texts:List[str], lang:str, version:str):
+        '''Batch the G2PW polyphone model over every Chinese segment of the request; see text.chinese2.prefetch_g2pw.'''
+        if version == "v1" or lang not in {"zh", "all_zh", "auto"}:
+            return nullcontext()
+        # 按clean_text_inf实际查缓存的中文片段过滤，已在G2P缓存中的片段不会再走G2PW
+        texts = [
+            span for text in texts for span, span_lang in self.get_g2p_spans(text, lang)
+            if span_lang == "zh" and not g2p_cache.contains(span, "zh", version)
+        ]
+        if len(texts) == 0:
+            return nullcontext()
+        from text import chinese2
+        return chinese2.prefetch_g2pw(texts)
+
     def pre_seg_text(self, text:str, lang:str, text_split_method:str):
         text = text.strip("\n")
         if len(text) == 0:
@@ -117,96 +151,107 @@ class TextPreprocessor:
         return self.get_phones_and_bert(text, language, version)
         
     def get_phones_and_bert(self, text:str, language:str, version:str, final:bool=False):
+        phones, norm_text, bert_pieces = self.get_phones_and_bert_pieces(text, language, version, final)
+        bert = self.build_bert_features([bert_pieces])[0]
+        return phones, bert, norm_text
+
+    def get_phones_and_bert_pieces(self, text:str, language:str, version:str, final:bool=False):
+        '''
+        G2P only. Returns (phones, norm_text, bert_pieces), where each piece is either
+        (norm_text, word2ph) of a Chinese span that needs BERT features, or the phone
+        count of a span that gets zero features. build_bert_features turns the pieces
+        of many texts into features with batched BERT forwards.
+        '''
+        phones_list = []
+        norm_text_list = []
+        bert_pieces = []
+        for span, lang in self.get_g2p_spans(text, language):
+            phones, word2ph, norm_text = self.clean_text_inf(span, lang, version)
+            if lang == "zh":
+                bert_pieces.append((norm_text, word2ph))
+            else:
+                bert_pieces.append(len(phones))
+            phones_list.append(phones)
+            norm_text_list.append(norm_text)
+        phones = sum(phones_list, [])
+        norm_text = ''.join(norm_text_list)
+
+        if not final and len(phones) < 6:
+            return self.get_phones_and_bert_pieces("." + text,language,version,final=True)
+
+        return phones, norm_text, bert_pieces
+
+    def get_g2p_spans(self, text:str, language:str)->List[Tuple[str, str]]:
+        '''The (text, language) spans that get_phones_and_bert_pieces passes to clean_text_inf.'''
         if language in {"en", "all_zh", "all_ja", "all_ko", "all_yue"}:
             language = language.replace("all_","")
             if language == "en":
-                LangSegment.setfilters(["en"])
-                formattext = " ".join(tmp["text"] for tmp in LangSegment.getTexts(text))
+                formattext = " ".join(tmp["text"] for tmp in lang_segments(text, ["en"]))
             else:
                 # 因无法区别中日韩文汉字,以用户输入为准
                 formattext = text
             while "  " in formattext:
                 formattext = formattext.replace("  ", " ")
-            if language == "zh":
-                if re.search(r'[A-Za-z]', formattext):
-                    formattext = re.sub(r'[a-z]', lambda x: x.group(0).upper(), formattext)
-                    formattext = chinese.mix_text_normalize(formattext)
-                    return self.get_phones_and_bert(formattext,"zh",version)
-                else:
-                    phones, word2ph, norm_text = self.clean_text_inf(formattext, language, version)
-                    bert = self.get_bert_feature(norm_text, word2ph).to(self.device)
-            elif language == "yue" and re.search(r'[A-Za-z]', formattext):
-                    formattext = re.sub(r'[a-z]', lambda x: x.group(0).upper(), formattext)
-                    formattext = chinese.mix_text_normalize(formattext)
-                    return self.get_phones_and_bert(formattext,"yue",version)
-            else:
-                phones, word2ph, norm_text = self.clean_text_inf(formattext, language, version)
-                bert = torch.zeros(
-                    (1024, len(phones)),
-                    dtype=torch.float32,
-                ).to(self.device)
+            if language in {"zh", "yue"} and re.search(r'[A-Za-z]', formattext):
+                formattext = re.sub(r'[a-z]', lambda x: x.group(0).upper(), formattext)
+                formattext = chinese.mix_text_normalize(formattext)
+                return self.get_g2p_spans(formattext, language)
+            return [(formattext, language)]
         elif language in {"zh", "ja", "ko", "yue", "auto", "auto_yue"}:
             textlist=[]
             langlist=[]
-            LangSegment.setfilters(["zh","ja","en","ko"])
+            segments = lang_segments(text, ["zh","ja","en","ko"])
             if language == "auto":
-                for tmp in LangSegment.getTexts(text):
+                for tmp in segments:
                     langlist.append(tmp["lang"])
                     textlist.append(tmp["text"])
             elif language == "auto_yue":
-                for tmp in LangSegment.getTexts(text):
+                for tmp in segments:
                     if tmp["lang"] == "zh":
                         tmp["lang"] = "yue"
                     langlist.append(tmp["lang"])
                     textlist.append(tmp["text"])
             else:
-                for tmp in LangSegment.getTexts(text):
+                for tmp in segments:
                     if tmp["lang"] == "en":
                         langlist.append(tmp["lang"])
                     else:
                         # 因无法区别中日韩文汉字,以用户输入为准
                         langlist.append(language)
                     textlist.append(tmp["text"])
-            # print(textlist)
-            # print(langlist)
-            phones_list = []
-            bert_list = []
-            norm_text_list = []
-            for i in range(len(textlist)):
-                lang = langlist[i]
-                phones, word2ph, norm_text = self.clean_text_inf(textlist[i], lang, version)
-                bert = self.get_bert_inf(phones, word2ph, norm_text, lang)
-                phones_list.append(phones)
-                norm_text_list.append(norm_text)
-                bert_list.append(bert)
-            bert = torch.cat(bert_list, dim=1)
-            phones = sum(phones_list, [])
-            norm_text = ''.join(norm_text_list)
-
-        if not final and len(phones) < 6:
-            return self.get_phones_and_bert("." + text,language,version,final=True)
-
-        return phones, bert, norm_text
+            return list(zip(textlist, langlist))
+        return []
 
+    def build_bert_features(self, pieces_list:List[list])->List[torch.Tensor]:
+        '''Phone-level BERT features [1024, n_phones] for each text's pieces from get_phones_and_bert_pieces.'''
+        spans = [piece for pieces in pieces_list for piece in pieces if not isinstance(piece, int)]
+        span_features = iter(self.get_bert_feature_batch([text for text, _ in spans], [word2ph for _, word2ph in spans]))
+        bert_features = []
+        for pieces in pieces_list:
+            parts = []
+            for piece in pieces:
+                if isinstance(piece, int):
+                    parts.append(torch.zeros((1024, piece), dtype=torch.float32))
+                else:
+                    parts.append(next(span_features))
+            bert_features.append(torch.cat(parts, dim=1).to(self.device))
+        return bert_features
 
     def get_bert_feature(self, text:str, word2ph:list)->torch.Tensor:
-        with torch.no_grad():
-            inputs = self.tokenizer(text, return_tensors="pt")
-            for i in inputs:
-                inputs[i] = inputs[i].to(self.device)
-            res = self.bert_model(**inputs, output_hidden_states=True)
-            res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
-        assert len(word2ph) == len(text)
-        phone_level_feature = []
-        for i in range(len(word2ph)):
-            repeat_feature = res[i].repeat(word2ph[i], 1)
-            phone_level_feature.append(repeat_feature)
-        phone_level_feature = torch.cat(phone_level_feature, dim=0)
-        return phone_level_feature.T
+        return self.get_bert_feature_batch([text], [word2ph])[0]
+
+    def get_bert_feature_batch(self, texts:List[str], word2phs:List[list])->List[torch.Tensor]:
+        '''Phone-level BERT features of several texts, bert_batch_size texts per forward.'''
+        if len(texts) == 0:
+            return []
+        with metrics.timer("tts_stage_seconds", stage="bert"):
+            return get_phone_level_features(self.bert_model, self.tokenizer, texts, word2phs,
+                                            self.device, self.bert_batch_size)
     
     def clean_text_inf(self, text:str, language:str, version:str="v1"):
-        phones, word2ph, norm_text = clean_text(text, language, version)
-        phones = cleaned_text_to_sequence(phones, version)
+        with metrics.timer("tts_stage_seconds", stage="g2p"):
+            phones, word2ph, norm_text = clean_text(text, language, version)
+            phones = cleaned_text_to_sequence(phones, version)
         return phones, word2ph, norm_text
 
     def get_bert_inf(self, phones:list, word2ph:list, norm_text:str, language:str):
@@ -0,0 +1,69 @@
+# 导出推理用的SoVITS权重: 折叠weight norm, 去掉后验编码器和VQ训练状态
+# 用法: python GPT_SoVITS/export_sovits_inference.py SoVITS_weights_v2/xxx.pth SoVITS_weights_v2/xxx_infer.pth
+import argparse
+import json
+import os
+import shutil
+import sys
+from time import time as ttime
+
+now_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(now_dir)
+
+import torch
+from module.models import load_sovits_for_inference
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export a SoVITS checkpoint in frozen inference form")
+    parser.add_argument("src", help="SoVITS weights (SoVITS_weights*/*.pth) or a training checkpoint (logs/*/G_*.pth)")
+    parser.add_argument("dst", help="Output path of the inference checkpoint")
+    parser.add_argument("--config", default=None, help="s2 config json, needed only for training checkpoints")
+    parser.add_argument("--fp32", action="store_true", help="Keep fp32 weights instead of saving fp16")
+    return parser.parse_args()
+
+
+def load_source(src, config_path):
+    ckpt = torch.load(src, map_location="cpu")
+    if "weight" in ckpt:
+        return ckpt["weight"], ckpt["config"], ckpt.get("info", "")
+    if "model" not in ckpt:
+        raise ValueError(f"{src} is neither a SoVITS weight file nor a training checkpoint")
+    if config_path is None:
+        raise ValueError("--config is required to export a training checkpoint")
+    with open(config_path, "r", encoding="utf-8") as f:
+        hps = json.load(f)
+    return ckpt["model"], hps, "iteration_%s" % ckpt.get("iteration", "")
+
+
+def export_inference_sovits(src, dst, config_path=None, half=True):
+    weight, hps, info = load_source(src, config_path)
+    if weight["enc_p.text_embedding.weight"].shape[0] == 322:
+        hps["model"]["version"] = "v1"
+    else:
+        hps["model"]["version"] = "v2"
+    hps["model"]["semantic_frame_rate"] = "25hz"
+    vits_model = load_sovits_for_inference(
+        {"weight": weight},
+        hps["data"]["filter_length"] // 2 + 1,
+        hps["train"]["segment_size"] // hps["data"]["hop_length"],
+        n_speakers=hps["data"]["n_speakers"],
+        **hps["model"]
+    )
+    state_dict = vits_model.state_dict()
+    if half:
+        state_dict = {k: v.half() if v.is_floating_point() else v for k, v in state_dict.items()}
+    opt = {"weight": state_dict, "config": hps, "info": info, "frozen": True}
+
+    # torch.save 不支持中文路径, 先写临时文件再移动
+    tmp_path = "%s.pth" % ttime()
+    torch.save(opt, tmp_path)
+    shutil.move(tmp_path, dst)
+    src_mb = os.path.getsize(src) / 1024 / 1024
+    dst_mb = os.path.getsize(dst) / 1024 / 1024
+    print(f"Exported {src} ({src_mb:.1f} MB) -> {dst} ({dst_mb:.1f} MB), {len(state_dict)} tensors")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    export_inference_sovits(args.src, args.dst, args.config, half=not args.fp32)
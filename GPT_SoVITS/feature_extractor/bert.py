@@ -0,0 +1,68 @@
+# 文本前端的BERT特征：只加载用到的那部分编码器
+import torch
+import torch.nn as nn
+from transformers import AutoConfig, AutoModel
+from transformers import logging as tf_logging
+
+# 音素级特征一直取 hidden_states[-3]，最后两层编码器和MLM头的输出都用不到
+UNUSED_LAST_LAYERS = 2
+
+
+class BertFeatureExtractor(nn.Module):
+    """
+    Encoder of a masked-LM checkpoint (chinese-roberta-wwm-ext-large) truncated after
+    the layer whose output the TTS front end consumes, i.e. what used to be
+    hidden_states[-3] of AutoModelForMaskedLM. The last two encoder layers and the
+    MLM head are never loaded, and only the final hidden state is kept.
+    """
+
+    def __init__(self, base_path:str):
+        super().__init__()
+        config = AutoConfig.from_pretrained(base_path)
+        config.num_hidden_layers -= UNUSED_LAST_LAYERS
+        # 少加载的层和MLM头会触发"unused weights"警告，只在这里静音，之后恢复原来的日志级别
+        verbosity = tf_logging.get_verbosity()
+        tf_logging.set_verbosity_error()
+        try:
+            self.model = AutoModel.from_pretrained(base_path, config=config, add_pooling_layer=False)
+        finally:
+            tf_logging.set_verbosity(verbosity)
+
+    def forward(self, input_ids, attention_mask=None, token_type_ids=None):
+        return self.model(
+            input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+        ).last_hidden_state
+
+
+def get_model(base_path:str):
+    model = BertFeatureExtractor(base_path)
+    model.eval()
+    return model
+
+
+def get_phone_level_features(bert_model, tokenizer, texts, word2phs, device, batch_size=32):
+    """
+    Phone-level features [hidden, n_phones] for each text. Texts are padded into batches
+    of up to batch_size sorted by length, and character features are expanded to phones
+    with repeat_interleave(word2ph).
+    """
+    features = [None] * len(texts)
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        with torch.no_grad():
+            inputs = tokenizer([texts[i] for i in batch], return_tensors="pt", padding=True)
+            for key in inputs:
+                inputs[key] = inputs[key].to(device)
+            hidden = bert_model(**inputs).cpu()
+        for row, i in enumerate(batch):
+            word2ph = word2phs[i]
+            assert len(word2ph) == len(texts[i])
+            # 去掉[CLS]，右侧padding不影响前len(word2ph)个位置
+            char_feature = hidden[row, 1:1 + len(word2ph)]
+            features[i] = char_feature.repeat_interleave(torch.tensor(word2ph), dim=0).T
+    return features
+
+
+def get_bert_feature(bert_model, tokenizer, text, word2ph, device):
+    return get_phone_level_features(bert_model, tokenizer, [text], [word2ph], device)[0]
@@ -19,6 +19,8 @@ logging.getLogger("charset_normalizer").setLevel(logging.ERROR)
 logging.getLogger("torchaudio._extension").setLevel(logging.ERROR)
 logging.getLogger("multipart.multipart").setLevel(logging.ERROR)
 import LangSegment, os, re, sys, json
+import hashlib, threading
+from collections import OrderedDict
 import pdb
 import torch
 
@@ -94,16 +96,18 @@ is_share = eval(is_share)
 if "_CUDA_VISIBLE_DEVICES" in os.environ:
     os.environ["CUDA_VISIBLE_DEVICES"] = os.environ["_CUDA_VISIBLE_DEVICES"]
 is_half = eval(os.environ.get("is_half", "True")) and torch.cuda.is_available()
+cpu_precision = os.environ.get("cpu_precision", "fp32").lower()
 punctuation = set(['!', '?', '…', ',', '.', '-'," "])
 import gradio as gr
-from transformers import AutoModelForMaskedLM, AutoTokenizer
+from transformers import AutoTokenizer
 import numpy as np
 import librosa
 from feature_extractor import cnhubert
+from feature_extractor import bert as bert_extractor
 
 cnhubert.cnhubert_base_path = cnhubert_base_path
 
-from module.models import SynthesizerTrn
+from module.models import load_sovits_for_inference
 from AR.models.t2s_lightning_module import Text2SemanticLightningModule
 from text import cleaned_text_to_sequence
 from text.cleaner import clean_text
@@ -111,6 +115,8 @@ from time import time as ttime
 from module.mel_processing import spectrogram_torch
 from tools.my_utils import load_audio
 from tools.i18n.i18n import I18nAuto, scan_language_list
+from tts_metrics import metrics, record_cache, record_synthesis
+from int8_quantization import use_int8, quantize_linear_int8, quantize_t2s_int8
 
 language=os.environ.get("language","Auto")
 language=sys.argv[-1] if sys.argv[-1] in scan_language_list() else language
@@ -122,6 +128,8 @@ if torch.cuda.is_available():
     device = "cuda"
 else:
     device = "cpu"
+# 纯CPU部署时 cpu_precision=int8 对T2S、BERT、CNHuBERT做int8动态量化
+is_int8 = not is_half and use_int8(cpu_precision, device)
 
 dict_language_v1 = {
     i18n("中文"): "all_zh",#全部按中文识别
@@ -147,27 +155,17 @@ dict_language_v2 = {
 dict_language = dict_language_v1 if version =='v1' else dict_language_v2
 
 tokenizer = AutoTokenizer.from_pretrained(bert_path)
-bert_model = AutoModelForMaskedLM.from_pretrained(bert_path)
+bert_model = bert_extractor.get_model(bert_path)
 if is_half == True:
     bert_model = bert_model.half().to(device)
 else:
     bert_model = bert_model.to(device)
+if is_int8:
+    bert_model = quantize_linear_int8(bert_model)
 
 
 def get_bert_feature(text, word2ph):
-    with torch.no_grad():
-        inputs = tokenizer(text, return_tensors="pt")
-        for i in inputs:
-            inputs[i] = inputs[i].to(device)
-        res = bert_model(**inputs, output_hidden_states=True)
-        res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
-    assert len(word2ph) == len(text)
-    phone_level_feature = []
-    for i in range(len(word2ph)):
-        repeat_feature = res[i].repeat(word2ph[i], 1)
-        phone_level_feature.append(repeat_feature)
-    phone_level_feature = torch.cat(phone_level_feature, dim=0)
-    return phone_level_feature.T
+    return bert_extractor.get_bert_feature(bert_model, tokenizer, text, word2ph, device)
 
 
 class DictToAttrRecursive(dict):
@@ -203,11 +201,31 @@ if is_half == True:
     ssl_model = ssl_model.half().to(device)
 else:
     ssl_model = ssl_model.to(device)
-
-
+if is_int8:
+    ssl_model = quantize_linear_int8(ssl_model)
+
+
+file_hash_cache = {}
+def get_hash_of_file(path):
+    """文件内容sha256, 按(路径, 大小, 修改时间)记忆, 文件不变时不重复读盘"""
+    stat = os.stat(path)
+    stamp = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if stamp not in file_hash_cache:
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(chunk)
+        file_hash_cache[stamp] = sha256.hexdigest()
+    return file_hash_cache[stamp]
+
+
+# GPT和SoVITS权重可能被并行加载, weight.json的读改写需要互斥
+weight_json_lock = threading.Lock()
+sovits_hash = ""
 def change_sovits_weights(sovits_path,prompt_language=None,text_language=None):
-    global vq_model, hps, version, dict_language
+    global vq_model, hps, version, dict_language, sovits_hash
     dict_s2 = torch.load(sovits_path, map_location="cpu")
+    sovits_hash = get_hash_of_file(sovits_path)
     hps = dict_s2["config"]
     hps = DictToAttrRecursive(hps)
     hps.model.semantic_frame_rate = "25hz"
@@ -217,26 +235,25 @@ def change_sovits_weights(sovits_path,prompt_language=None,text_language=None):
         hps.model.version = "v2"
     version = hps.model.version
     # print("sovits版本:",hps.model.version)
-    vq_model = SynthesizerTrn(
+    # 普通权重和 export_sovits_inference.py 导出的推理权重都走这里
+    vq_model = load_sovits_for_inference(
+        dict_s2,
         hps.data.filter_length // 2 + 1,
         hps.train.segment_size // hps.data.hop_length,
         n_speakers=hps.data.n_speakers,
         **hps.model
     )
-    if ("pretrained" not in sovits_path):
-        del vq_model.enc_q
     if is_half == True:
         vq_model = vq_model.half().to(device)
     else:
         vq_model = vq_model.to(device)
-    vq_model.eval()
-    print(vq_model.load_state_dict(dict_s2["weight"], strict=False))
     dict_language = dict_language_v1 if version =='v1' else dict_language_v2
-    with open("./weight.json")as f:
-        data=f.read()
-        data=json.loads(data)
-        data["SoVITS"][version]=sovits_path
-    with open("./weight.json","w")as f:f.write(json.dumps(data))
+    with weight_json_lock:
+        with open("./weight.json")as f:
+            data=f.read()
+            data=json.loads(data)
+            data["SoVITS"][version]=sovits_path
+        with open("./weight.json","w")as f:f.write(json.dumps(data))
     if prompt_language is not None and text_language is not None:
         if prompt_language in list(dict_language.keys()):
             prompt_text_update, prompt_language_update = {'__type__':'update'},  {'__type__':'update', 'value':prompt_language}
@@ -255,12 +272,11 @@ def change_sovits_weights(sovits_path,prompt_language=None,text_language=None):
 #change_sovits_weights(sovits_path)
 
 
-def change_gpt_weights(gpt_path):
-    global hz, max_sec, t2s_model, config
-    hz = 50
+gpt_hash = ""
+def load_gpt_weights(gpt_path):
+    """读取并构建GPT模型, 不改动全局状态, 可以和SoVITS权重并行加载"""
     dict_s1 = torch.load(gpt_path, map_location="cpu")
     config = dict_s1["config"]
-    max_sec = config["data"]["max_sec"]
     t2s_model = Text2SemanticLightningModule(config, "****", is_train=False)
     t2s_model.load_state_dict(dict_s1["weight"])
     if is_half == True:
@@ -269,14 +285,37 @@ def change_gpt_weights(gpt_path):
     t2s_model.eval()
     total = sum([param.nelement() for param in t2s_model.parameters()])
     print("Number of parameter: %.2fM" % (total / 1e6))
-    with open("./weight.json")as f:
-        data=f.read()
-        data=json.loads(data)
-        data["GPT"][version]=gpt_path
-    with open("./weight.json","w")as f:f.write(json.dumps(data))
+    if is_int8:
+        t2s_model = quantize_t2s_int8(t2s_model)
+    return t2s_model, config
+
+
+def apply_gpt_weights(gpt_path, loaded_model, loaded_config, weight_version=None):
+    """
+    启用 load_gpt_weights 加载好的模型并记录到weight.json。
+    weight_version 是记录用的版本键, 默认取当前SoVITS的version;
+    和SoVITS并行加载时全局version可能还没更新, 需要在SoVITS加载完成后显式传入。
+    """
+    global hz, max_sec, t2s_model, config, gpt_hash
+    hz = 50
+    gpt_hash = get_hash_of_file(gpt_path)
+    t2s_model, config = loaded_model, loaded_config
+    max_sec = config["data"]["max_sec"]
+    if weight_version is None:
+        weight_version = version
+    with weight_json_lock:
+        with open("./weight.json")as f:
+            data=f.read()
+            data=json.loads(data)
+            data["GPT"][weight_version]=gpt_path
+        with open("./weight.json","w")as f:f.write(json.dumps(data))
     return t2s_model, dict_language
 
 
+def change_gpt_weights(gpt_path):
+    return apply_gpt_weights(gpt_path, *load_gpt_weights(gpt_path))
+
+
 #change_gpt_weights(gpt_path)
 
 
@@ -297,16 +336,128 @@ def get_spepc(hps, filename):
     )
     return spec
 
+##参考音频特征缓存: prompt_semantic/refers/ge只与参考音频内容和SoVITS模型有关, 按内容哈希复用, 并落盘供重启后直接加载
+ref_feature_cache_dir = os.environ.get("ref_feature_cache_dir", "TEMP/ref_feature_cache")
+ref_feature_cache_max = 16
+ref_feature_cache = {}
+ref_feature_lock = threading.Lock()
+
+
+def get_ref_paths(inp_refs):
+    ref_paths = []
+    for path in (inp_refs if isinstance(inp_refs, (list, tuple)) else []):
+        path = path if isinstance(path, str) else str(path)
+        if not os.path.exists(path):
+            print(i18n("音频文件不存在，跳过：{}").format(path))
+            continue
+        ref_paths.append(path)
+    return ref_paths
+
+
+def get_ref_feature_key(ref_wav_path, ref_paths, ref_free):
+    items = [sovits_hash, cnhubert_base_path, str(is_half), str(ref_free)]
+    if is_int8:
+        items.append("int8")
+    if not ref_free or len(ref_paths) == 0:
+        items.append(get_hash_of_file(ref_wav_path))
+    items.extend(get_hash_of_file(path) for path in ref_paths)
+    return hashlib.sha256("|".join(items).encode("utf-8")).hexdigest()
+
+
+def extract_ref_feature(ref_wav_path, ref_paths, ref_free):
+    prompt_semantic = None
+    if not ref_free:
+        zero_wav = np.zeros(
+            int(hps.data.sampling_rate * 0.3),
+            dtype=np.float16 if is_half == True else np.float32,
+        )
+        with torch.no_grad():
+            wav16k, sr = librosa.load(ref_wav_path, sr=16000)
+            if (wav16k.shape[0] > 160000 or wav16k.shape[0] < 48000):
+                gr.Warning(i18n("参考音频在3~10秒范围外，请更换！"))
+                raise OSError(i18n("参考音频在3~10秒范围外，请更换！"))
+            wav16k = torch.from_numpy(wav16k)
+            zero_wav_torch = torch.from_numpy(zero_wav)
+            if is_half == True:
+                wav16k = wav16k.half().to(device)
+                zero_wav_torch = zero_wav_torch.half().to(device)
+            else:
+                wav16k = wav16k.to(device)
+                zero_wav_torch = zero_wav_torch.to(device)
+            wav16k = torch.cat([wav16k, zero_wav_torch])
+            ssl_content = ssl_model.model(wav16k.unsqueeze(0))[
+                "last_hidden_state"
+            ].transpose(
+                1, 2
+            )  # .float()
+            codes = vq_model.extract_latent(ssl_content)
+            prompt_semantic = codes[0, 0].cpu()
+
+    refers = []
+    for path in ref_paths:
+        try:
+            refers.append(get_spepc(hps, path))
+        except Exception as e:
+            print(f"处理参考音频时出错: {e}")
+    if(len(refers) == 0):
+        refers = [get_spepc(hps, ref_wav_path)]
+    ge = vq_model.get_ge([refer.to(dtype).to(device) for refer in refers])
+    return {
+        "prompt_semantic": prompt_semantic,
+        "refers": refers,
+        "ge": ge.cpu(),
+    }
+
+
+def get_ref_feature(ref_wav_path, inp_refs=None, ref_free=False):
+    """
+    返回参考音频特征 {"prompt_semantic", "refers", "ge"}, 已放到推理设备上。
+    依次查内存缓存、磁盘缓存, 都未命中才重新提取。
+    """
+    ref_paths = get_ref_paths(inp_refs)
+    key = get_ref_feature_key(ref_wav_path, ref_paths, ref_free)
+    with ref_feature_lock:
+        record_cache("ref_feature", key in ref_feature_cache)
+        if key in ref_feature_cache:
+            return ref_feature_cache[key]
+        cache_path = os.path.join(ref_feature_cache_dir, "%s.pth" % key)
+        feature = None
+        if os.path.exists(cache_path):
+            try:
+                feature = torch.load(cache_path, map_location="cpu")
+            except Exception as e:
+                print(f"读取参考音频特征缓存失败, 重新提取: {e}")
+        if feature is None:
+            feature = extract_ref_feature(ref_wav_path, ref_paths, ref_free)
+            try:
+                os.makedirs(ref_feature_cache_dir, exist_ok=True)
+                torch.save(feature, cache_path + ".tmp")
+                os.replace(cache_path + ".tmp", cache_path)
+            except Exception as e:
+                print(f"保存参考音频特征缓存失败: {e}")
+        feature = {
+            "prompt_semantic": None if feature["prompt_semantic"] is None else feature["prompt_semantic"].to(device),
+            "refers": [refer.to(dtype).to(device) for refer in feature["refers"]],
+            "ge": feature["ge"].to(dtype).to(device),
+        }
+        while len(ref_feature_cache) >= ref_feature_cache_max:
+            ref_feature_cache.pop(next(iter(ref_feature_cache)))
+        ref_feature_cache[key] = feature
+    return feature
+
+
 def clean_text_inf(text, language, version):
-    phones, word2ph, norm_text = clean_text(text, language, version)
-    phones = cleaned_text_to_sequence(phones, version)
+    with metrics.timer("tts_stage_seconds", stage="g2p"):
+        phones, word2ph, norm_text = clean_text(text, language, version)
+        phones = cleaned_text_to_sequence(phones, version)
     return phones, word2ph, norm_text
 
 dtype=torch.float16 if is_half == True else torch.float32
 def get_bert_inf(phones, word2ph, norm_text, language):
     language=language.replace("all_","")
     if language == "zh":
-        bert = get_bert_feature(norm_text, word2ph).to(device)#.to(dtype)
+        with metrics.timer("tts_stage_seconds", stage="bert"):
+            bert = get_bert_feature(norm_text, word2ph).to(device)#.to(dtype)
     else:
         bert = torch.zeros(
             (1024, len(phones)),
@@ -415,11 +566,82 @@ def merge_short_text_in_array(texts, threshold):
             result[len(result) - 1] += text
     return result
 
-##ref_wav_path+prompt_text+prompt_language+text(单个)+text_language+top_k+top_p+temperature
-# cache_tokens={}#暂未实现清理机制
-cache= {}
-def get_tts_wav(ref_wav_path, prompt_text, prompt_language, text, text_language, how_to_cut=i18n("不切"), top_k=20, top_p=0.6, temperature=0.6, ref_free=False, speed=1, if_freeze=False, inp_refs=123):
-    global cache
+class SemanticCache:
+    """
+    pred_semantic的LRU缓存, 线程安全, 同时按条数和占用字节数限制。
+    键由音素id、prompt语义token、BERT特征和采样参数的哈希组成, 不同文本不会串用结果。
+    """
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(all_phoneme_ids, prompt, bert, top_k, top_p, temperature):
+        sha256 = hashlib.sha256()
+        for tensor in (all_phoneme_ids, prompt, bert):
+            sha256.update(b"none" if tensor is None else tensor.detach().cpu().numpy().tobytes())
+        sha256.update(("%s|%s|%s|%s" % (gpt_hash, top_k, top_p, temperature)).encode("utf-8"))
+        return sha256.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, pred_semantic):
+        size = pred_semantic.numel() * pred_semantic.element_size()
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self._size(self.entries.pop(key))
+            self.entries[key] = pred_semantic
+            self.bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= self._size(evicted)
+
+    @staticmethod
+    def _size(tensor):
+        return tensor.numel() * tensor.element_size()
+
+
+##参考文本的音素/BERT特征与T2S参考部分的嵌入, 同一音色每次请求都一样, 按参考文本+参考语义token+GPT模型复用
+prompt_prefix_cache_max = 16
+prompt_prefix_cache = {}
+prompt_prefix_lock = threading.Lock()
+
+
+def get_prompt_prefix(prompt_text, prompt_language, prompt):
+    sha256 = hashlib.sha256(prompt.detach().cpu().numpy().tobytes())
+    sha256.update(("%s|%s|%s|%s|%s" % (gpt_hash, version, is_half, prompt_language, prompt_text)).encode("utf-8"))
+    key = sha256.hexdigest()
+    with prompt_prefix_lock:
+        record_cache("prompt_prefix", key in prompt_prefix_cache)
+        if key in prompt_prefix_cache:
+            return prompt_prefix_cache[key]
+        phones1, bert1, norm_text1 = get_phones_and_bert(prompt_text, prompt_language, version)
+        with torch.no_grad():
+            prefix_cache = t2s_model.model.get_prefix_cache(
+                torch.LongTensor(phones1).to(device).unsqueeze(0),
+                bert1.to(device).unsqueeze(0),
+                prompt,
+            )
+        while len(prompt_prefix_cache) >= prompt_prefix_cache_max:
+            prompt_prefix_cache.pop(next(iter(prompt_prefix_cache)))
+        prompt_prefix_cache[key] = (phones1, bert1, norm_text1, prefix_cache)
+    return prompt_prefix_cache[key]
+
+
+semantic_cache = SemanticCache(
+    max_entries=int(os.environ.get("semantic_cache_max_entries", 256)),
+    max_bytes=int(os.environ.get("semantic_cache_max_mb", 64)) * 1024 * 1024,
+)
+def get_tts_wav(ref_wav_path, prompt_text, prompt_language, text, text_language, how_to_cut=i18n("不切"), top_k=20, top_p=0.6, temperature=0.6, ref_free=False, speed=1, if_freeze=False, inp_refs=123, return_fragment=False):
+    # return_fragment=True时每合成完一段就yield一次, 供流式播放; 否则合成完全部文本后一次性yield
     if ref_wav_path: pass
     else: gr.Warning(i18n('请上传参考音频'))
     if text: pass
@@ -443,32 +665,13 @@ def get_tts_wav(ref_wav_path, prompt_text, prompt_language, text, text_language,
         int(hps.data.sampling_rate * 0.3),
         dtype=np.float16 if is_half == True else np.float32,
     )
+    ref_feature = get_ref_feature(ref_wav_path, inp_refs, ref_free)
     if not ref_free:
-        with torch.no_grad():
-            wav16k, sr = librosa.load(ref_wav_path, sr=16000)
-            if (wav16k.shape[0] > 160000 or wav16k.shape[0] < 48000):
-                gr.Warning(i18n("参考音频在3~10秒范围外，请更换！"))
-                raise OSError(i18n("参考音频在3~10秒范围外，请更换！"))
-            wav16k = torch.from_numpy(wav16k)
-            zero_wav_torch = torch.from_numpy(zero_wav)
-            if is_half == True:
-                wav16k = wav16k.half().to(device)
-                zero_wav_torch = zero_wav_torch.half().to(device)
-            else:
-                wav16k = wav16k.to(device)
-                zero_wav_torch = zero_wav_torch.to(device)
-            wav16k = torch.cat([wav16k, zero_wav_torch])
-            ssl_content = ssl_model.model(wav16k.unsqueeze(0))[
-                "last_hidden_state"
-            ].transpose(
-                1, 2
-            )  # .float()
-            codes = vq_model.extract_latent(ssl_content)
-            prompt_semantic = codes[0, 0]
-            prompt = prompt_semantic.unsqueeze(0).to(device)
+        prompt = ref_feature["prompt_semantic"].unsqueeze(0)
 
     t1 = ttime()
     t.append(t1-t0)
+    metrics.observe("tts_stage_seconds", t1 - t0, stage="ref_feature")
 
     if (how_to_cut == i18n("凑四句一切")):
         text = cut1(text)
@@ -491,12 +694,13 @@ def get_tts_wav(ref_wav_path, prompt_text, prompt_language, text, text_language,
     all_audio_segments = []
     
     if not ref_free:
-        phones1, bert1, norm_text1 = get_phones_and_bert(prompt_text, prompt_language, version)
+        phones1, bert1, norm_text1, prefix_cache = get_prompt_prefix(prompt_text, prompt_language, prompt)
 
     # 这些变量用于记录处理时间
     time_phone_bert = 0
     time_infer = 0
     time_decode = 0
+    audio_samples = 0
 
     for i_text, text in enumerate(texts):
         # 解决输入目标文本的空行导致报错的问题
@@ -522,10 +726,12 @@ def get_tts_wav(ref_wav_path, prompt_text, prompt_language, text, text_language,
         time_phone_bert += t_phone_end - t_phone_start
 
         t_infer_start = ttime()
-        # 使用缓存，如果该文本段已经处理过且需要冻结
-        if(i_text in cache and if_freeze==True):
-            pred_semantic = cache[i_text]
-        else:
+        # 需要冻结时, 同一文本段+参考+采样参数直接复用上次的语义token, 只重跑VITS(改语速/音色)
+        semantic_key = SemanticCache.make_key(all_phoneme_ids, None if ref_free else prompt, bert, top_k, top_p, temperature)
+        pred_semantic = semantic_cache.get(semantic_key) if if_freeze == True else None
+        if if_freeze == True:
+            record_cache("semantic", pred_semantic is not None)
+        if pred_semantic is None:
             with torch.no_grad():
                 pred_semantic, idx = t2s_model.model.infer_panel(
                     all_phoneme_ids,
@@ -537,55 +743,47 @@ def get_tts_wav(ref_wav_path, prompt_text, prompt_language, text, text_language,
                     top_p=top_p,
                     temperature=temperature,
                     early_stop_num=hz * max_sec,
+                    prefix_cache=None if ref_free else prefix_cache,
                 )
                 pred_semantic = pred_semantic[:, -idx:].unsqueeze(0)
-                cache[i_text] = pred_semantic
+                semantic_cache.put(semantic_key, pred_semantic)
         t_infer_end = ttime()
         time_infer += t_infer_end - t_infer_start
 
         t_decode_start = ttime()
-        refers = []
-        if(inp_refs):
-            for path in inp_refs:
-                try:
-                    # 使用path变量代替filename
-                    if isinstance(path, str):
-                        print(f"使用参考音频文件: {path}")
-                    else:
-                        path = str(path)
-                        print(f"已将非字符串路径转换: {path}")
-                        
-                    print(f"该文件存在: {os.path.exists(path)}")
-                    # 使用path而非filename
-                    refer = get_spepc(hps, path).to(dtype).to(device)
-                    refers.append(refer)
-                except Exception as e:
-                    print(f"处理参考音频时出错: {e}")
-            
-            if(len(refers) == 0):
-                refers = [get_spepc(hps, ref_wav_path).to(dtype).to(device)]
-            
-            # 解码生成音频
-            audio = (vq_model.decode(pred_semantic, torch.LongTensor(phones2).to(device).unsqueeze(0), refers, speed=speed).detach().cpu().numpy()[0, 0])
-            max_audio = np.abs(audio).max()  # 简单防止16bit爆音
-            if max_audio > 1:
-                audio /= max_audio
-            
-            # 将当前音频段和静音段添加到列表中
-            all_audio_segments.append(audio)
-            all_audio_segments.append(zero_wav)
-            
+        # 解码生成音频, 参考频谱与ge来自缓存, 不再逐段重算
+        audio = (vq_model.decode(pred_semantic, torch.LongTensor(phones2).to(device).unsqueeze(0), ref_feature["refers"], speed=speed, ge=ref_feature["ge"]).detach().cpu().numpy()[0, 0])
+        max_audio = np.abs(audio).max()  # 简单防止16bit爆音
+        if max_audio > 1:
+            audio /= max_audio
+
         t_decode_end = ttime()
         time_decode += t_decode_end - t_decode_start
+        metrics.observe("tts_stage_seconds", t_decode_end - t_decode_start, stage="vits_decode")
+        audio_samples += audio.shape[0] + zero_wav.shape[0]
+
+        if return_fragment:
+            with metrics.timer("tts_stage_seconds", stage="postprocess"):
+                fragment = (np.concatenate([audio, zero_wav], 0) * 32768).astype(np.int16)
+            yield hps.data.sampling_rate, fragment
+            continue
+
+        # 将当前音频段和静音段添加到列表中
+        all_audio_segments.append(audio)
+        all_audio_segments.append(zero_wav)
 
     # 所有文本处理完毕，打印总时间统计
     print("%.3f\t%.3f\t%.3f\t%.3f" % 
           (t[0], time_phone_bert, time_infer, time_decode))
+    record_synthesis(t[0] + time_phone_bert + time_infer + time_decode, audio_samples / hps.data.sampling_rate)
+    if return_fragment:
+        return
     
     # 如果有生成的音频段，合并并输出
     if all_audio_segments:
-        final_audio = np.concatenate(all_audio_segments, 0)
-        yield hps.data.sampling_rate, (final_audio * 32768).astype(np.int16)
+        with metrics.timer("tts_stage_seconds", stage="postprocess"):
+            final_audio = (np.concatenate(all_audio_segments, 0) * 32768).astype(np.int16)
+        yield hps.data.sampling_rate, final_audio
     else:
         # 如果没有生成任何音频段，返回空音频
         yield hps.data.sampling_rate, np.zeros(0, dtype=np.int16)
@@ -0,0 +1,29 @@
+# CPU推理的精度模式: fp32(默认) 或 int8 动态量化
+# int8 只量化 Linear 权重, 激活仍是fp32, 推理时按批次动态量化; 只在CPU(fbgemm/qnnpack)上可用
+import torch
+import torch.nn as nn
+
+CPU_PRECISIONS = ["fp32", "int8"]
+
+
+def use_int8(cpu_precision:str, device) -> bool:
+    if cpu_precision not in CPU_PRECISIONS:
+        print(f"Unknown cpu_precision {cpu_precision}, falling back to fp32")
+        return False
+    if cpu_precision == "int8" and str(device) != "cpu":
+        print("int8 dynamic quantization is CPU only, keeping fp32 on", device)
+        return False
+    return cpu_precision == "int8"
+
+
+def quantize_linear_int8(model:nn.Module) -> nn.Module:
+    """Dynamic int8 quantization of every nn.Linear in model (BERT, CNHuBERT)"""
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def quantize_t2s_int8(t2s_model:nn.Module) -> nn.Module:
+    """Text2SemanticLightningModule with its decoder blocks and output layer quantized"""
+    t2s_model.eval()
+    t2s_model.model.quantize_dynamic_int8()
+    return t2s_model
@@ -172,13 +172,24 @@ class EuclideanCodebook(nn.Module):
         x = rearrange(x, "... d -> (...) d")
         return x
 
+    def freeze_for_inference(self):
+        """Drop the EMA/k-means training buffers and cache the squared codebook norms"""
+        for name in ("cluster_size", "embed_avg"):
+            if name in self._buffers:
+                del self._buffers[name]
+        self.register_buffer("embed_sq", self.embed.pow(2).sum(1, keepdim=True).t())
+
     def quantize(self, x):
         embed = self.embed.t()
-        dist = -(
-            x.pow(2).sum(1, keepdim=True)
-            - 2 * x @ embed
-            + embed.pow(2).sum(0, keepdim=True)
-        )
+        if "embed_sq" in self._buffers:
+            # |x|^2 is constant per row and does not change the argmax
+            dist = 2 * x @ embed - self.embed_sq
+        else:
+            dist = -(
+                x.pow(2).sum(1, keepdim=True)
+                - 2 * x @ embed
+                + embed.pow(2).sum(0, keepdim=True)
+            )
         embed_ind = dist.max(dim=-1).indices
         return embed_ind
 
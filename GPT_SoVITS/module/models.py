@@ -15,9 +15,11 @@ from module import attentions
 
 from torch.nn import Conv1d, ConvTranspose1d, AvgPool1d, Conv2d
 from torch.nn.utils import weight_norm, remove_weight_norm, spectral_norm
+from torch.nn.utils.weight_norm import WeightNorm
 from module.commons import init_weights, get_padding
 from module.mrte_model import MRTE
 from module.quantize import ResidualVectorQuantizer
+from module.core_vq import EuclideanCodebook
 # from text import symbols
 from text import symbols as symbols_v1
 from text import symbols2 as symbols_v2
@@ -255,13 +257,34 @@ class TextEncoder(nn.Module):
         text = self.encoder_text(text * text_mask, text_mask)
         y = self.mrte(y, y_mask, text, text_mask, ge)
         y = self.encoder2(y * y_mask, y_mask)
-        if(speed!=1):
+        if isinstance(speed, (list, tuple)):
+            y, y_mask = self.interpolate_speed(y, y_lengths, speed)
+        elif(speed!=1):
             y = F.interpolate(y, size=int(y.shape[-1] / speed)+1, mode="linear")
             y_mask = F.interpolate(y_mask, size=y.shape[-1], mode="nearest")
         stats = self.proj(y) * y_mask
         m, logs = torch.split(stats, self.out_channels, dim=1)
         return y, m, logs, y_mask
 
+    @staticmethod
+    def interpolate_speed(y, y_lengths, speeds):
+        """
+        Stretch every item of a padded batch by its own speed factor, the way the
+        scalar speed branch stretches a single unpadded item. Returns the re-padded
+        features and their mask.
+        """
+        lengths = [int(length) if speed == 1 else int(int(length) / speed) + 1
+                   for length, speed in zip(y_lengths.tolist(), speeds)]
+        out = y.new_zeros(y.shape[0], y.shape[1], max(lengths))
+        for i, (length, speed) in enumerate(zip(lengths, speeds)):
+            item = y[i:i + 1, :, :int(y_lengths[i])]
+            if speed != 1:
+                item = F.interpolate(item, size=length, mode="linear")
+            out[i, :, :length] = item[0]
+        lengths = torch.LongTensor(lengths).to(y.device)
+        y_mask = torch.unsqueeze(commons.sequence_mask(lengths, out.size(2)), 1).to(y.dtype)
+        return out, y_mask
+
     def extract_latent(self, x):
         x = self.ssl_proj(x)
         quantized, codes, commit_loss, quantized_list = self.quantizer(x)
@@ -461,20 +484,27 @@ class Generator(torch.nn.Module):
         if gin_channels != 0:
             self.cond = nn.Conv1d(gin_channels, upsample_initial_channel, 1)
 
-    def forward(self, x, g=None):
+    def forward(self, x, g=None, x_mask=None):
+        # x_mask [B, 1, T]: 补齐的batch里每个卷积的输入在有效长度之外都清零，
+        # 与单条解码时卷积两端的零填充一致，padding 不会渗进短序列的尾部
         x = self.conv_pre(x)
         if g is not None:
             x = x + self.cond(g)
+        if x_mask is not None:
+            x = x * x_mask
 
         for i in range(self.num_upsamples):
             x = F.leaky_relu(x, modules.LRELU_SLOPE)
             x = self.ups[i](x)
+            if x_mask is not None:
+                x_mask = torch.repeat_interleave(x_mask, self.ups[i].stride[0], dim=2)
+                x = x * x_mask
             xs = None
             for j in range(self.num_kernels):
                 if xs is None:
-                    xs = self.resblocks[i * self.num_kernels + j](x)
+                    xs = self.resblocks[i * self.num_kernels + j](x, x_mask)
                 else:
-                    xs += self.resblocks[i * self.num_kernels + j](x)
+                    xs += self.resblocks[i * self.num_kernels + j](x, x_mask)
             x = xs / self.num_kernels
         x = F.leaky_relu(x)
         x = self.conv_post(x)
@@ -984,8 +1014,9 @@ class SynthesizerTrn(nn.Module):
         return o, y_mask, (z, z_p, m_p, logs_p)
 
     @torch.no_grad()
-    def decode(self, codes, text, refer, noise_scale=0.5,speed=1):
-        def get_ge(refer):
+    def get_ge(self, refer):
+        """参考频谱 -> 音色embedding ge, 传入list时对多条参考取平均"""
+        def _get_ge(refer):
             ge = None
             if refer is not None:
                 refer_lengths = torch.LongTensor([refer.size(2)]).to(refer.device)
@@ -1000,11 +1031,18 @@ class SynthesizerTrn(nn.Module):
         if(type(refer)==list):
             ges=[]
             for _refer in refer:
-                ge=get_ge(_refer)
+                ge=_get_ge(_refer)
                 ges.append(ge)
             ge=torch.stack(ges,0).mean(0)
         else:
-            ge=get_ge(refer)
+            ge=_get_ge(refer)
+        return ge
+
+    @torch.no_grad()
+    def decode(self, codes, text, refer, noise_scale=0.5,speed=1,ge=None):
+        # ge可由get_ge预先算好传入, 避免每段文本重复跑ref_enc
+        if ge is None:
+            ge = self.get_ge(refer)
 
         y_lengths = torch.LongTensor([codes.size(2) * 2]).to(codes.device)
         text_lengths = torch.LongTensor([text.size(-1)]).to(text.device)
@@ -1024,7 +1062,96 @@ class SynthesizerTrn(nn.Module):
         o = self.dec((z * y_mask)[:, :, :], g=ge)
         return o
 
+    @torch.no_grad()
+    def batched_decode(self, codes_list, text_list, refer, noise_scale=0.5, speed=1, ge=None):
+        """
+        Decode several segments as one padded batch, with length masks through enc_p,
+        the flow and the vocoder instead of one long concatenated sequence. The vocoder
+        re-applies the upsampled mask before every convolution, so each row matches
+        its single-segment decode up to floating point (given the same noise).
+        codes_list: semantic tokens [T_i] of each segment
+        text_list: phone ids [N_i] of each segment
+        speed: one factor for all segments, or a list with one per segment
+        Returns the audio [samples_i] of each segment.
+        """
+        if ge is None:
+            ge = self.get_ge(refer)
+        batch_size = len(codes_list)
+        speeds = list(speed) if isinstance(speed, (list, tuple)) else [speed] * batch_size
+        device = codes_list[0].device
+
+        code_lengths = torch.LongTensor([codes.shape[-1] for codes in codes_list]).to(device)
+        text_lengths = torch.LongTensor([text.shape[-1] for text in text_list]).to(device)
+        # 码本0和音素0只是填充, 会被mask掉
+        codes = codes_list[0].new_zeros(1, batch_size, int(code_lengths.max()))
+        text = text_list[0].new_zeros(batch_size, int(text_lengths.max()))
+        for i in range(batch_size):
+            codes[0, i, :code_lengths[i]] = codes_list[i]
+            text[i, :text_lengths[i]] = text_list[i]
+
+        y_lengths = code_lengths * 2
+        quantized = self.quantizer.decode(codes)
+        if self.semantic_frame_rate == "25hz":
+            quantized = F.interpolate(
+                quantized, size=int(quantized.shape[-1] * 2), mode="nearest"
+            )
+        x, m_p, logs_p, y_mask = self.enc_p(
+            quantized, y_lengths, text, text_lengths, ge, speeds
+        )
+        z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
+
+        z = self.flow(z_p, y_mask, g=ge, reverse=True)
+
+        o = self.dec(z * y_mask, g=ge, x_mask=y_mask)
+        upsample_rate = math.prod(self.upsample_rates)
+        audio_lengths = (y_mask.sum(dim=(1, 2)).long() * upsample_rate).tolist()
+        return [o[i, 0, :audio_lengths[i]] for i in range(batch_size)]
+
     def extract_latent(self, x):
         ssl = self.ssl_proj(x)
         quantized, codes, commit_loss, quantized_list = self.quantizer(ssl)
         return codes.transpose(0, 1)
+
+    def freeze_for_inference(self):
+        """
+        Turn the model into its inference form: drop the posterior encoder, fold every
+        weight norm into a plain weight and replace the codebook EMA state with cached
+        code norms. Idempotent, so it can run both before loading a frozen checkpoint
+        (to match its keys) and after loading a training-format one.
+        """
+        if hasattr(self, "enc_q"):
+            del self.enc_q
+        fold_weight_norm(self)
+        for module in self.quantizer.modules():
+            if isinstance(module, EuclideanCodebook):
+                module.freeze_for_inference()
+        self.frozen = True
+        return self.eval()
+
+
+def fold_weight_norm(model):
+    """Remove every weight_norm hook under model, leaving weight = g * v / |v|"""
+    for module in model.modules():
+        for hook in list(module._forward_pre_hooks.values()):
+            if isinstance(hook, WeightNorm):
+                remove_weight_norm(module, hook.name)
+    return model
+
+
+def load_sovits_for_inference(dict_s2, *args, **kwargs):
+    """
+    Build a SynthesizerTrn from a SoVITS checkpoint dict, either a regular one or one
+    exported by export_sovits_inference.py, in its frozen inference form. args and
+    kwargs go to the SynthesizerTrn constructor.
+    """
+    vits_model = SynthesizerTrn(*args, **kwargs)
+    frozen = dict_s2.get("frozen", False)
+    if frozen:
+        # 导出的权重已经折叠过, 先把结构转成推理形态, 参数名才对得上
+        vits_model.freeze_for_inference()
+    elif hasattr(vits_model, "enc_q"):
+        del vits_model.enc_q
+    vits_model.load_state_dict(dict_s2["weight"], strict=False)
+    if not frozen:
+        vits_model.freeze_for_inference()
+    return vits_model.eval()
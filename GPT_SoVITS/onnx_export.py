@@ -1,15 +1,13 @@
-from module.models_onnx import SynthesizerTrn, symbols
+from module.models_onnx import SynthesizerTrn
 from AR.models.t2s_lightning_module_onnx import Text2SemanticLightningModule
 import torch
 import torchaudio
 from torch import nn
 from feature_extractor import cnhubert
-cnhubert_base_path = "pretrained_models/chinese-hubert-base"
-cnhubert.cnhubert_base_path=cnhubert_base_path
-ssl_model = cnhubert.get_model()
-from text import cleaned_text_to_sequence
+from text import cleaned_text_to_sequence, symbols_v1, symbols_v2
 import soundfile
 from tools.my_utils import load_audio
+import argparse
 import os
 import json
 
@@ -198,6 +196,10 @@ class VitsModel(nn.Module):
         self.hps = dict_s2["config"]
         self.hps = DictToAttrRecursive(self.hps)
         self.hps.model.semantic_frame_rate = "25hz"
+        if dict_s2["weight"]["enc_p.text_embedding.weight"].shape[0] == 322:
+            self.hps.model.version = "v1"
+        else:
+            self.hps.model.version = "v2"
         self.vq_model = SynthesizerTrn(
             self.hps.data.filter_length // 2 + 1,
             self.hps.train.segment_size // self.hps.data.hop_length,
@@ -259,21 +261,23 @@ class GptSoVits(nn.Module):
 
 
 class SSLModel(nn.Module):
-    def __init__(self):
+    def __init__(self, cnhubert_base_path="pretrained_models/chinese-hubert-base"):
         super().__init__()
-        self.ssl = ssl_model
+        cnhubert.cnhubert_base_path = cnhubert_base_path
+        self.ssl = cnhubert.get_model()
 
     def forward(self, ref_audio_16k):
         return self.ssl.model(ref_audio_16k)["last_hidden_state"].transpose(1, 2)
 
 
-def export(vits_path, gpt_path, project_name):
+def export(vits_path, gpt_path, project_name, cnhubert_base_path="pretrained_models/chinese-hubert-base"):
     vits = VitsModel(vits_path)
     gpt = T2SModel(gpt_path, vits)
     gpt_sovits = GptSoVits(vits, gpt)
-    ssl = SSLModel()
-    ref_seq = torch.LongTensor([cleaned_text_to_sequence(["n", "i2", "h", "ao3", ",", "w", "o3", "sh", "i4", "b", "ai2", "y", "e4"])])
-    text_seq = torch.LongTensor([cleaned_text_to_sequence(["w", "o3", "sh", "i4", "b", "ai2", "y", "e4", "w", "o3", "sh", "i4", "b", "ai2", "y", "e4", "w", "o3", "sh", "i4", "b", "ai2", "y", "e4"])])
+    ssl = SSLModel(cnhubert_base_path)
+    version = vits.hps.model.version
+    ref_seq = torch.LongTensor([cleaned_text_to_sequence(["n", "i2", "h", "ao3", ",", "w", "o3", "sh", "i4", "b", "ai2", "y", "e4"], version)])
+    text_seq = torch.LongTensor([cleaned_text_to_sequence(["w", "o3", "sh", "i4", "b", "ai2", "y", "e4", "w", "o3", "sh", "i4", "b", "ai2", "y", "e4", "w", "o3", "sh", "i4", "b", "ai2", "y", "e4"], version)])
     ref_bert = torch.randn((ref_seq.shape[1], 1024)).float()
     text_bert = torch.randn((text_seq.shape[1], 1024)).float()
     ref_audio = torch.randn((1, 48000 * 5)).float()
@@ -311,7 +315,7 @@ def export(vits_path, gpt_path, project_name):
             "EmbeddingDim": gpt.t2s_model.embedding_dim,
             "Dict": "BasicDict",
             "BertPath": "chinese-roberta-wwm-ext-large",
-            "Symbol": symbols,
+            "Symbol": symbols_v1.symbols if version == "v1" else symbols_v2.symbols,
             "AddBlank": False
         }
     
@@ -319,16 +323,40 @@ def export(vits_path, gpt_path, project_name):
     with open(f"onnx/{project_name}.json", 'w') as MoeVsConfFile:
         json.dump(MoeVSConf, MoeVsConfFile, indent = 4)
 
+    # TTS_infer_pack/OnnxTTS.py 读取的推理配置: 解码循环的停止条件和采样参数都固定在导出时
+    infer_conf = {
+        "version": version,
+        "sampling_rate": vits.hps.data.sampling_rate,
+        "filter_length": vits.hps.data.filter_length,
+        "hop_length": vits.hps.data.hop_length,
+        "win_length": vits.hps.data.win_length,
+        "hz": gpt.hz,
+        "max_sec": gpt.max_sec,
+        "EOS": gpt.t2s_model.EOS,
+        "num_layers": gpt.t2s_model.num_layers,
+        "top_k": gpt.config["inference"]["top_k"],
+        "repetition_penalty": 1.35,
+    }
+    with open(f"onnx/{project_name}/{project_name}_infer.json", 'w') as infer_conf_file:
+        json.dump(infer_conf, infer_conf_file, indent = 4)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export GPT-SoVITS weights to ONNX")
+    parser.add_argument("--gpt_path", default="GPT_weights/nahida-e25.ckpt")
+    parser.add_argument("--vits_path", default="SoVITS_weights/nahida_e30_s3930.pth")
+    parser.add_argument("--name", default="nahida", help="Graphs are written to onnx/<name>/")
+    parser.add_argument("--cnhubert_base_path", default="pretrained_models/chinese-hubert-base")
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
+    args = parse_args()
     try:
         os.mkdir("onnx")
     except:
         pass
 
-    gpt_path = "GPT_weights/nahida-e25.ckpt"
-    vits_path = "SoVITS_weights/nahida_e30_s3930.pth"
-    exp_path = "nahida"
-    export(vits_path, gpt_path, exp_path)
+    export(args.vits_path, args.gpt_path, args.name, args.cnhubert_base_path)
 
     # soundfile.write("out.wav", a, vits.hps.data.sampling_rate)
\ No newline at end of file
@@ -19,7 +19,8 @@ import os.path
 from glob import glob
 from tqdm import tqdm
 from text.cleaner import clean_text
-from transformers import AutoModelForMaskedLM, AutoTokenizer
+from transformers import AutoTokenizer
+from feature_extractor import bert as bert_extractor
 import numpy as np
 from tools.my_utils import clean_path
 
@@ -59,29 +60,14 @@ if os.path.exists(txt_path) == False:
     if os.path.exists(bert_pretrained_dir):...
     else:raise FileNotFoundError(bert_pretrained_dir)
     tokenizer = AutoTokenizer.from_pretrained(bert_pretrained_dir)
-    bert_model = AutoModelForMaskedLM.from_pretrained(bert_pretrained_dir)
+    bert_model = bert_extractor.get_model(bert_pretrained_dir)
     if is_half == True:
         bert_model = bert_model.half().to(device)
     else:
         bert_model = bert_model.to(device)
 
     def get_bert_feature(text, word2ph):
-        with torch.no_grad():
-            inputs = tokenizer(text, return_tensors="pt")
-            for i in inputs:
-                inputs[i] = inputs[i].to(device)
-            res = bert_model(**inputs, output_hidden_states=True)
-            res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
-
-        assert len(word2ph) == len(text)
-        phone_level_feature = []
-        for i in range(len(word2ph)):
-            repeat_feature = res[i].repeat(word2ph[i], 1)
-            phone_level_feature.append(repeat_feature)
-
-        phone_level_feature = torch.cat(phone_level_feature, dim=0)
-
-        return phone_level_feature.T
+        return bert_extractor.get_bert_feature(bert_model, tokenizer, text, word2ph, device)
 
     def process(data, res):
         for name, text, lan in data:
@@ -1,6 +1,7 @@
 import os
 import pdb
 import re
+from contextlib import nullcontext
 
 import cn2an
 from pypinyin import lazy_pinyin, Style
@@ -20,9 +21,9 @@ pinyin_to_symbol_map = {
 
 import jieba_fast.posseg as psg
 
-# is_g2pw_str = os.environ.get("is_g2pw", "True")##默认开启
-# is_g2pw = False#True if is_g2pw_str.lower() == 'true' else False
-is_g2pw = True#True if is_g2pw_str.lower() == 'true' else False
+# 默认开启; 没有G2PW模型的环境(如 benchmarks/ 的随机权重跑分)可设 is_g2pw=False 退回 pypinyin
+is_g2pw_str = os.environ.get("is_g2pw", "True")
+is_g2pw = True if is_g2pw_str.lower() == 'true' else False
 if is_g2pw:
     print("当前使用g2pw进行拼音推理")
     from text.g2pw import G2PWPinyin, correct_pronunciation
@@ -50,23 +51,28 @@ rep_map = {
 
 tone_modifier = ToneSandhi()
 
+# 每句文本都会用到的正则，模块加载时编译一次
+rep_pattern = re.compile("|".join(re.escape(p) for p in rep_map.keys()))
+non_zh_pattern = re.compile(r"[^\u4e00-\u9fa5" + "".join(punctuation) + r"]+")
+non_zh_en_pattern = re.compile(r"[^\u4e00-\u9fa5A-Za-z" + "".join(punctuation) + r"]+")
+english_word_pattern = re.compile("[a-zA-Z]+")
+sentence_split_pattern = re.compile(r"(?<=[{0}])\s*".format("".join(punctuation)))
+consecutive_punctuation_pattern = re.compile(
+    "([{0}])([{0}])+".format("".join(re.escape(p) for p in punctuation))
+)
+
 
 def replace_punctuation(text):
     text = text.replace("嗯", "恩").replace("呣", "母")
-    pattern = re.compile("|".join(re.escape(p) for p in rep_map.keys()))
-
-    replaced_text = pattern.sub(lambda x: rep_map[x.group()], text)
+    replaced_text = rep_pattern.sub(lambda x: rep_map[x.group()], text)
 
-    replaced_text = re.sub(
-        r"[^\u4e00-\u9fa5" + "".join(punctuation) + r"]+", "", replaced_text
-    )
+    replaced_text = non_zh_pattern.sub("", replaced_text)
 
     return replaced_text
 
 
 def g2p(text):
-    pattern = r"(?<=[{0}])\s*".format("".join(punctuation))
-    sentences = [i for i in re.split(pattern, text) if i.strip() != ""]
+    sentences = [i for i in sentence_split_pattern.split(text) if i.strip() != ""]
     phones, word2ph = _g2p(sentences)
     return phones, word2ph
 
@@ -134,140 +140,156 @@ def _merge_erhua(initials: list[str],
     return new_initials, new_finals
 
 
+def prefetch_g2pw(texts):
+    """
+    Context manager that runs G2PW once, batched, over the Chinese of all texts (the
+    Chinese spans of one request), so g2p calls for those texts inside the block skip
+    the model. Han runs that come out differently later fall back to a run of their own.
+    """
+    if not is_g2pw:
+        return nullcontext()
+    segs = []
+    for text in texts:
+        for sentence in sentence_split_pattern.split(text_normalize(text)):
+            if sentence.strip() != "":
+                segs.append(english_word_pattern.sub("", sentence))
+    return g2pw.prefetch(segs)
+
+
 def _g2p(segments):
     phones_list = []
     word2ph = []
-    for seg in segments:
-        pinyins = []
-        # Replace all English words in the sentence
-        seg = re.sub("[a-zA-Z]+", "", seg)
-        seg_cut = psg.lcut(seg)
-        seg_cut = tone_modifier.pre_merge_for_modify(seg_cut)
-        initials = []
-        finals = []
-
-        if not is_g2pw:
-            for word, pos in seg_cut:
-                if pos == "eng":
-                    continue
-                sub_initials, sub_finals = _get_initials_finals(word)
-                sub_finals = tone_modifier.modified_tone(word, pos, sub_finals)
-                # 儿化
-                sub_initials, sub_finals = _merge_erhua(sub_initials, sub_finals, word, pos)
-                initials.append(sub_initials)
-                finals.append(sub_finals)
-                # assert len(sub_initials) == len(sub_finals) == len(word)
-            initials = sum(initials, [])
-            finals = sum(finals, [])
-            print("pypinyin结果",initials,finals)
-        else:
-            # g2pw采用整句推理
-            pinyins = g2pw.lazy_pinyin(seg, neutral_tone_with_five=True, style=Style.TONE3)
-
-            pre_word_length = 0
-            for word, pos in seg_cut:
-                sub_initials = []
-                sub_finals = []
-                now_word_length = pre_word_length + len(word)
-
-                if pos == 'eng':
-                    pre_word_length = now_word_length
-                    continue
+    # g2pw: 所有句子的多音字先一次batch推理，不再逐句跑ONNX
+    if is_g2pw:
+        prefetch = g2pw.prefetch([english_word_pattern.sub("", seg) for seg in segments])
+    else:
+        prefetch = nullcontext()
+    with prefetch:
+        for seg in segments:
+            pinyins = []
+            # Replace all English words in the sentence
+            seg = english_word_pattern.sub("", seg)
+            seg_cut = psg.lcut(seg)
+            seg_cut = tone_modifier.pre_merge_for_modify(seg_cut)
+            initials = []
+            finals = []
+
+            if not is_g2pw:
+                for word, pos in seg_cut:
+                    if pos == "eng":
+                        continue
+                    sub_initials, sub_finals = _get_initials_finals(word)
+                    sub_finals = tone_modifier.modified_tone(word, pos, sub_finals)
+                    # 儿化
+                    sub_initials, sub_finals = _merge_erhua(sub_initials, sub_finals, word, pos)
+                    initials.append(sub_initials)
+                    finals.append(sub_finals)
+                    # assert len(sub_initials) == len(sub_finals) == len(word)
+                initials = sum(initials, [])
+                finals = sum(finals, [])
+                print("pypinyin结果",initials,finals)
+            else:
+                # g2pw采用整句推理
+                pinyins = g2pw.lazy_pinyin(seg, neutral_tone_with_five=True, style=Style.TONE3)
 
-                word_pinyins = pinyins[pre_word_length:now_word_length]
+                pre_word_length = 0
+                for word, pos in seg_cut:
+                    sub_initials = []
+                    sub_finals = []
+                    now_word_length = pre_word_length + len(word)
 
-                # 多音字消歧
-                word_pinyins = correct_pronunciation(word,word_pinyins)
+                    if pos == 'eng':
+                        pre_word_length = now_word_length
+                        continue
 
-                for pinyin in word_pinyins:
-                    if pinyin[0].isalpha():
-                        sub_initials.append(to_initials(pinyin))
-                        sub_finals.append(to_finals_tone3(pinyin,neutral_tone_with_five=True))
-                    else:
-                        sub_initials.append(pinyin)
-                        sub_finals.append(pinyin)
-
-                pre_word_length = now_word_length
-                sub_finals = tone_modifier.modified_tone(word, pos, sub_finals)
-                # 儿化
-                sub_initials, sub_finals = _merge_erhua(sub_initials, sub_finals, word, pos)
-                initials.append(sub_initials)
-                finals.append(sub_finals)
-
-            initials = sum(initials, [])
-            finals = sum(finals, [])
-            # print("g2pw结果",initials,finals)
-
-        for c, v in zip(initials, finals):
-            raw_pinyin = c + v
-            # NOTE: post process for pypinyin outputs
-            # we discriminate i, ii and iii
-            if c == v:
-                assert c in punctuation
-                phone = [c]
-                word2ph.append(1)
-            else:
-                v_without_tone = v[:-1]
-                tone = v[-1]
-
-                pinyin = c + v_without_tone
-                assert tone in "12345"
-
-                if c:
-                    # 多音节
-                    v_rep_map = {
-                        "uei": "ui",
-                        "iou": "iu",
-                        "uen": "un",
-                    }
-                    if v_without_tone in v_rep_map.keys():
-                        pinyin = c + v_rep_map[v_without_tone]
+                    word_pinyins = pinyins[pre_word_length:now_word_length]
+
+                    # 多音字消歧
+                    word_pinyins = correct_pronunciation(word,word_pinyins)
+
+                    for pinyin in word_pinyins:
+                        if pinyin[0].isalpha():
+                            sub_initials.append(to_initials(pinyin))
+                            sub_finals.append(to_finals_tone3(pinyin,neutral_tone_with_five=True))
+                        else:
+                            sub_initials.append(pinyin)
+                            sub_finals.append(pinyin)
+
+                    pre_word_length = now_word_length
+                    sub_finals = tone_modifier.modified_tone(word, pos, sub_finals)
+                    # 儿化
+                    sub_initials, sub_finals = _merge_erhua(sub_initials, sub_finals, word, pos)
+                    initials.append(sub_initials)
+                    finals.append(sub_finals)
+
+                initials = sum(initials, [])
+                finals = sum(finals, [])
+                # print("g2pw结果",initials,finals)
+
+            for c, v in zip(initials, finals):
+                raw_pinyin = c + v
+                # NOTE: post process for pypinyin outputs
+                # we discriminate i, ii and iii
+                if c == v:
+                    assert c in punctuation
+                    phone = [c]
+                    word2ph.append(1)
                 else:
-                    # 单音节
-                    pinyin_rep_map = {
-                        "ing": "ying",
-                        "i": "yi",
-                        "in": "yin",
-                        "u": "wu",
-                    }
-                    if pinyin in pinyin_rep_map.keys():
-                        pinyin = pinyin_rep_map[pinyin]
+                    v_without_tone = v[:-1]
+                    tone = v[-1]
+
+                    pinyin = c + v_without_tone
+                    assert tone in "12345"
+
+                    if c:
+                        # 多音节
+                        v_rep_map = {
+                            "uei": "ui",
+                            "iou": "iu",
+                            "uen": "un",
+                        }
+                        if v_without_tone in v_rep_map.keys():
+                            pinyin = c + v_rep_map[v_without_tone]
                     else:
-                        single_rep_map = {
-                            "v": "yu",
-                            "e": "e",
-                            "i": "y",
-                            "u": "w",
+                        # 单音节
+                        pinyin_rep_map = {
+                            "ing": "ying",
+                            "i": "yi",
+                            "in": "yin",
+                            "u": "wu",
                         }
-                        if pinyin[0] in single_rep_map.keys():
-                            pinyin = single_rep_map[pinyin[0]] + pinyin[1:]
-
-                assert pinyin in pinyin_to_symbol_map.keys(), (pinyin, seg, raw_pinyin)
-                new_c, new_v = pinyin_to_symbol_map[pinyin].split(" ")
-                new_v = new_v + tone
-                phone = [new_c, new_v]
-                word2ph.append(len(phone))
-
-            phones_list += phone
+                        if pinyin in pinyin_rep_map.keys():
+                            pinyin = pinyin_rep_map[pinyin]
+                        else:
+                            single_rep_map = {
+                                "v": "yu",
+                                "e": "e",
+                                "i": "y",
+                                "u": "w",
+                            }
+                            if pinyin[0] in single_rep_map.keys():
+                                pinyin = single_rep_map[pinyin[0]] + pinyin[1:]
+
+                    assert pinyin in pinyin_to_symbol_map.keys(), (pinyin, seg, raw_pinyin)
+                    new_c, new_v = pinyin_to_symbol_map[pinyin].split(" ")
+                    new_v = new_v + tone
+                    phone = [new_c, new_v]
+                    word2ph.append(len(phone))
+
+                phones_list += phone
     return phones_list, word2ph
 
 
 def replace_punctuation_with_en(text):
     text = text.replace("嗯", "恩").replace("呣", "母")
-    pattern = re.compile("|".join(re.escape(p) for p in rep_map.keys()))
+    replaced_text = rep_pattern.sub(lambda x: rep_map[x.group()], text)
 
-    replaced_text = pattern.sub(lambda x: rep_map[x.group()], text)
-
-    replaced_text = re.sub(
-        r"[^\u4e00-\u9fa5A-Za-z" + "".join(punctuation) + r"]+", "", replaced_text
-    )
+    replaced_text = non_zh_en_pattern.sub("", replaced_text)
 
     return replaced_text
 
 def replace_consecutive_punctuation(text):
-    punctuations = ''.join(re.escape(p) for p in punctuation)
-    pattern = f'([{punctuations}])([{punctuations}])+'
-    result = re.sub(pattern, r'\1', text)
+    result = consecutive_punctuation_pattern.sub(r'\1', text)
     return result
 
 def text_normalize(text):
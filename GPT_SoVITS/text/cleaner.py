@@ -1,5 +1,9 @@
 from text import cleaned_text_to_sequence
 import os
+import json
+import hashlib
+import importlib
+from functools import lru_cache
 # if os.environ.get("version","v1")=="v1":
 #     from text import chinese
 #     from text.symbols import symbols
@@ -9,6 +13,38 @@ import os
 
 from text import symbols as symbols_v1
 from text import symbols2 as symbols_v2
+from text.g2p_cache import G2PCache
+
+
+def g2p_frontend_fingerprint():
+    """Identify the G2P frontend: G2PW on/off, the G2PW model files and the pinyin dictionaries"""
+    text_dir = os.path.dirname(__file__)
+    is_g2pw = os.environ.get("is_g2pw", "True").lower() == "true"
+    parts = {"is_g2pw": is_g2pw}
+    dictionaries = [os.path.join(text_dir, "opencpop-strict.txt")]
+    if is_g2pw:
+        dictionaries += [os.path.join(text_dir, "g2pw", name) for name in ("polyphonic.rep", "polyphonic-fix.rep")]
+        # 模型文件很大，只取大小和修改时间
+        model_dir = os.environ.get("G2PW_MODEL_DIR", "GPT_SoVITS/text/G2PWModel")
+        for name in ("g2pW.onnx", "config.py"):
+            path = os.path.join(model_dir, name)
+            if os.path.exists(path):
+                stat = os.stat(path)
+                parts[name] = [stat.st_size, int(stat.st_mtime)]
+    for path in dictionaries:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                parts[os.path.basename(path)] = hashlib.sha1(f.read()).hexdigest()
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+# G2P_CACHE_SIZE=0 关闭缓存; G2P_CACHE_PATH 指定JSONL文件时音素缓存跨进程重启保留
+g2p_cache_path = os.environ.get("G2P_CACHE_PATH") or None
+g2p_cache = G2PCache(
+    maxsize=int(os.environ.get("G2P_CACHE_SIZE", 4096)),
+    path=g2p_cache_path,
+    fingerprint=g2p_frontend_fingerprint() if g2p_cache_path else ""
+)
 
 special = [
     # ("%", "zh", "SP"),
@@ -18,8 +54,22 @@ special = [
 ]
 
 
+@lru_cache(maxsize=None)
+def get_language_module(module_name):
+    return importlib.import_module("text." + module_name)
+
+
 def clean_text(text, language, version=None):
     if version is None:version=os.environ.get('version', 'v2')
+    cached = g2p_cache.get(text, language, version)
+    if cached is not None:
+        return cached
+    phones, word2ph, norm_text = _clean_text(text, language, version)
+    g2p_cache.put(text, language, version, phones, word2ph, norm_text)
+    return phones, word2ph, norm_text
+
+
+def _clean_text(text, language, version):
     if version == "v1":
         symbols = symbols_v1.symbols
         language_module_map = {"zh": "chinese", "ja": "japanese", "en": "english"}
@@ -33,7 +83,7 @@ def clean_text(text, language, version=None):
     for special_s, special_l, target_symbol in special:
         if special_s in text and language == special_l:
             return clean_special(text, language, special_s, target_symbol, version)
-    language_module = __import__("text."+language_module_map[language],fromlist=[language_module_map[language]])
+    language_module = get_language_module(language_module_map[language])
     if hasattr(language_module,"text_normalize"):
         norm_text = language_module.text_normalize(text)
     else:
@@ -67,7 +117,7 @@ def clean_special(text, language, special_s, target_symbol, version=None):
     特殊静音段sp符号处理
     """
     text = text.replace(special_s, ",")
-    language_module = __import__("text."+language_module_map[language],fromlist=[language_module_map[language]])
+    language_module = get_language_module(language_module_map[language])
     norm_text = language_module.text_normalize(text)
     phones = language_module.g2p(norm_text)
     new_ph = []
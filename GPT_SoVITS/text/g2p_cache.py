@@ -0,0 +1,164 @@
+# clean_text 结果的缓存：角色台词反复出现，相同句子不必每次都重跑文本规范化、分词和G2P
+import os
+import json
+import threading
+from collections import OrderedDict
+
+from tts_metrics import record_cache
+
+
+class G2PCache:
+    """
+    Bounded LRU of clean_text results keyed by (text, language, version).
+
+    With a path, entries are also appended to a JSONL file and loaded back on the
+    next start, so the phoneme cache survives restarts. The file is compacted to the
+    newest maxsize entries when it is loaded. Its first line records the fingerprint
+    of the G2P frontend that produced the entries; a file written by a different
+    frontend (G2PW on/off, another model or dictionary) is discarded.
+    """
+
+    def __init__(self, maxsize=4096, path=None, fingerprint=""):
+        self.maxsize = maxsize
+        self.path = path
+        self.fingerprint = fingerprint
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if self.path:
+            self._load()
+
+    @staticmethod
+    def _pack(phones, word2ph, norm_text):
+        return tuple(phones), None if word2ph is None else tuple(word2ph), norm_text
+
+    @staticmethod
+    def _unpack(entry):
+        # 每次返回新的list，调用方修改结果不会污染缓存
+        phones, word2ph, norm_text = entry
+        return list(phones), None if word2ph is None else list(word2ph), norm_text
+
+    def get(self, text, language, version):
+        """(phones, word2ph, norm_text) for a cached call, or None on a miss"""
+        if self.maxsize <= 0:
+            return None
+        key = (text, language, version)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        record_cache("g2p", entry is not None)
+        return None if entry is None else self._unpack(entry)
+
+    def contains(self, text, language, version):
+        """Membership test that does not count towards the hit-rate stats"""
+        with self.lock:
+            return (text, language, version) in self.entries
+
+    def put(self, text, language, version, phones, word2ph, norm_text):
+        if self.maxsize <= 0:
+            return
+        key = (text, language, version)
+        entry = self._pack(phones, word2ph, norm_text)
+        with self.lock:
+            is_new = key not in self.entries
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            if self.path and is_new:
+                self._append(key, entry)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    @staticmethod
+    def _to_line(key, entry):
+        text, language, version = key
+        phones, word2ph, norm_text = entry
+        return json.dumps({
+            "text": text, "language": language, "version": version,
+            "phones": phones, "word2ph": word2ph, "norm_text": norm_text,
+        }, ensure_ascii=False) + "\n"
+
+    def _append(self, key, entry):
+        """Caller holds the lock"""
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(self._to_line(key, entry))
+        except Exception as e:
+            print(f"Error saving G2P cache entry to {self.path}: {e}")
+
+    def _header(self):
+        return json.dumps({"fingerprint": self.fingerprint}) + "\n"
+
+    def _rewrite(self):
+        """Replace the file with the header and the current entries, atomically via a temp file"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self._header())
+            f.write("".join(self._to_line(key, entry) for key, entry in self.entries.items()))
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            try:
+                self._rewrite()
+            except Exception as e:
+                print(f"Error creating G2P cache {self.path}: {e}")
+            return
+        lines = 0
+        header = None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    lines += 1
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 写入中断留下的残行，跳过
+                        continue
+                    if header is None:
+                        header = item.get("fingerprint")
+                        if header != self.fingerprint:
+                            # 前端(G2PW开关、模型或词典)变了，旧音素结果作废
+                            print(f"Discarding G2P cache {self.path}: written by another G2P frontend")
+                            break
+                        continue
+                    key = (item["text"], item["language"], item["version"])
+                    self.entries[key] = self._pack(item["phones"], item["word2ph"], item["norm_text"])
+                    self.entries.move_to_end(key)
+                    if len(self.entries) > self.maxsize:
+                        self.entries.popitem(last=False)
+        except Exception as e:
+            print(f"Error loading G2P cache from {self.path}: {e}")
+            return
+        print(f"Loaded {len(self.entries)} G2P cache entries from {self.path}")
+
+        if header != self.fingerprint or lines > len(self.entries) + 1:
+            # 去掉重复和被淘汰的行(或整个作废的旧文件)，经临时文件原子替换
+            try:
+                self._rewrite()
+            except Exception as e:
+                print(f"Error compacting G2P cache {self.path}: {e}")
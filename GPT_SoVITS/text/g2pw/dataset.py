@@ -85,6 +85,13 @@ def prepare_onnx_input(tokenizer,
         char_ids.append(char_id)
         position_ids.append(position_id)
 
+    # 不同句子长度不同，右侧补齐到同一长度，padding位置的attention_mask为0
+    padded_len = max(len(input_id) for input_id in input_ids)
+    pad_id = tokenizer.pad_token_id or 0
+    for rows, pad_value in ((input_ids, pad_id), (token_type_ids, 0), (attention_masks, 0)):
+        for i, row in enumerate(rows):
+            rows[i] = row + [pad_value] * (padded_len - len(row))
+
     outputs = {
         'input_ids': np.array(input_ids).astype(np.int64),
         'token_type_ids': np.array(token_type_ids).astype(np.int64),
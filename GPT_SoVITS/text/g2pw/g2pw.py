@@ -2,6 +2,8 @@
 
 import pickle
 import os
+import threading
+from contextlib import contextmanager
 
 from pypinyin.constants import RE_HANS
 from pypinyin.core import Pinyin, Style
@@ -35,6 +37,29 @@ class G2PWPinyin(Pinyin):
     def get_seg(self, **kwargs):
         return simple_seg
 
+    @contextmanager
+    def prefetch(self, texts):
+        '''
+        Disambiguate the polyphonic characters of every Han run in texts with padded,
+        batched ONNX runs up front. lazy_pinyin calls in this thread inside the block
+        reuse those results instead of running the model once per run.
+        '''
+        chunks = dict.fromkeys(
+            words for text in texts for words in self.seg(text) if RE_HANS.match(words)
+        )
+        prefetched = self._converter.prefetched()
+        outer = dict(prefetched)
+        missing = [chunk for chunk in chunks if chunk not in prefetched]
+        if missing:
+            for chunk, result in zip(missing, self._g2pw(missing)):
+                prefetched[chunk] = [result]
+        try:
+            yield
+        finally:
+            # 嵌套调用时恢复外层的预取结果
+            prefetched.clear()
+            prefetched.update(outer)
+
 
 class Converter(UltimateConverter):
     def __init__(self, g2pw_instance, v_to_u=False,
@@ -46,6 +71,13 @@ class Converter(UltimateConverter):
             tone_sandhi=tone_sandhi, **kwargs)
 
         self._g2pw = g2pw_instance
+        # prefetch() 的结果按线程保存，并发请求互不影响
+        self._local = threading.local()
+
+    def prefetched(self):
+        if not hasattr(self._local, "results"):
+            self._local.results = {}
+        return self._local.results
 
     def convert(self, words, style, heteronym, errors, strict, **kwargs):
         pys = []
@@ -70,7 +102,9 @@ class Converter(UltimateConverter):
     def _to_pinyin(self, han, style, heteronym, errors, strict, **kwargs):
         pinyins = []
 
-        g2pw_pinyin = self._g2pw(han)
+        g2pw_pinyin = self.prefetched().get(han)
+        if g2pw_pinyin is None:
+            g2pw_pinyin = self._g2pw(han)
 
         if not g2pw_pinyin:  # g2pw 不支持的汉字改为使用 pypinyin 原有逻辑
             return super(Converter, self).convert(
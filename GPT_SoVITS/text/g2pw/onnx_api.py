@@ -29,17 +29,27 @@ model_version = '1.1'
 
 
 def predict(session, onnx_input: Dict[str, Any],
-            labels: List[str]) -> Tuple[List[str], List[float]]:
+            labels: List[str], use_io_binding: bool=False) -> Tuple[List[str], List[float]]:
     all_preds = []
     all_confidences = []
-    probs = session.run([], {
+    feeds = {
         "input_ids": onnx_input['input_ids'],
         "token_type_ids": onnx_input['token_type_ids'],
         "attention_mask": onnx_input['attention_masks'],
         "phoneme_mask": onnx_input['phoneme_masks'],
         "char_ids": onnx_input['char_ids'],
         "position_ids": onnx_input['position_ids']
-    })[0]
+    }
+    if use_io_binding:
+        # 输入一次性拷到执行设备，输出绑定在CPU上，省去 run() 每次分配输出的开销
+        binding = session.io_binding()
+        for name, value in feeds.items():
+            binding.bind_cpu_input(name, np.ascontiguousarray(value))
+        binding.bind_output(session.get_outputs()[0].name, 'cpu')
+        session.run_with_iobinding(binding)
+        probs = binding.copy_outputs_to_cpu()[0]
+    else:
+        probs = session.run([], feeds)[0]
 
     preds = np.argmax(probs, axis=1).tolist()
     max_probs = []
@@ -82,13 +92,30 @@ class G2PWOnnxConverter:
                  model_dir: str='G2PWModel/',
                  style: str='bopomofo',
                  model_source: str=None,
-                 enable_non_tradional_chinese: bool=False):
+                 enable_non_tradional_chinese: bool=False,
+                 intra_op_num_threads: int=None,
+                 inter_op_num_threads: int=None,
+                 use_io_binding: bool=None,
+                 max_batch_rows: int=None):
         uncompress_path = download_and_decompress(model_dir)
 
+        # 会话线程数、IO binding和单次推理的最大行数(每个多音字一行)，未指定时读环境变量
+        if intra_op_num_threads is None:
+            intra_op_num_threads = int(os.environ.get("G2PW_INTRA_OP_THREADS", 2))
+        if inter_op_num_threads is None:
+            inter_op_num_threads = int(os.environ.get("G2PW_INTER_OP_THREADS", 0))
+        if use_io_binding is None:
+            use_io_binding = os.environ.get("G2PW_IO_BINDING", "False").lower() == "true"
+        if max_batch_rows is None:
+            max_batch_rows = int(os.environ.get("G2PW_MAX_BATCH_ROWS", 256))
+        self.use_io_binding = use_io_binding
+        self.max_batch_rows = max_batch_rows
+
         sess_options = onnxruntime.SessionOptions()
         sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
         sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
-        sess_options.intra_op_num_threads = 2
+        sess_options.intra_op_num_threads = intra_op_num_threads
+        sess_options.inter_op_num_threads = inter_op_num_threads
         try:
             self.session_g2pW = onnxruntime.InferenceSession(os.path.join(uncompress_path, 'g2pW.onnx'),sess_options=sess_options, providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
         except:
@@ -193,20 +220,25 @@ class G2PWOnnxConverter:
             # sentences no polyphonic words
             return partial_results
 
-        onnx_input = prepare_onnx_input(
-            tokenizer=self.tokenizer,
-            labels=self.labels,
-            char2phonemes=self.char2phonemes,
-            chars=self.chars,
-            texts=texts,
-            query_ids=query_ids,
-            use_mask=self.config.use_mask,
-            window_size=None)
-
-        preds, confidences = predict(
-            session=self.session_g2pW,
-            onnx_input=onnx_input,
-            labels=self.labels)
+        # 所有句子的多音字拼成padding后的batch，每 max_batch_rows 行跑一次ONNX
+        preds = []
+        for start in range(0, len(texts), self.max_batch_rows):
+            onnx_input = prepare_onnx_input(
+                tokenizer=self.tokenizer,
+                labels=self.labels,
+                char2phonemes=self.char2phonemes,
+                chars=self.chars,
+                texts=texts[start:start + self.max_batch_rows],
+                query_ids=query_ids[start:start + self.max_batch_rows],
+                use_mask=self.config.use_mask,
+                window_size=None)
+
+            batch_preds, confidences = predict(
+                session=self.session_g2pW,
+                onnx_input=onnx_input,
+                labels=self.labels,
+                use_io_binding=self.use_io_binding)
+            preds += batch_preds
         if self.config.use_char_phoneme:
             preds = [pred.split(' ')[1] for pred in preds]
 
@@ -0,0 +1,176 @@
+# 推理流水线的耗时/吞吐指标, 以 Prometheus 文本格式由 api_v2.py 和 Flask 应用的 /metrics 暴露
+import time
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Cumulative histogram with Prometheus-style upper bounds"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {"buckets": cumulative, "count": self.count, "sum": self.sum}
+
+    def format(self, name, labels=None):
+        """Prometheus exposition lines for this histogram"""
+        labels = dict(labels or {})
+        snapshot = self.snapshot()
+        lines = []
+        for bound, count in snapshot["buckets"]:
+            lines.append("%s_bucket%s %d" % (name, format_labels(dict(labels, le=bound)), count))
+        lines.append("%s_count%s %d" % (name, format_labels(labels), snapshot["count"]))
+        lines.append("%s_sum%s %f" % (name, format_labels(labels), snapshot["sum"]))
+        return lines
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    items = ",".join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in sorted(labels.items()))
+    return "{%s}" % items
+
+
+class MetricsRegistry:
+    """Thread-safe counters, gauges and histograms keyed by metric name and labels"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.descriptions = {}
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def describe(self, name, kind, help_text, buckets=None):
+        self.descriptions[name] = (kind, help_text, buckets)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                buckets = self.descriptions.get(name, (None, None, None))[2]
+                self.histograms[key] = Histogram(buckets or DEFAULT_BUCKETS)
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """Plain-dict copy of every series keyed like name{labels}, e.g. for benchmark reports"""
+        with self.lock:
+            return {
+                "counters": {name + format_labels(dict(labels)): value for (name, labels), value in self.counters.items()},
+                "gauges": {name + format_labels(dict(labels)): value for (name, labels), value in self.gauges.items()},
+                "histograms": {
+                    name + format_labels(dict(labels)): {"count": histogram.count, "sum": histogram.sum}
+                    for (name, labels), histogram in self.histograms.items()
+                },
+            }
+
+    def histogram_snapshot(self, name, **labels):
+        """Cumulative buckets, count and sum of one histogram series, or None if nothing was observed"""
+        with self.lock:
+            histogram = self.histograms.get(self._key(name, labels))
+            return None if histogram is None else histogram.snapshot()
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            series = {}
+            for (name, labels), value in self.counters.items():
+                series.setdefault(name, []).append("%s%s %s" % (name, format_labels(dict(labels)), value))
+            for (name, labels), value in self.gauges.items():
+                series.setdefault(name, []).append("%s%s %s" % (name, format_labels(dict(labels)), value))
+            for (name, labels), histogram in self.histograms.items():
+                series.setdefault(name, []).extend(histogram.format(name, dict(labels)))
+
+        lines = []
+        for name in sorted(series):
+            kind, help_text, _ = self.descriptions.get(name, ("untyped", name, None))
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            lines.extend(series[name])
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.describe("tts_stage_seconds", "histogram",
+                 "Time spent per pipeline stage: ref_feature, g2p, bert, t2s_prefill, t2s_decode_token, vits_decode, postprocess")
+metrics.describe("tts_t2s_tokens_total", "counter", "Semantic tokens generated by the T2S decoder")
+metrics.describe("tts_t2s_seconds_total", "counter", "Compute seconds spent in T2S prefill and decoding")
+metrics.describe("tts_tokens_per_second", "gauge", "T2S decode throughput of the most recent call")
+metrics.describe("tts_t2s_batch_size", "histogram", "Rows decoded together per T2S step",
+                 buckets=(1, 2, 4, 8, 16, 32, 64))
+metrics.describe("tts_real_time_factor", "histogram", "Synthesis compute time divided by audio duration",
+                 buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 4))
+metrics.describe("tts_audio_seconds_total", "counter", "Seconds of audio synthesized")
+metrics.describe("tts_synthesis_seconds_total", "counter", "Compute seconds spent synthesizing audio")
+metrics.describe("tts_cache_requests_total", "counter", "Cache lookups by cache and result (hit/miss)")
+metrics.describe("tts_first_audio_seconds", "histogram",
+                 "Time from the start of a streaming_decode request to its first audio chunk")
+
+
+def record_t2s(prefill_seconds, decode_seconds, steps, tokens):
+    """One T2S call: prefill time, decode time over `steps` steps producing `tokens` tokens"""
+    metrics.observe("tts_stage_seconds", prefill_seconds, stage="t2s_prefill")
+    if steps > 0:
+        metrics.observe("tts_stage_seconds", decode_seconds / steps, stage="t2s_decode_token")
+    metrics.inc("tts_t2s_tokens_total", tokens)
+    metrics.inc("tts_t2s_seconds_total", prefill_seconds + decode_seconds)
+    if decode_seconds > 0:
+        metrics.set("tts_tokens_per_second", round(tokens / decode_seconds, 3))
+
+
+def record_synthesis(compute_seconds, audio_seconds):
+    metrics.inc("tts_synthesis_seconds_total", compute_seconds)
+    metrics.inc("tts_audio_seconds_total", audio_seconds)
+    if audio_seconds > 0:
+        metrics.observe("tts_real_time_factor", compute_seconds / audio_seconds)
+
+
+def record_cache(cache, hit):
+    metrics.inc("tts_cache_requests_total", cache=cache, result="hit" if hit else "miss")
@@ -158,11 +158,13 @@ import soundfile as sf
 from fastapi import FastAPI, Request, Query, HTTPException
 from fastapi.responses import StreamingResponse, JSONResponse
 import uvicorn
-from transformers import AutoModelForMaskedLM, AutoTokenizer
+from transformers import AutoTokenizer
 import numpy as np
 from feature_extractor import cnhubert
+from feature_extractor import bert as bert_extractor
 from io import BytesIO
-from module.models import SynthesizerTrn
+from module.models import load_sovits_for_inference
+from int8_quantization import use_int8, quantize_linear_int8, quantize_t2s_int8
 from AR.models.t2s_lightning_module import Text2SemanticLightningModule
 from text import cleaned_text_to_sequence
 from text.cleaner import clean_text
@@ -225,20 +227,17 @@ def get_sovits_weights(sovits_path):
         hps.model.version = "v2"
     logger.info(f"模型版本: {hps.model.version}")
     model_params_dict = vars(hps.model)
-    vq_model = SynthesizerTrn(
+    vq_model = load_sovits_for_inference(
+        dict_s2,
         hps.data.filter_length // 2 + 1,
         hps.train.segment_size // hps.data.hop_length,
         n_speakers=hps.data.n_speakers,
         **model_params_dict
     )
-    if ("pretrained" not in sovits_path):
-        del vq_model.enc_q
     if is_half == True:
         vq_model = vq_model.half().to(device)
     else:
         vq_model = vq_model.to(device)
-    vq_model.eval()
-    vq_model.load_state_dict(dict_s2["weight"], strict=False)
 
     sovits = Sovits(vq_model, hps)
     return sovits
@@ -260,6 +259,8 @@ def get_gpt_weights(gpt_path):
         t2s_model = t2s_model.half()
     t2s_model = t2s_model.to(device)
     t2s_model.eval()
+    if is_int8:
+        t2s_model = quantize_t2s_int8(t2s_model)
     total = sum([param.nelement() for param in t2s_model.parameters()])
     logger.info("Number of parameter: %.2fM" % (total / 1e6))
 
@@ -278,20 +279,7 @@ def change_gpt_sovits_weights(gpt_path,sovits_path):
 
 
 def get_bert_feature(text, word2ph):
-    with torch.no_grad():
-        inputs = tokenizer(text, return_tensors="pt")
-        for i in inputs:
-            inputs[i] = inputs[i].to(device)  #####输入是long不用管精度问题，精度随bert_model
-        res = bert_model(**inputs, output_hidden_states=True)
-        res = torch.cat(res["hidden_states"][-3:-2], -1)[0].cpu()[1:-1]
-    assert len(word2ph) == len(text)
-    phone_level_feature = []
-    for i in range(len(word2ph)):
-        repeat_feature = res[i].repeat(word2ph[i], 1)
-        phone_level_feature.append(repeat_feature)
-    phone_level_feature = torch.cat(phone_level_feature, dim=0)
-    # if(is_half==True):phone_level_feature=phone_level_feature.half()
-    return phone_level_feature.T
+    return bert_extractor.get_bert_feature(bert_model, tokenizer, text, word2ph, device)
 
 
 def clean_text_inf(text, language, version):
@@ -762,6 +750,7 @@ parser.add_argument("-fp", "--full_precision", action="store_true", default=Fals
 parser.add_argument("-hp", "--half_precision", action="store_true", default=False, help="覆盖config.is_half为True, 使用半精度")
 # bool值的用法为 `python ./api.py -fp ...`
 # 此时 full_precision==True, half_precision==False
+parser.add_argument("-cpr", "--cpu_precision", type=str, default=g_config.cpu_precision, help="纯CPU推理的精度, fp32 / int8")
 parser.add_argument("-sm", "--stream_mode", type=str, default="close", help="流式返回模式, close / normal / keepalive")
 parser.add_argument("-mt", "--media_type", type=str, default="wav", help="音频编码格式, wav / ogg / aac")
 parser.add_argument("-st", "--sub_type", type=str, default="int16", help="音频数据类型, int16 / int32")
@@ -809,6 +798,8 @@ if args.half_precision:
 if args.full_precision and args.half_precision:
     is_half = g_config.is_half  # 炒饭fallback
 logger.info(f"半精: {is_half}")
+is_int8 = not is_half and use_int8(args.cpu_precision, device)
+logger.info(f"int8动态量化: {is_int8}")
 
 # 流式返回模式
 if args.stream_mode.lower() in ["normal","n"]:
@@ -837,7 +828,7 @@ else:
 # 初始化模型
 cnhubert.cnhubert_base_path = cnhubert_base_path
 tokenizer = AutoTokenizer.from_pretrained(bert_path)
-bert_model = AutoModelForMaskedLM.from_pretrained(bert_path)
+bert_model = bert_extractor.get_model(bert_path)
 ssl_model = cnhubert.get_model()
 if is_half:
     bert_model = bert_model.half().to(device)
@@ -845,6 +836,9 @@ if is_half:
 else:
     bert_model = bert_model.to(device)
     ssl_model = ssl_model.to(device)
+if is_int8:
+    bert_model = quantize_linear_int8(bert_model)
+    ssl_model = quantize_linear_int8(ssl_model)
 change_gpt_sovits_weights(gpt_path = gpt_path, sovits_path = sovits_path)
 
 
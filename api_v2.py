@@ -8,6 +8,18 @@
     `-p` - `绑定端口, 默认9880`
     `-c` - `TTS配置文件路径, 默认"GPT_SoVITS/configs/tts_infer.yaml"`
 
+配置文件 custom 中设置 `continuous_batching: true` 后，并发请求的分句会在T2S解码的每个token边界动态加入同一个batch，
+生成完毕的分句立即移出，batch上限由 `max_batch_size` 控制（默认16）。
+
+纯CPU部署可在 custom 中设置 `cpu_precision: int8`，T2S、BERT、CNHuBERT 的 Linear 权重做int8动态量化；
+量化前后的差异可以用 `python benchmarks/check_int8_accuracy.py` 检查。
+
+custom 中设置 `backend: onnx` 和 `onnx_dir: GPT_SoVITS/onnx/<name>` 后，T2S和VITS改用 ONNX Runtime 运行导出的图
+（默认 `backend: torch`），导出: 在 GPT_SoVITS 目录下执行 `python onnx_export.py --gpt_path ... --vits_path ... --name <name>`。
+可选项: `ort_intra_op_threads` / `ort_inter_op_threads`（0为ORT默认）、`ort_io_binding`（默认开启，KV缓存不经过numpy）、
+`ort_cache_dir`（优化后的图缓存目录）。ONNX后端必须提供 prompt_text，采样参数和语速在导出时固定，请求中的对应参数不生效；
+`/set_gpt_weights` 和 `/set_sovits_weights` 不可用。
+
 ## 调用:
 
 ### 推理
@@ -39,7 +51,9 @@ POST:
     "streaming_mode": False,      # bool. whether to return a streaming response.
     "seed": -1,                   # int. random seed for reproducibility.
     "parallel_infer": True,       # bool. whether to use parallel inference.
-    "repetition_penalty": 1.35    # float. repetition penalty for T2S model.
+    "repetition_penalty": 1.35,   # float. repetition penalty for T2S model.
+    "streaming_decode": False,    # bool. vocode each sentence in chunks while it is generated, needs streaming_mode.
+    "stream_chunk_size": 20       # int. semantic tokens per streamed chunk (25 tokens = 1s of audio).
 }
 ```
 
@@ -69,6 +83,18 @@ POST:
 RESP: 无
 
 
+### 监控指标
+
+endpoint: `/metrics`
+
+GET:
+```
+http://127.0.0.1:9880/metrics
+```
+RESP: Prometheus 文本格式的各阶段耗时(参考特征、G2P、BERT、T2S prefill/逐token解码、VITS解码、后处理)、
+生成token数与速度、实时率(RTF)、T2S batch 占用和缓存命中次数
+
+
 ### 切换GPT模型
 
 endpoint: `/set_gpt_weights`
@@ -114,11 +140,13 @@ import soundfile as sf
 from fastapi import FastAPI, Request, HTTPException, Response
 from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi import FastAPI, UploadFile, File
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 from io import BytesIO
 from tools.i18n.i18n import I18nAuto
-from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config
+from GPT_SoVITS.TTS_infer_pack.TTS import TTS, TTS_Config, create_tts
 from GPT_SoVITS.TTS_infer_pack.text_segmentation_method import get_method_names as get_cut_method_names
+from tts_metrics import metrics
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 # print(sys.path)
@@ -141,7 +169,7 @@ if config_path in [None, ""]:
 
 tts_config = TTS_Config(config_path)
 print(tts_config)
-tts_pipeline = TTS(tts_config)
+tts_pipeline = create_tts(tts_config)
 
 APP = FastAPI()
 class TTS_Request(BaseModel):
@@ -165,6 +193,8 @@ class TTS_Request(BaseModel):
     streaming_mode:bool = False
     parallel_infer:bool = True
     repetition_penalty:float = 1.35
+    streaming_decode:bool = False
+    stream_chunk_size:int = 20
 
 ### modify from https://github.com/RVC-Boss/GPT-SoVITS/pull/894/files
 def pack_ogg(io_buffer:BytesIO, data:np.ndarray, rate:int):
@@ -295,7 +325,9 @@ async def tts_handle(req:dict):
                 "media_type": "wav",          # str. media type of the output audio, support "wav", "raw", "ogg", "aac".
                 "streaming_mode": False,      # bool. whether to return a streaming response.
                 "parallel_infer": True,       # bool.(optional) whether to use parallel inference.
-                "repetition_penalty": 1.35    # float.(optional) repetition penalty for T2S model.          
+                "repetition_penalty": 1.35,   # float.(optional) repetition penalty for T2S model.
+                "streaming_decode": False,    # bool.(optional) vocode each sentence in chunks while it is generated.
+                "stream_chunk_size": 20       # int.(optional) semantic tokens per streamed chunk.
             }
     returns:
         StreamingResponse: audio stream response.
@@ -310,6 +342,9 @@ async def tts_handle(req:dict):
 
     if streaming_mode:
         req["return_fragment"] = True
+    else:
+        # 非流式响应只取生成器的第一个结果, 分块声码会截断音频
+        req["streaming_decode"] = False
     
     try:
         tts_generator=tts_pipeline.run(req)
@@ -325,7 +360,9 @@ async def tts_handle(req:dict):
             return StreamingResponse(streaming_generator(tts_generator, media_type, ), media_type=f"audio/{media_type}")
     
         else:
-            sr, audio_data = next(tts_generator)
+            # 在线程池中推理，不阻塞事件循环；TTS.run 加锁设置参考音频/文本并按请求复制，并发请求互不串音色
+            # 开启 continuous_batching 时并发请求会合并进同一个T2S解码batch
+            sr, audio_data = await run_in_threadpool(next, tts_generator)
             audio_data = pack_audio(BytesIO(), audio_data, sr, media_type).getvalue()
             return Response(audio_data, media_type=f"audio/{media_type}")
     except Exception as e:
@@ -365,7 +402,9 @@ async def tts_get_endpoint(
                         media_type:str = "wav",
                         streaming_mode:bool = False,
                         parallel_infer:bool = True,
-                        repetition_penalty:float = 1.35
+                        repetition_penalty:float = 1.35,
+                        streaming_decode:bool = False,
+                        stream_chunk_size:int = 20
                         ):
     req = {
         "text": text,
@@ -387,7 +426,9 @@ async def tts_get_endpoint(
         "media_type":media_type,
         "streaming_mode":streaming_mode,
         "parallel_infer":parallel_infer,
-        "repetition_penalty":float(repetition_penalty)
+        "repetition_penalty":float(repetition_penalty),
+        "streaming_decode":streaming_decode,
+        "stream_chunk_size":int(stream_chunk_size)
     }
     return await tts_handle(req)
                 
@@ -398,6 +439,11 @@ async def tts_post_endpoint(request: TTS_Request):
     return await tts_handle(req)
 
 
+@APP.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @APP.get("/set_refer_audio")
 async def set_refer_aduio(refer_audio_path: str = None):
     try:
@@ -1,13 +1,18 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, send_from_directory
 import os
+import json
 from waitress import serve
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
 
-from models.deepseek_api import DeepSeekAPI
+from models.deepseek_api import DeepSeekAPI, StreamAborted
 from models.conversation import ConversationManager
+from models.context_builder import ContextBuilder
 from models.auth import Auth
-from tts_service import generate_voice
+from models.tts_queue import TTSJobQueue
+import tts_service
+from tts_service import generate_voice_stream, SentenceSplitter, voice_cache
+from tts_metrics import metrics as tts_metrics
 
 # 确保必要的目录存在
 os.makedirs('voice', exist_ok=True)
@@ -25,14 +30,53 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # Initialize services
 auth = Auth()
-deepseek_api = DeepSeekAPI(api_key=os.getenv('DEEPSEEK_API_KEY'))
+deepseek_api = DeepSeekAPI(api_key=os.getenv('DEEPSEEK_API_KEY'), metrics=tts_metrics)
 conversation_manager = ConversationManager(storage_dir='conversations')
+# Keep each DeepSeek request within a token budget; older turns are folded into a stored summary
+context_builder = ContextBuilder(
+    conversation_manager,
+    deepseek_api.summarize,
+    max_tokens=int(os.getenv('CONTEXT_MAX_TOKENS', 6000)),
+    summary_batch=int(os.getenv('CONTEXT_SUMMARY_BATCH', 10)),
+    tokenizer_path=os.getenv('DEEPSEEK_TOKENIZER_PATH'),
+    summary_chunk_tokens=int(os.getenv('CONTEXT_SUMMARY_CHUNK_TOKENS', 3000))
+)
+# Voice synthesis runs in its own worker(s) so the text reply is not blocked by TTS
+tts_queue = TTSJobQueue(
+    generate_voice_stream,
+    max_workers=int(os.getenv('TTS_WORKERS', 1)),
+    max_pending=int(os.getenv('TTS_MAX_PENDING', 32))
+)
+tts_metrics.describe('tts_queue_jobs', 'gauge', 'Voice jobs currently tracked by status')
+tts_metrics.describe('voice_cache_bytes', 'gauge', 'Disk usage of the synthesized-utterance cache')
+
+# 后台加载并预热全部模型；放在导入时启动，waitress-serve、flask run 等任何WSGI方式都会触发
+tts_service.start_background(warmup=os.getenv('TTS_WARMUP', 'True').lower() == 'true')
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'txt', 'csv'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# 启动期间也可访问：就绪检查、监控指标、登录页及其静态资源
+READY_EXEMPT_ENDPOINTS = ('ready', 'prometheus_metrics', 'login', 'logout', 'static')
+
+@app.before_request
+def require_ready():
+    # 与 /ready 判断一致：模型加载和预热完成前、或加载失败后，其余请求返回503
+    if request.endpoint in READY_EXEMPT_ENDPOINTS:
+        return None
+    status = tts_service.get_status()
+    if status['state'] == 'failed':
+        return {'error': 'Voice models failed to load', 'detail': status['error']}, 503
+    if not status['ready']:
+        return {'error': 'Service is starting, please retry shortly'}, 503
+
+@app.route('/ready')
+def ready():
+    status = tts_service.get_status()
+    return status, (200 if status['ready'] else 503)
+
 @app.route('/')
 def home():
     if 'user_id' not in session:
@@ -69,32 +113,101 @@ def chat():
     user_id = session['user_id']
     message = request.form.get('message', '')
     
-    # Get conversation history
-    conversation = conversation_manager.get_conversation(user_id)
+    # Get conversation history, fitted to the token budget
+    conversation = context_builder.build_history(user_id, message, deepseek_api.admin_instruction)
     
-    # Call DeepSeek API
-    response = deepseek_api.generate_response(message, conversation)
+    # Call DeepSeek API; a coalesced duplicate request (double-clicked send) does not save the turn again
+    response = deepseek_api.generate_response(
+        message, conversation, user_id=user_id,
+        on_complete=lambda reply: conversation_manager.save_conversation(user_id, message, reply)
+    )
     
-    # Save conversation
-    conversation_manager.save_conversation(user_id, message, response)
-    
-    # 生成语音
-    try:
-        voice_file = generate_voice(response)
-        if voice_file and os.path.exists(voice_file):
-            voice_relative_path = "/voice/" + os.path.basename(voice_file)
-        else:
-            print("警告：语音文件未成功生成或不存在")
-            voice_relative_path = None
-    except Exception as e:
-        print(f"生成语音时出错: {e}")
-        voice_relative_path = None
+    # 语音合成放入后台队列，文本回复立即返回，前端订阅 /voice_stream 逐句获取语音
+    voice_job = tts_queue.submit(response)
     
     return {
         'response': response,
-        'voice_file': voice_relative_path
+        'voice_job': voice_job
+    }
+
+@app.route('/chat_stream', methods=['POST'])
+def chat_stream():
+    """Stream the reply as server-sent events and start voicing each sentence while the LLM is still generating"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    user_id = session['user_id']
+    message = request.form.get('message', '')
+    conversation = context_builder.build_history(user_id, message, deepseek_api.admin_instruction)
+    
+    def events():
+        voice_job = tts_queue.open()
+        splitter = SentenceSplitter()
+        response = ''
+        try:
+            yield "event: voice_job\ndata: " + json.dumps({'voice_job': voice_job}) + "\n\n"
+            # 回复完整生成后由发起API调用的请求保存一次；合并进来的重复请求和客户端断开都不影响
+            for delta in deepseek_api.generate_response_stream(
+                    message, conversation, user_id=user_id,
+                    on_complete=lambda reply: conversation_manager.save_conversation(user_id, message, reply)):
+                response += delta
+                for sentence in splitter.feed(delta):
+                    tts_queue.feed(voice_job, sentence)
+                yield "data: " + json.dumps({'delta': delta}) + "\n\n"
+            for sentence in splitter.flush():
+                tts_queue.feed(voice_job, sentence)
+            
+            yield "event: end\ndata: " + json.dumps({'response': response}) + "\n\n"
+        except StreamAborted as e:
+            # 上游中断，回复不完整：不写入对话记录，通知前端
+            yield "event: error\ndata: " + json.dumps({'error': f"Sorry, I encountered an error while processing your request: {e}"}) + "\n\n"
+        finally:
+            tts_queue.close(voice_job)
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _voice_urls(voice_files):
+    # 语音文件可能位于 voice/cache 子目录，按相对 voice 目录的路径生成URL
+    return ["/voice/" + os.path.relpath(voice_file, 'voice').replace(os.sep, '/') for voice_file in voice_files]
+
+@app.route('/voice_status/<job_id>')
+def voice_status(job_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    job = tts_queue.get_job(job_id)
+    if job is None:
+        return {'error': 'Unknown voice job'}, 404
+    
+    return {
+        'status': job['status'],
+        'voice_files': _voice_urls(job['fragments'])
     }
 
+@app.route('/voice_stream/<job_id>')
+def voice_stream(job_id):
+    """Server-sent events: push each voice fragment as soon as it is synthesized"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    def events():
+        sent = 0
+        while True:
+            job = tts_queue.wait_job(job_id, sent)
+            if job is None:
+                yield "event: end\ndata: " + json.dumps({'status': 'error'}) + "\n\n"
+                return
+            for voice_url in _voice_urls(job['fragments'][sent:]):
+                yield "data: " + json.dumps({'voice_file': voice_url}) + "\n\n"
+            sent = len(job['fragments'])
+            if job['status'] in ('done', 'error'):
+                yield "event: end\ndata: " + json.dumps({'status': job['status']}) + "\n\n"
+                return
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/admin/instruction', methods=['GET', 'POST'])
 def admin_instruction():
     if not session.get('is_admin', False):
@@ -108,6 +221,29 @@ def admin_instruction():
         
     return render_template('admin_instruction.html')
 
+@app.route('/admin/voice_cache')
+def admin_voice_cache():
+    if not session.get('is_admin', False):
+        return redirect(url_for('home'))
+    
+    return voice_cache.stats()
+
+@app.route('/admin/llm_stats')
+def admin_llm_stats():
+    if not session.get('is_admin', False):
+        return redirect(url_for('home'))
+    
+    return deepseek_api.get_latency_stats()
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # TTS各阶段耗时/吞吐、LLM延迟、缓存命中与合成队列，统一由 tts_metrics 注册表输出
+    # 磁盘占用和队列状态是瞬时值，抓取时刷新
+    tts_metrics.set('voice_cache_bytes', voice_cache.stats()['bytes'])
+    for status, count in tts_queue.stats().items():
+        tts_metrics.set('tts_queue_jobs', count, status=status)
+    return Response(tts_metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'user_id' not in session:
@@ -146,4 +282,5 @@ def serve_voice(filename):
 if __name__ == "__main__":
     port = int(os.getenv('PORT', 8080))
     print(f"启动服务器在 0.0.0.0:{port}")
-    serve(app, host='0.0.0.0', port=port)
\ No newline at end of file
+    # 语音流(SSE)连接会占用工作线程直到合成结束，线程数需比默认的4更宽裕
+    serve(app, host='0.0.0.0', port=port, threads=int(os.getenv('WAITRESS_THREADS', 16)))
\ No newline at end of file
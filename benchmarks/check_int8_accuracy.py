@@ -0,0 +1,216 @@
+"""
+Accuracy check of the CPU int8 mode (cpu_precision: int8) against fp32 on the benchmark corpus.
+
+Both precisions run the same pipeline with greedy T2S decoding (top_k=1), so any difference
+comes from quantization. Per text it reports:
+    - bert_max_abs / bert_cosine: phone-level BERT features, int8 vs fp32
+    - token_match: share of positions where the semantic tokens agree, first_divergence
+    - mel_l1: mean absolute log-mel difference of the decoded audio (SoVITS itself stays fp32)
+    - bert/t2s seconds for both precisions
+The prompt semantic tokens (CNHuBERT + codebook) are compared once.
+
+Usage (from the repository root):
+    python benchmarks/check_int8_accuracy.py
+    python benchmarks/check_int8_accuracy.py --models-json my_models.json --min-token-match 0.9 --max-mel-l1 0.5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+GPT_SOVITS_DIR = os.path.join(REPO_DIR, "GPT_SoVITS")
+for path in (REPO_DIR, GPT_SOVITS_DIR):
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the CPU int8 mode against fp32")
+    parser.add_argument("--corpus", default=os.path.join(BENCHMARK_DIR, "corpus.json"))
+    parser.add_argument("--models-json", default=None,
+                        help="JSON with gpt_path, sovits_path, bert_path, cnhubert_base_path, ref_wav "
+                             "(and optionally ref_text); random models are built when omitted")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-sec", type=int, default=4, help="max_sec of the random GPT model")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--cache-dir", default=os.path.join(BENCHMARK_DIR, ".cache"))
+    parser.add_argument("--output", default=None, help="Report path (default: benchmarks/results/int8_<time>.json)")
+    parser.add_argument("--min-token-match", type=float, default=None, help="Fail when the mean token match is lower")
+    parser.add_argument("--max-mel-l1", type=float, default=None, help="Fail when the mean mel L1 is higher")
+    return parser.parse_args(argv)
+
+
+def load_tts(paths, cpu_precision):
+    from TTS_infer_pack.TTS import TTS
+    return TTS({
+        "version": "v2",
+        "custom": {
+            "device": "cpu",
+            "is_half": False,
+            "version": "v2",
+            "t2s_weights_path": paths["gpt_path"],
+            "vits_weights_path": paths["sovits_path"],
+            "bert_base_path": paths["bert_path"],
+            "cnhuhbert_base_path": paths["cnhubert_base_path"],
+            "cpu_precision": cpu_precision,
+        },
+    })
+
+
+def log_mel(tts, audio):
+    import torch
+    from module.mel_processing import mel_spectrogram_torch
+    mel = mel_spectrogram_torch(
+        audio.float().clamp(-1, 1).unsqueeze(0),
+        tts.configs.filter_length, 128, tts.configs.sampling_rate,
+        tts.configs.hop_length, tts.configs.win_length, 0, None,
+    )
+    return mel[0]
+
+
+def synthesize(tts, item, ref_text, ref_lang):
+    """Greedy T2S + SoVITS decode of one text as a single segment, with per-stage timings"""
+    import torch
+    version = tts.configs.version
+    preprocessor = tts.text_preprocessor
+    prompt_phones, prompt_bert, _ = preprocessor.segment_and_extract_feature_for_text(ref_text, ref_lang, version)
+
+    start = time.perf_counter()
+    phones, bert, _ = preprocessor.segment_and_extract_feature_for_text(item["text"], item["lang"], version)
+    bert_seconds = time.perf_counter() - start
+
+    all_phones = torch.LongTensor(prompt_phones + phones)
+    all_bert = torch.cat([prompt_bert, bert], dim=1).float()
+    prompt = tts.prompt_cache["prompt_semantic"].unsqueeze(0)
+
+    start = time.perf_counter()
+    with torch.no_grad():
+        pred_semantic_list, idx_list = tts.t2s_model.model.infer_panel_naive_batched(
+            [all_phones], torch.LongTensor([all_phones.shape[-1]]), prompt, [all_bert],
+            top_k=1, top_p=1, temperature=1,
+            early_stop_num=tts.configs.hz * tts.configs.max_sec,
+        )
+    t2s_seconds = time.perf_counter() - start
+    tokens = pred_semantic_list[0][-idx_list[0]:]
+
+    with torch.no_grad():
+        audio = tts.vits_model.decode(
+            tokens.unsqueeze(0).unsqueeze(0), torch.LongTensor(phones).unsqueeze(0), tts.prompt_cache["refer_spec"]
+        ).detach()[0, 0, :]
+    return {"bert": bert, "tokens": tokens, "audio": audio,
+            "bert_seconds": bert_seconds, "t2s_seconds": t2s_seconds}
+
+
+def token_agreement(a, b):
+    n = min(len(a), len(b))
+    if n == 0:
+        return 0.0, 0
+    equal = (a[:n] == b[:n])
+    divergence = int((~equal).nonzero()[0]) if not bool(equal.all()) else n
+    return round(float(equal.float().mean()) * n / max(len(a), len(b)), 4), divergence
+
+
+def compare(tts, fp32, int8):
+    import torch
+    bert_cosine = torch.nn.functional.cosine_similarity(
+        fp32["bert"].flatten().float(), int8["bert"].flatten().float(), dim=0)
+    token_match, first_divergence = token_agreement(fp32["tokens"], int8["tokens"])
+    mel_a, mel_b = log_mel(tts, fp32["audio"]), log_mel(tts, int8["audio"])
+    frames = min(mel_a.shape[-1], mel_b.shape[-1])
+    return {
+        "bert_max_abs": round(float((fp32["bert"] - int8["bert"]).abs().max()), 5),
+        "bert_cosine": round(float(bert_cosine), 5),
+        "tokens": [len(fp32["tokens"]), len(int8["tokens"])],
+        "token_match": token_match,
+        "first_divergence": first_divergence,
+        "mel_l1": round(float((mel_a[:, :frames] - mel_b[:, :frames]).abs().mean()), 5),
+        "bert_seconds": [round(fp32["bert_seconds"], 4), round(int8["bert_seconds"], 4)],
+        "t2s_seconds": [round(fp32["t2s_seconds"], 4), round(int8["t2s_seconds"], 4)],
+    }
+
+
+def run_precision(paths, corpus, cpu_precision, seed):
+    import torch
+    tts = load_tts(paths, cpu_precision)
+    ref_text = paths.get("ref_text", corpus["ref_text"])
+    tts.set_ref_audio(paths["ref_wav"])
+    # 预热, 首次调用的初始化不计入耗时
+    synthesize(tts, corpus["warmup"], ref_text, corpus["ref_lang"])
+    outputs = {}
+    for item in corpus["texts"]:
+        torch.manual_seed(seed)
+        outputs[item["id"]] = synthesize(tts, item, ref_text, corpus["ref_lang"])
+    return tts, tts.prompt_cache["prompt_semantic"].clone(), outputs
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+    if args.models_json:
+        with open(args.models_json, encoding="utf-8") as f:
+            paths = json.load(f)
+    else:
+        from random_models import build_random_models
+        # 随机权重没有配套的G2PW模型, 中文注音退回 pypinyin
+        os.environ["is_g2pw"] = "False"
+        all_texts = [corpus["ref_text"], corpus["warmup"]["text"]] + [item["text"] for item in corpus["texts"]]
+        paths = build_random_models(os.path.join(args.cache_dir, "random_models"), all_texts,
+                                    seed=args.seed, max_sec=args.max_sec)
+    paths = {k: os.path.abspath(v) if k.endswith("_path") or k == "ref_wav" else v for k, v in paths.items()}
+
+    import torch
+    torch.set_num_threads(args.threads)
+    # TTS 会写 GPT_SoVITS/configs/tts_infer.yaml, 工作目录放在缓存里
+    work_dir = os.path.join(os.path.abspath(args.cache_dir), "work")
+    os.makedirs(work_dir, exist_ok=True)
+    output = os.path.abspath(args.output) if args.output else os.path.join(
+        BENCHMARK_DIR, "results", "int8_%s.json" % datetime.now().strftime("%Y%m%d_%H%M%S"))
+    os.chdir(work_dir)
+
+    tts, prompt_fp32, outputs_fp32 = run_precision(paths, corpus, "fp32", args.seed)
+    del tts
+    tts, prompt_int8, outputs_int8 = run_precision(paths, corpus, "int8", args.seed)
+
+    prompt_match, _ = token_agreement(prompt_fp32, prompt_int8)
+    results = {item_id: compare(tts, outputs_fp32[item_id], outputs_int8[item_id]) for item_id in outputs_fp32}
+    mean_token_match = sum(r["token_match"] for r in results.values()) / len(results)
+    mean_mel_l1 = sum(r["mel_l1"] for r in results.values()) / len(results)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "models": paths,
+        "prompt_token_match": prompt_match,
+        "mean_token_match": round(mean_token_match, 4),
+        "mean_mel_l1": round(mean_mel_l1, 5),
+        "texts": results,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print("\n%-16s %10s %11s %8s %9s %15s %15s" % (
+        "text", "bert_cos", "token_match", "diverge", "mel_l1", "bert s fp32/i8", "t2s s fp32/i8"))
+    for item_id, r in results.items():
+        print("%-16s %10s %11s %8s %9s %15s %15s" % (
+            item_id, r["bert_cosine"], r["token_match"], r["first_divergence"], r["mel_l1"],
+            "%.3f/%.3f" % tuple(r["bert_seconds"]), "%.3f/%.3f" % tuple(r["t2s_seconds"])))
+    print("prompt token match %s, mean token match %s, mean mel L1 %s" % (
+        prompt_match, report["mean_token_match"], report["mean_mel_l1"]))
+    print(f"Report written to {output}")
+
+    failed = False
+    if args.min_token_match is not None and mean_token_match < args.min_token_match:
+        print(f"FAIL: mean token match {mean_token_match:.4f} < {args.min_token_match}")
+        failed = True
+    if args.max_mel_l1 is not None and mean_mel_l1 > args.max_mel_l1:
+        print(f"FAIL: mean mel L1 {mean_mel_l1:.5f} > {args.max_mel_l1}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
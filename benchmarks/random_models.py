@@ -0,0 +1,155 @@
+# 随机初始化的小模型, 结构和接口与正式权重一致, 让基准测试在没有预训练权重的CPU机器上也能跑
+import os
+import json
+
+import numpy as np
+import soundfile as sf
+import torch
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+GPT_SOVITS_DIR = os.path.join(REPO_DIR, "GPT_SoVITS")
+
+# 结构参数变化时调高版本号, 旧的缓存目录会被重新生成
+MODELS_VERSION = 1
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+
+
+def _build_bert(out_dir, texts):
+    """Character-level BERT with the 1024-dim hidden states the T2S bert_proj expects"""
+    from transformers import BertConfig, BertForMaskedLM, BertTokenizerFast
+
+    chars = sorted(set("".join(texts)) - set(" \n"))
+    vocab = SPECIAL_TOKENS + [c for c in chars if c not in SPECIAL_TOKENS]
+    os.makedirs(out_dir, exist_ok=True)
+    vocab_file = os.path.join(out_dir, "vocab.txt")
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(vocab) + "\n")
+    BertTokenizerFast(vocab_file=vocab_file, do_lower_case=True).save_pretrained(out_dir)
+
+    config = BertConfig(
+        vocab_size=len(vocab),
+        hidden_size=1024,
+        num_hidden_layers=3,
+        num_attention_heads=16,
+        intermediate_size=1024,
+        max_position_embeddings=512,
+    )
+    BertForMaskedLM(config).save_pretrained(out_dir)
+
+
+def _build_cnhubert(out_dir):
+    """HuBERT with 768-dim outputs (SynthesizerTrn hard-codes ssl_dim=768) and a narrow conv front end"""
+    from transformers import HubertConfig, HubertModel, Wav2Vec2FeatureExtractor
+
+    config = HubertConfig(
+        hidden_size=768,
+        num_hidden_layers=2,
+        num_attention_heads=12,
+        intermediate_size=1024,
+        conv_dim=(128,) * 7,
+    )
+    HubertModel(config).save_pretrained(out_dir)
+    Wav2Vec2FeatureExtractor(
+        feature_size=1, sampling_rate=16000, padding_value=0.0, do_normalize=True, return_attention_mask=False
+    ).save_pretrained(out_dir)
+
+
+def _build_gpt(path, max_sec):
+    from AR.models.t2s_lightning_module import Text2SemanticLightningModule
+
+    config = {
+        "data": {"max_sec": max_sec, "pad_val": 1024},
+        "model": {
+            "vocab_size": 1025,
+            "phoneme_vocab_size": 732,
+            "embedding_dim": 256,
+            "hidden_dim": 256,
+            "head": 4,
+            "linear_units": 1024,
+            "n_layer": 2,
+            "dropout": 0,
+            "EOS": 1024,
+            "random_bert": 0,
+        },
+        "inference": {"top_k": 15},
+    }
+    model = Text2SemanticLightningModule(config, "****", is_train=False)
+    with torch.no_grad():
+        # EOS的logit恒为0, 随机权重下几乎不会被采样, 每段都解码到 early_stop_num,
+        # 各次跑分生成的token数相同, 结果才可比
+        model.model.ar_predict_layer.weight[config["model"]["EOS"]].zero_()
+    torch.save({"config": config, "info": "random-init benchmark model", "weight": model.state_dict()}, path)
+
+
+def _build_sovits(path):
+    from module.models import SynthesizerTrn
+
+    with open(os.path.join(GPT_SOVITS_DIR, "configs", "s2.json")) as f:
+        hps = json.load(f)
+    # MRTE 固定了 192 维内容编码和 512 维说话人向量, 这两项不能缩小
+    hps["model"].update({
+        "n_layers": 2,
+        "filter_channels": 384,
+        "upsample_initial_channel": 128,
+        "resblock_kernel_sizes": [3],
+        "resblock_dilation_sizes": [[1, 3, 5]],
+        "n_layers_q": 1,
+        "version": "v2",
+    })
+    model = SynthesizerTrn(
+        hps["data"]["filter_length"] // 2 + 1,
+        hps["train"]["segment_size"] // hps["data"]["hop_length"],
+        n_speakers=hps["data"]["n_speakers"],
+        **hps["model"]
+    )
+    weight = {k: v for k, v in model.state_dict().items() if not k.startswith("enc_q.")}
+    torch.save({"config": hps, "info": "random-init benchmark model", "weight": weight}, path)
+
+
+def _build_ref_wav(path, seconds=4.0, sr=32000, seed=0):
+    """Deterministic voiced-like signal within the 3~10 s reference range"""
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    f0 = 180 + 25 * np.sin(2 * np.pi * 0.7 * t) + 8 * np.sin(2 * np.pi * 5.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voice = sum(np.sin(k * phase) / k for k in range(1, 12))
+    syllables = 0.55 + 0.45 * np.sin(2 * np.pi * 3.2 * t) ** 2
+    audio = 0.25 * voice * syllables + 0.01 * rng.randn(len(t))
+    audio = audio / np.abs(audio).max() * 0.8
+    sf.write(path, audio.astype(np.float32), sr, subtype="PCM_16")
+
+
+def build_random_models(out_dir, texts, seed=0, max_sec=4):
+    """
+    Write random-initialized GPT/SoVITS checkpoints, BERT and CNHuBERT directories and a
+    reference wav into out_dir and return their paths. Reuses out_dir when it was built
+    with the same seed, max_sec and MODELS_VERSION.
+    """
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    settings = {"version": MODELS_VERSION, "seed": seed, "max_sec": max_sec}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("settings") == settings:
+            return manifest["paths"]
+
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {
+        "gpt_path": os.path.join(out_dir, "gpt_random.ckpt"),
+        "sovits_path": os.path.join(out_dir, "sovits_random.pth"),
+        "bert_path": os.path.join(out_dir, "chinese-roberta-random"),
+        "cnhubert_base_path": os.path.join(out_dir, "chinese-hubert-random"),
+        "ref_wav": os.path.join(out_dir, "ref.wav"),
+    }
+    print(f"Building random-initialized benchmark models in {out_dir}")
+    torch.manual_seed(seed)
+    _build_bert(paths["bert_path"], texts)
+    _build_cnhubert(paths["cnhubert_base_path"])
+    _build_gpt(paths["gpt_path"], max_sec)
+    _build_sovits(paths["sovits_path"])
+    _build_ref_wav(paths["ref_wav"], seed=seed)
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"settings": settings, "paths": paths}, f, indent=2)
+    return paths
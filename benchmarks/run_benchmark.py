@@ -0,0 +1,448 @@
+"""
+TTS benchmark: runs TTS_infer_pack.TTS.run and inference_webui.get_tts_wav over a fixed corpus
+and reports time-to-first-audio, real-time factor, T2S tokens/sec, peak RSS and per-stage times.
+
+Every configuration of the sweep runs in its own subprocess so peak RSS, thread settings and
+model precision do not leak between runs. Without --models-json, small random-initialized models
+are generated (benchmarks/random_models.py), so the suite runs on a CPU-only box without weights.
+
+Usage (from the repository root):
+    python benchmarks/run_benchmark.py
+    python benchmarks/run_benchmark.py --backends tts --batch-size 1,8 --threads 1,4 --save-baseline
+    python benchmarks/run_benchmark.py --models-json my_models.json --device cuda --precision fp32,fp16
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import itertools
+import subprocess
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+GPT_SOVITS_DIR = os.path.join(REPO_DIR, "GPT_SoVITS")
+for path in (REPO_DIR, GPT_SOVITS_DIR):
+    if path not in sys.path:
+        sys.path.append(path)
+
+RESULT_MARKER = "BENCHMARK_RESULT "
+# 与基线对比的指标及其方向
+COMPARED_METRICS = {
+    "ttfa_seconds": "lower",
+    "rtf": "lower",
+    "tokens_per_second": "higher",
+    "peak_rss_mb": "lower",
+}
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _str_list(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="GPT-SoVITS inference benchmark")
+    parser.add_argument("--backends", type=_str_list, default=["tts", "webui"],
+                        help="tts (TTS_infer_pack.TTS.run) and/or webui (inference_webui.get_tts_wav)")
+    parser.add_argument("--batch-size", type=_int_list, default=[1, 4], help="TTS.run batch_size values")
+    parser.add_argument("--parallel-infer", type=_int_list, default=[1, 0], help="TTS.run parallel_infer values (1/0)")
+    parser.add_argument("--split-bucket", type=_int_list, default=[1, 0], help="TTS.run split_bucket values (1/0)")
+    parser.add_argument("--precision", type=_str_list, default=["fp32"], help="fp32, fp16 (needs CUDA) and/or int8 (CPU dynamic quantization)")
+    parser.add_argument("--threads", type=_int_list, default=[1, 4], help="CPU thread counts")
+    parser.add_argument("--return-fragment", type=_int_list, default=[0],
+                        help="1 streams fragments, so time-to-first-audio measures the first segment")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--texts", type=_str_list, default=None, help="Corpus text ids to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per text")
+    parser.add_argument("--corpus", default=os.path.join(BENCHMARK_DIR, "corpus.json"))
+    parser.add_argument("--models-json", default=None,
+                        help="JSON with gpt_path, sovits_path, bert_path, cnhubert_base_path, ref_wav "
+                             "(and optionally ref_text); random models are built when omitted")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-sec", type=int, default=4, help="max_sec of the random GPT model (tokens per segment / 50)")
+    parser.add_argument("--cache-dir", default=os.path.join(BENCHMARK_DIR, ".cache"))
+    parser.add_argument("--output", default=None, help="Report path (default: benchmarks/results/report_<time>.json)")
+    parser.add_argument("--baseline", default=os.path.join(BENCHMARK_DIR, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="Also write this report as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Relative change counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--timeout", type=int, default=3600, help="Seconds allowed per configuration")
+    parser.add_argument("--verbose", action="store_true", help="Echo worker output")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def config_key(config):
+    key = "%s|%s|%s|threads=%d|fragment=%d" % (
+        config["backend"], config["device"], config["precision"], config["threads"], config["return_fragment"])
+    if config["backend"] == "tts":
+        key += "|bs=%d|parallel=%d|bucket=%d" % (config["batch_size"], config["parallel_infer"], config["split_bucket"])
+    return key
+
+
+def expand_grid(args):
+    """Every configuration of the sweep; get_tts_wav has no batching knobs so webui ignores those axes"""
+    configs = {}
+    for backend, precision, threads, fragment in itertools.product(
+            args.backends, args.precision, args.threads, args.return_fragment):
+        base = {"backend": backend, "device": args.device, "precision": precision,
+                "threads": threads, "return_fragment": fragment}
+        if backend == "tts":
+            for batch_size, parallel, bucket in itertools.product(args.batch_size, args.parallel_infer, args.split_bucket):
+                config = dict(base, batch_size=batch_size, parallel_infer=parallel, split_bucket=bucket)
+                configs[config_key(config)] = config
+        elif backend == "webui":
+            configs[config_key(base)] = base
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+    return configs
+
+
+# ---------------------------------------------------------------- worker
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 以KB计, macOS 以字节计
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        try:
+            import psutil
+            info = psutil.Process().memory_info()
+            return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+        except ImportError:
+            return None
+
+
+def _stage_breakdown(snapshot):
+    prefix = 'tts_stage_seconds{stage="'
+    stages = {}
+    for key, histogram in snapshot["histograms"].items():
+        if not key.startswith(prefix):
+            continue
+        count = histogram["count"]
+        stages[key[len(prefix):-2]] = {
+            "count": count,
+            "total_seconds": round(histogram["sum"], 4),
+            "mean_seconds": round(histogram["sum"] / count, 6) if count else 0,
+        }
+    return stages
+
+
+def _load_backend(config, paths, corpus):
+    """Load the models once and return synthesize(item, seed, return_fragment) -> iterator of (sr, audio)"""
+    import torch
+    is_half = config["precision"] == "fp16"
+    ref_text = paths.get("ref_text", corpus["ref_text"])
+
+    if config["backend"] == "tts":
+        from TTS_infer_pack.TTS import TTS
+        tts = TTS({
+            "version": "v2",
+            "custom": {
+                "device": config["device"],
+                "is_half": is_half,
+                "version": "v2",
+                "t2s_weights_path": paths["gpt_path"],
+                "vits_weights_path": paths["sovits_path"],
+                "bert_base_path": paths["bert_path"],
+                "cnhuhbert_base_path": paths["cnhubert_base_path"],
+                "cpu_precision": "int8" if config["precision"] == "int8" else "fp32",
+            },
+        })
+
+        def synthesize(item, seed, return_fragment):
+            return tts.run({
+                "text": item["text"],
+                "text_lang": item["lang"],
+                "ref_audio_path": paths["ref_wav"],
+                "prompt_text": ref_text,
+                "prompt_lang": corpus["ref_lang"],
+                "top_k": 15,
+                "top_p": 1,
+                "temperature": 1,
+                "text_split_method": "cut1",
+                "batch_size": config["batch_size"],
+                "parallel_infer": bool(config["parallel_infer"]),
+                "split_bucket": bool(config["split_bucket"]),
+                "return_fragment": bool(return_fragment),
+                "seed": seed,
+            })
+        return synthesize
+
+    import inference_webui as webui
+    webui.change_sovits_weights(paths["sovits_path"])
+    webui.change_gpt_weights(paths["gpt_path"])
+    languages = {code: name for name, code in webui.dict_language.items()}
+
+    def synthesize(item, seed, return_fragment):
+        # get_tts_wav 没有 seed 参数, 在这里固定随机种子
+        torch.manual_seed(seed)
+        return webui.get_tts_wav(
+            paths["ref_wav"], ref_text, languages[corpus["ref_lang"]],
+            item["text"], languages[item["lang"]],
+            how_to_cut=webui.i18n("凑四句一切"), top_k=15, top_p=1, temperature=1,
+            return_fragment=bool(return_fragment),
+        )
+    return synthesize
+
+
+def _timed_run(synthesize, item, seed, return_fragment):
+    start = time.perf_counter()
+    ttfa = None
+    samples = 0
+    sampling_rate = None
+    for sampling_rate, audio in synthesize(item, seed, return_fragment):
+        if ttfa is None:
+            ttfa = time.perf_counter() - start
+        samples += len(audio)
+    wall = time.perf_counter() - start
+    audio_seconds = samples / sampling_rate if sampling_rate else 0.0
+    return {
+        "ttfa_seconds": round(ttfa if ttfa is not None else wall, 4),
+        "wall_seconds": round(wall, 4),
+        "audio_seconds": round(audio_seconds, 4),
+        "rtf": round(wall / audio_seconds, 4) if audio_seconds else None,
+    }
+
+
+def run_worker(job_path):
+    with open(job_path, encoding="utf-8") as f:
+        job = json.load(f)
+    config, paths, corpus = job["config"], job["paths"], job["corpus"]
+
+    import torch
+    torch.set_num_threads(config["threads"])
+    from tts_metrics import metrics
+
+    synthesize = _load_backend(config, paths, corpus)
+    # 预热: JIT、参考音频特征、文本前端的首次加载不计入结果
+    for _ in synthesize(corpus["warmup"], job["seed"], config["return_fragment"]):
+        pass
+    metrics.reset()
+
+    runs = []
+    for item in corpus["texts"]:
+        for i in range(job["repeat"]):
+            run = _timed_run(synthesize, item, job["seed"] + i, config["return_fragment"])
+            run["id"] = item["id"]
+            runs.append(run)
+
+    snapshot = metrics.snapshot()
+    tokens = snapshot["counters"].get("tts_t2s_tokens_total", 0)
+    t2s_seconds = snapshot["counters"].get("tts_t2s_seconds_total", 0)
+    wall = sum(run["wall_seconds"] for run in runs)
+    audio_seconds = sum(run["audio_seconds"] for run in runs)
+    summary = {
+        "ttfa_seconds": round(sum(run["ttfa_seconds"] for run in runs) / len(runs), 4),
+        "rtf": round(wall / audio_seconds, 4) if audio_seconds else None,
+        "tokens_per_second": round(tokens / t2s_seconds, 2) if t2s_seconds else None,
+        "t2s_tokens": tokens,
+        "wall_seconds": round(wall, 4),
+        "audio_seconds": round(audio_seconds, 4),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    if torch.cuda.is_available() and str(config["device"]).startswith("cuda"):
+        summary["peak_cuda_mb"] = round(torch.cuda.max_memory_allocated() / (1024 * 1024), 1)
+
+    result = {"summary": summary, "stages": _stage_breakdown(snapshot), "runs": runs}
+    print(RESULT_MARKER + json.dumps(result, ensure_ascii=False), flush=True)
+
+
+# ---------------------------------------------------------------- driver
+
+
+def run_config(args, config, paths, corpus, work_dir):
+    """Run one configuration in a fresh interpreter and return its result dict"""
+    os.makedirs(work_dir, exist_ok=True)
+    job_path = os.path.join(work_dir, "job.json")
+    with open(job_path, "w", encoding="utf-8") as f:
+        json.dump({"config": config, "paths": paths, "corpus": corpus, "seed": args.seed, "repeat": args.repeat},
+                  f, ensure_ascii=False)
+
+    env = dict(os.environ)
+    threads = str(config["threads"])
+    env.update({
+        "OMP_NUM_THREADS": threads,
+        "MKL_NUM_THREADS": threads,
+        "version": "v2",
+        "is_half": str(config["precision"] == "fp16"),
+        "cpu_precision": "int8" if config["precision"] == "int8" else "fp32",
+        "gpt_path": paths["gpt_path"],
+        "sovits_path": paths["sovits_path"],
+        "bert_path": paths["bert_path"],
+        "cnhubert_base_path": paths["cnhubert_base_path"],
+        "PYTHONIOENCODING": "utf-8",
+    })
+    if paths.get("random"):
+        # 随机权重没有配套的G2PW模型, 中文注音退回 pypinyin
+        env["is_g2pw"] = "False"
+    if config["device"] == "cpu":
+        env["CUDA_VISIBLE_DEVICES"] = ""
+
+    # 工作目录放在缓存里: webui 会写 ./weight.json, TTS 会写 GPT_SoVITS/configs/tts_infer.yaml
+    try:
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", job_path],
+            cwd=work_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, encoding="utf-8", errors="replace", timeout=args.timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return {"error": f"timed out after {args.timeout}s"}
+
+    lines = process.stdout.splitlines()
+    if args.verbose:
+        print(process.stdout)
+    for line in reversed(lines):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    return {"error": f"worker exited with code {process.returncode}", "log_tail": lines[-30:]}
+
+
+def compare_with_baseline(report, baseline, tolerance):
+    """Relative change per compared metric for every configuration present in both reports"""
+    baseline_results = {r["key"]: r for r in baseline.get("results", []) if "summary" in r}
+    rows = []
+    missing = []
+    for result in report["results"]:
+        if "summary" not in result:
+            continue
+        old = baseline_results.get(result["key"])
+        if old is None:
+            missing.append(result["key"])
+            continue
+        for metric, better in COMPARED_METRICS.items():
+            current, previous = result["summary"].get(metric), old["summary"].get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            regression = change > tolerance if better == "lower" else change < -tolerance
+            rows.append({
+                "key": result["key"],
+                "metric": metric,
+                "baseline": previous,
+                "current": current,
+                "change": round(change, 4),
+                "regression": regression,
+            })
+    return {
+        "baseline_created": baseline.get("created"),
+        "tolerance": tolerance,
+        "regressions": sum(1 for row in rows if row["regression"]),
+        "rows": rows,
+        "missing_in_baseline": missing,
+    }
+
+
+def environment_info():
+    import torch
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "cpu_count": os.cpu_count(),
+        "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        "git_commit": commit,
+    }
+
+
+def print_summary(report):
+    print("\n%-70s %8s %8s %10s %9s" % ("configuration", "TTFA(s)", "RTF", "tokens/s", "RSS(MB)"))
+    for result in report["results"]:
+        if "summary" in result:
+            s = result["summary"]
+            print("%-70s %8s %8s %10s %9s" % (result["key"], s["ttfa_seconds"], s["rtf"], s["tokens_per_second"], s["peak_rss_mb"]))
+        else:
+            print("%-70s %s" % (result["key"], result.get("skipped") or result.get("error")))
+
+    comparison = report.get("comparison")
+    if comparison:
+        print("\nCompared with baseline from %s (tolerance %.0f%%): %d regression(s)" % (
+            comparison["baseline_created"], comparison["tolerance"] * 100, comparison["regressions"]))
+        for row in comparison["rows"]:
+            if row["regression"]:
+                print("  REGRESSION %s %s: %s -> %s (%+.1f%%)" % (
+                    row["key"], row["metric"], row["baseline"], row["current"], row["change"] * 100))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.worker:
+        run_worker(args.worker)
+        return 0
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+    if args.texts:
+        corpus["texts"] = [item for item in corpus["texts"] if item["id"] in args.texts]
+
+    if args.models_json:
+        with open(args.models_json, encoding="utf-8") as f:
+            paths = json.load(f)
+    else:
+        from random_models import build_random_models
+        all_texts = [corpus["ref_text"], corpus["warmup"]["text"]] + [item["text"] for item in corpus["texts"]]
+        paths = build_random_models(os.path.join(args.cache_dir, "random_models"), all_texts,
+                                    seed=args.seed, max_sec=args.max_sec)
+        paths = dict(paths, random=True)
+
+    configs = expand_grid(args)
+    work_dir = os.path.join(args.cache_dir, "work")
+    results = []
+    for i, (key, config) in enumerate(configs.items()):
+        print(f"[{i + 1}/{len(configs)}] {key}")
+        if config["precision"] == "fp16" and config["device"] == "cpu":
+            results.append({"key": key, "config": config, "skipped": "fp16 needs a CUDA device"})
+            continue
+        if config["precision"] == "int8" and config["device"] != "cpu":
+            results.append({"key": key, "config": config, "skipped": "int8 is CPU only"})
+            continue
+        result = run_config(args, config, paths, corpus, work_dir)
+        if "error" in result:
+            print(f"  failed: {result['error']}")
+        results.append(dict(result, key=key, config=config))
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment_info(),
+        "models": "random" if paths.get("random") else args.models_json,
+        "corpus": [item["id"] for item in corpus["texts"]],
+        "repeat": args.repeat,
+        "results": results,
+        "comparison": None,
+    }
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            report["comparison"] = compare_with_baseline(report, json.load(f), args.tolerance)
+
+    output = args.output or os.path.join(BENCHMARK_DIR, "results",
+                                         "report_%s.json" % datetime.now().strftime("%Y%m%d_%H%M%S"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(dict(report, comparison=None), f, ensure_ascii=False, indent=2)
+
+    print_summary(report)
+    print(f"\nReport written to {output}")
+    if args.fail_on_regression and report["comparison"] and report["comparison"]["regressions"]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
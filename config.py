@@ -7,6 +7,8 @@ sovits_path = ""
 gpt_path = ""
 is_half_str = os.environ.get("is_half", "True")
 is_half = True if is_half_str.lower() == 'true' else False
+# 纯CPU推理的精度: fp32 或 int8（T2S、BERT、CNHuBERT 的 Linear 做动态量化），GPU上忽略
+cpu_precision = os.environ.get("cpu_precision", "fp32").lower()
 is_share_str = os.environ.get("is_share","False")
 is_share= True if is_share_str.lower() == 'true' else False
 
@@ -48,6 +50,7 @@ class Config:
         self.sovits_path = sovits_path
         self.gpt_path = gpt_path
         self.is_half = is_half
+        self.cpu_precision = cpu_precision
 
         self.cnhubert_path = cnhubert_path
         self.bert_path = bert_path
@@ -0,0 +1,202 @@
+import os
+import re
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+class ContextBuilder:
+    """
+    Build the conversation history sent to the LLM within a token budget.
+
+    The newest messages are kept verbatim as long as they fit. Everything older
+    is folded into a rolling summary that is computed once, stored next to the
+    conversation as user_<id>_summary.json, and only extended when more
+    messages fall out of the window.
+
+    Older messages are folded in chunks of at most summary_batch messages and
+    summary_chunk_tokens tokens, at most summary_max_chunks per fold, so a long
+    legacy log is caught up over several turns instead of in one unbounded call.
+    Folding runs in a background worker, so a request never waits for the
+    summarize call; it uses the summary as stored. The byte offset of the first
+    uncovered message is stored with the summary, so a fold reads only the new
+    messages of the log. After a failed summarize call the user's folding backs
+    off exponentially.
+    """
+
+    def __init__(self, conversation_manager, summarize, max_tokens=6000, summary_batch=10, tokenizer_path=None,
+                 summary_chunk_tokens=3000, summary_max_chunks=4, retry_backoff=30, max_retry_backoff=600):
+        # summarize(messages, previous_summary) -> new summary text, or None on failure
+        self.conversation_manager = conversation_manager
+        self.summarize = summarize
+        self.max_tokens = max_tokens
+        self.summary_batch = summary_batch
+        self.summary_chunk_tokens = summary_chunk_tokens
+        self.summary_max_chunks = summary_max_chunks
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        # user_id -> (consecutive failures, time before which folding is skipped)
+        self._failures = {}
+        self._folding = set()
+        self._folding_guard = threading.Lock()
+        self._fold_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+        self.tokenizer = None
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._count_cached = lru_cache(maxsize=4096)(self._count_tokens)
+
+        if tokenizer_path:
+            try:
+                from transformers import AutoTokenizer
+                self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+                print(f"Loaded tokenizer for context budgeting from {tokenizer_path}")
+            except Exception as e:
+                print(f"Error loading tokenizer from {tokenizer_path}, falling back to estimates: {e}")
+
+    def _count_tokens(self, text):
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        # DeepSeek's published rule of thumb: ~0.6 token per CJK character, ~0.3 per other character
+        cjk = len(re.findall(r"[　-〿㐀-鿿＀-￯]", text))
+        return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
+
+    def count_tokens(self, text):
+        return self._count_cached(text)
+
+    def count_message_tokens(self, message):
+        # A few extra tokens per message for the role and chat-template framing
+        return self.count_tokens(message["content"]) + 4
+
+    def _get_summary_path(self, user_id):
+        return os.path.join(self.conversation_manager.storage_dir, f"user_{user_id}_summary.json")
+
+    def _get_user_lock(self, user_id):
+        with self._locks_guard:
+            if user_id not in self._locks:
+                self._locks[user_id] = threading.Lock()
+            return self._locks[user_id]
+
+    def _load_summary(self, user_id):
+        path = self._get_summary_path(user_id)
+        if not os.path.exists(path):
+            return {"covered": 0, "summary": ""}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading conversation summary for user {user_id}: {e}")
+            return {"covered": 0, "summary": ""}
+
+    def _save_summary(self, user_id, summary):
+        path = self._get_summary_path(user_id)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error saving conversation summary for user {user_id}: {e}")
+
+    def _may_fold(self, user_id):
+        failures = self._failures.get(user_id)
+        return failures is None or time.time() >= failures[1]
+
+    def _record_failure(self, user_id):
+        count = self._failures.get(user_id, (0, 0))[0] + 1
+        delay = min(self.max_retry_backoff, self.retry_backoff * 2 ** (count - 1))
+        self._failures[user_id] = (count, time.time() + delay)
+        print(f"Summarizing conversation for user {user_id} failed, retrying in {delay}s")
+
+    def _next_chunk(self, candidates):
+        """Prefix of candidates [(message, offset)] within summary_chunk_tokens, as (chunk, offset after it)"""
+        chunk = []
+        tokens = 0
+        offset = None
+        for msg, next_offset in candidates:
+            content = msg["content"]
+            cost = self.count_message_tokens(msg)
+            if chunk and tokens + cost > self.summary_chunk_tokens:
+                break
+            if cost > self.summary_chunk_tokens:
+                # A single oversized message is cut to roughly the chunk budget
+                content = content[:max(1, len(content) * self.summary_chunk_tokens // cost)]
+            chunk.append({"role": msg["role"], "content": content})
+            tokens += cost
+            offset = next_offset
+        return chunk, offset
+
+    def _schedule_fold(self, user_id, end):
+        """Start a background fold towards history[:end] unless one is running or the user is backing off"""
+        with self._folding_guard:
+            if user_id in self._folding or not self._may_fold(user_id):
+                return
+            self._folding.add(user_id)
+        self._fold_executor.submit(self._fold, user_id, end)
+
+    def _fold(self, user_id, end):
+        """Extend the rolling summary towards history[:end], saving after each chunk"""
+        try:
+            with self._get_user_lock(user_id):
+                summary = self._load_summary(user_id)
+            if "offset" not in summary:
+                # Summaries written before offsets were stored: locate the first uncovered message once
+                covered = self.conversation_manager.read_messages_from(user_id, 0, summary["covered"])
+                summary["offset"] = covered[-1][1] if covered else 0
+            for _ in range(self.summary_max_chunks):
+                if summary["covered"] >= end:
+                    break
+                limit = min(self.summary_batch, end - summary["covered"])
+                candidates = self.conversation_manager.read_messages_from(user_id, summary["offset"], limit)
+                if not candidates:
+                    break
+                chunk, offset = self._next_chunk(candidates)
+                new_summary = self.summarize(chunk, summary["summary"])
+                if new_summary is None:
+                    self._record_failure(user_id)
+                    break
+                self._failures.pop(user_id, None)
+                summary = {"covered": summary["covered"] + len(chunk), "summary": new_summary, "offset": offset}
+                with self._get_user_lock(user_id):
+                    self._save_summary(user_id, summary)
+        except Exception as e:
+            print(f"Error folding conversation summary for user {user_id}: {e}")
+        finally:
+            with self._folding_guard:
+                self._folding.discard(user_id)
+
+    def build_history(self, user_id, message, system_prompt=""):
+        """Get the conversation history to send along with message, fitted to max_tokens"""
+        budget = self.max_tokens - self.count_tokens(system_prompt) - self.count_tokens(message)
+        window_start, window = self.conversation_manager.get_recent_window(user_id)
+
+        with self._get_user_lock(user_id):
+            summary = self._load_summary(user_id)
+            budget -= self.count_tokens(summary["summary"])
+
+            # Walk back from the newest message while the budget allows
+            keep = 0
+            for msg in reversed(window):
+                cost = self.count_message_tokens(msg)
+                if cost > budget:
+                    break
+                budget -= cost
+                keep += 1
+            start = window_start + len(window) - keep
+
+            if start > summary["covered"]:
+                # Fold a batch beyond what is strictly needed so the summary is not
+                # recomputed on every turn
+                end = min(start + self.summary_batch, window_start + len(window))
+                self._schedule_fold(user_id, end)
+
+            start = max(start, summary["covered"])
+
+        messages = []
+        if summary["summary"] and summary["covered"] > 0:
+            messages.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{summary['summary']}"
+            })
+        messages.extend(window[start - window_start:])
+        return messages
@@ -1,84 +1,217 @@
 import os
 import json
-import time
+import threading
+from collections import deque
 from datetime import datetime
 
 class ConversationManager:
-    def __init__(self, storage_dir="conversations"):
+    """
+    Per-user conversation history stored as an append-only JSONL log.
+
+    Each message is one line, so saving a turn appends a few lines instead of
+    rewriting the whole history. The most recent messages are kept in memory
+    per user, and every user has their own lock so concurrent requests from
+    the same user cannot lose writes.
+    """
+
+    def __init__(self, storage_dir="conversations", recent_window=200):
         self.storage_dir = storage_dir
+        self.recent_window = recent_window
+        self._recent = {}
+        self._counts = {}
+        self._tail_checked = set()
+        self._locks = {}
+        self._locks_guard = threading.Lock()
         os.makedirs(self.storage_dir, exist_ok=True)
-    
+
     def _get_user_file_path(self, user_id):
         """Generate file path for user conversations"""
+        return os.path.join(self.storage_dir, f"user_{user_id}_conversation.jsonl")
+
+    def _get_legacy_file_path(self, user_id):
+        """Path of the old whole-file JSON format, migrated on first access"""
         return os.path.join(self.storage_dir, f"user_{user_id}_conversation.json")
-    
-    def get_conversation(self, user_id):
-        """Get conversation history for a user in a format suitable for the API"""
+
+    def _get_user_lock(self, user_id):
+        with self._locks_guard:
+            if user_id not in self._locks:
+                self._locks[user_id] = threading.Lock()
+            return self._locks[user_id]
+
+    def _migrate_legacy(self, user_id):
+        """Convert user_<id>_conversation.json to JSONL, written atomically via a temp file"""
+        legacy_path = self._get_legacy_file_path(user_id)
+        file_path = self._get_user_file_path(user_id)
+        if os.path.exists(file_path) or not os.path.exists(legacy_path):
+            return
+
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                conversation = json.load(f)
+            tmp_path = file_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for msg in conversation:
+                    f.write(json.dumps(msg, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, file_path)
+        except Exception as e:
+            print(f"Error migrating conversation for user {user_id}: {e}")
+
+    def _read_messages(self, user_id):
+        """Read every stored message for a user from disk"""
+        self._migrate_legacy(user_id)
         file_path = self._get_user_file_path(user_id)
-        
         if not os.path.exists(file_path):
             return []
-        
+
+        messages = []
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
-                conversation = json.load(f)
-                
-                # Filter to include only messages suitable for the DeepSeek API
-                api_conversation = []
-                for msg in conversation:
-                    if msg.get("role") in ["user", "assistant", "system"]:
-                        api_conversation.append({
-                            "role": msg["role"],
-                            "content": msg["content"]
-                        })
-                
-                return api_conversation
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        messages.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # A torn last line from an interrupted write; skip it
+                        print(f"Skipping malformed conversation line for user {user_id}")
         except Exception as e:
             print(f"Error loading conversation for user {user_id}: {e}")
-            return []
-    
+        return messages
+
+    def _get_recent(self, user_id):
+        """Recent-message window for a user, loaded from disk once. Caller holds the user lock."""
+        if user_id not in self._recent:
+            messages = self._read_messages(user_id)
+            self._recent[user_id] = deque(messages, maxlen=self.recent_window)
+            self._counts[user_id] = len(messages)
+        return self._recent[user_id]
+
+    def _repair_tail(self, file_path):
+        """Make sure the log ends with a newline so the next append starts on a fresh line, truncating a torn last record"""
+        if not os.path.exists(file_path):
+            return
+        with open(file_path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            # Scan backwards for the last newline
+            while pos > 0:
+                block = min(4096, pos)
+                f.seek(pos - block)
+                data = f.read(block)
+                if pos == end and data.endswith(b"\n"):
+                    return
+                newline = data.rfind(b"\n")
+                if newline != -1:
+                    pos = pos - block + newline + 1
+                    break
+                pos -= block
+            f.seek(pos)
+            try:
+                # Complete record that only lost its newline: keep it, it was already loaded
+                json.loads(f.read().decode('utf-8'))
+                f.write(b"\n")
+            except ValueError:
+                print(f"Truncating torn last line of {file_path}")
+                f.truncate(pos)
+
+    def _append_messages(self, user_id, messages):
+        """Append messages to the user's log and in-memory window"""
+        with self._get_user_lock(user_id):
+            recent = self._get_recent(user_id)
+            file_path = self._get_user_file_path(user_id)
+            try:
+                if user_id not in self._tail_checked:
+                    self._repair_tail(file_path)
+                    self._tail_checked.add(user_id)
+                with open(file_path, 'a', encoding='utf-8') as f:
+                    f.write("".join(json.dumps(msg, ensure_ascii=False) + "\n" for msg in messages))
+                recent.extend(messages)
+                self._counts[user_id] += len(messages)
+            except Exception as e:
+                print(f"Error saving conversation for user {user_id}: {e}")
+
+    def get_conversation(self, user_id):
+        """Get recent conversation history for a user in a format suitable for the API"""
+        with self._get_user_lock(user_id):
+            recent = list(self._get_recent(user_id))
+
+        # Filter to include only messages suitable for the DeepSeek API
+        return [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in recent
+            if msg.get("role") in ["user", "assistant", "system"]
+        ]
+
+    def get_recent_window(self, user_id):
+        """
+        Get (start, messages): the in-memory recent window in API format and the
+        absolute index of its first message in the full history
+        """
+        with self._get_user_lock(user_id):
+            recent = list(self._get_recent(user_id))
+            start = self._counts[user_id] - len(recent)
+        return start, [{"role": msg["role"], "content": msg["content"]} for msg in recent]
+
+    def get_full_history(self, user_id):
+        """Get every stored message for a user, including fields not sent to the API"""
+        with self._get_user_lock(user_id):
+            return self._read_messages(user_id)
+
+    def read_messages_from(self, user_id, offset, limit):
+        """
+        Read up to limit messages starting at byte offset of the log, without parsing
+        what comes before it. Returns [(message, offset just past its line)].
+        """
+        with self._get_user_lock(user_id):
+            self._migrate_legacy(user_id)
+            file_path = self._get_user_file_path(user_id)
+            if not os.path.exists(file_path):
+                return []
+
+            messages = []
+            try:
+                with open(file_path, 'rb') as f:
+                    f.seek(offset)
+                    while len(messages) < limit:
+                        line = f.readline()
+                        if not line:
+                            break
+                        offset += len(line)
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            messages.append((json.loads(line.decode('utf-8')), offset))
+                        except ValueError:
+                            # Same rule as _read_messages: a malformed line is not a message
+                            continue
+            except Exception as e:
+                print(f"Error reading conversation for user {user_id}: {e}")
+            return messages
+
     def save_conversation(self, user_id, user_message, assistant_response):
         """Save user message and assistant response to conversation history"""
-        conversation = self.get_conversation(user_id)
-        
-        # Add user message
-        conversation.append({
-            "role": "user",
-            "content": user_message,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        # Add assistant response
-        conversation.append({
-            "role": "assistant",
-            "content": assistant_response,
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        # Save updated conversation
-        file_path = self._get_user_file_path(user_id)
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(conversation, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Error saving conversation for user {user_id}: {e}")
-    
+        self._append_messages(user_id, [
+            {
+                "role": "user",
+                "content": user_message,
+                "timestamp": datetime.now().isoformat()
+            },
+            {
+                "role": "assistant",
+                "content": assistant_response,
+                "timestamp": datetime.now().isoformat()
+            }
+        ])
+
     def add_system_message(self, user_id, system_message, file_content=None):
         """Add system message to conversation history (e.g., for uploaded files)"""
-        conversation = self.get_conversation(user_id)
-        
-        # Add system message
-        conversation.append({
-            "role": "system",
-            "content": system_message,
-            "timestamp": datetime.now().isoformat(),
-            "file_content": file_content
-        })
-        
-        # Save updated conversation
-        file_path = self._get_user_file_path(user_id)
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(conversation, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"Error saving system message for user {user_id}: {e}")
\ No newline at end of file
+        self._append_messages(user_id, [
+            {
+                "role": "system",
+                "content": system_message,
+                "timestamp": datetime.now().isoformat(),
+                "file_content": file_content
+            }
+        ])
@@ -1,10 +1,58 @@
 # models/deepseek_api.py
 import os
 import json
+import time
+import hashlib
+import threading
+import httpx
 from openai import OpenAI
 
+class StreamAborted(Exception):
+    """The upstream stream failed before completing; the deltas received so far are partial"""
+
+
+class _SharedStream:
+    """Deltas of one in-flight streaming request, replayable by every coalesced caller"""
+
+    def __init__(self):
+        self.deltas = []
+        self.done = False
+        self.aborted = False
+        self.error = None
+        self.cond = threading.Condition()
+
+    def append(self, delta):
+        with self.cond:
+            self.deltas.append(delta)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.aborted = error is not None
+            self.error = error
+            self.cond.notify_all()
+
+    def __iter__(self):
+        sent = 0
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.deltas) > sent or self.done)
+                new_deltas = self.deltas[sent:]
+                done = self.done
+            sent += len(new_deltas)
+            yield from new_deltas
+            if done and sent == len(self.deltas):
+                if self.aborted:
+                    raise StreamAborted(str(self.error))
+                return
+
+
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 40, 60)
+
+
 class DeepSeekAPI:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, metrics=None):
         # Make sure we have a valid API key
         self.api_key = api_key or os.getenv('DEEPSEEK_API_KEY')
         if not self.api_key:
@@ -15,12 +63,40 @@ class DeepSeekAPI:
         self.admin_instruction = ""
         self.admin_instruction_file = "admin_instruction.txt"
         
+        # Pooled keep-alive HTTP connections, timeouts, retries and a concurrency cap
+        self.timeout = float(os.getenv('DEEPSEEK_TIMEOUT', 60))
+        self.max_retries = int(os.getenv('DEEPSEEK_MAX_RETRIES', 2))
+        self.max_concurrency = int(os.getenv('DEEPSEEK_MAX_CONCURRENCY', 8))
+        self.semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+                keepalive_expiry=60
+            ),
+            timeout=httpx.Timeout(self.timeout, connect=10)
+        )
+        
+        # Identical requests already in flight (e.g. a double-clicked send) share one API call
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        # Latency histograms live in a shared metrics registry (describe/observe/histogram_snapshot)
+        self.metrics = metrics
+        if self.metrics is not None:
+            for name in ("response", "first_token"):
+                self.metrics.describe(f"llm_{name}_seconds", "histogram", f"DeepSeek API latency ({name})",
+                                      buckets=LATENCY_BUCKETS)
+        
         # Initialize OpenAI client with explicit API key
         try:
             # Create client without proxies argument which seems to be causing issues
             client_kwargs = {
                 "api_key": self.api_key,
-                "base_url": self.base_url
+                "base_url": self.base_url,
+                "http_client": self.http_client,
+                "timeout": self.timeout,
+                # The OpenAI client retries with exponential backoff and jitter
+                "max_retries": self.max_retries
             }
             
             # Initialize the client with compatible arguments
@@ -53,8 +129,8 @@ class DeepSeekAPI:
         except Exception as e:
             print(f"Error saving admin instruction: {e}")
     
-    def generate_response(self, message, conversation_history=None):
-        """Generate response from DeepSeek V3 model using the OpenAI compatible API"""
+    def _build_messages(self, message, conversation_history=None):
+        """Build the chat message list: admin instruction, history, then the new user message"""
         if conversation_history is None:
             conversation_history = []
         
@@ -88,23 +164,167 @@ class DeepSeekAPI:
             "role": "user",
             "content": message
         })
+        return messages
+    
+    def _request_key(self, messages, stream, user_id=None):
+        # Only the same user's identical requests (e.g. a double-clicked send) are coalesced;
+        # different users never share one sampled reply
+        payload = json.dumps(
+            {"model": self.model_name, "messages": messages, "stream": stream, "user": user_id},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def _join_inflight(self, key, factory):
+        """Return (entry, is_leader); the first caller for key creates the entry with factory()"""
+        with self._inflight_lock:
+            if key in self._inflight:
+                return self._inflight[key], False
+            entry = factory()
+            self._inflight[key] = entry
+            return entry, True
+    
+    def _leave_inflight(self, key):
+        with self._inflight_lock:
+            self._inflight.pop(key, None)
+    
+    def generate_response(self, message, conversation_history=None, user_id=None, on_complete=None):
+        """Generate response from DeepSeek V3 model using the OpenAI compatible API
+
+        on_complete(response) is called once per API call, by the caller that made it,
+        so coalesced duplicates of a request can persist the turn exactly once.
+        """
+        messages = self._build_messages(message, conversation_history)
+        key = self._request_key(messages, stream=False, user_id=user_id)
+        entry, is_leader = self._join_inflight(key, lambda: {"event": threading.Event(), "result": None})
+        if not is_leader:
+            print("Identical DeepSeek request already in flight, waiting for its result")
+            entry["event"].wait()
+            return entry["result"]
         
+        try:
+            entry["result"] = self._call_api(messages)
+            if on_complete is not None:
+                on_complete(entry["result"])
+        finally:
+            self._leave_inflight(key)
+            entry["event"].set()
+        return entry["result"]
+    
+    def _call_api(self, messages):
         try:
             # Print debug info
             print(f"Calling DeepSeek API with model: {self.model_name}")
             print(f"Message count: {len(messages)}")
             
-            # Call the DeepSeek API using the OpenAI client
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                temperature=0.7,
-                stream=False
-            )
+            start = time.time()
+            with self.semaphore:
+                # Call the DeepSeek API using the OpenAI client
+                response = self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=messages,
+                    temperature=0.7,
+                    stream=False
+                )
+            self._observe_latency("response", time.time() - start)
             
             # Extract and return the response content
             return response.choices[0].message.content
         
         except Exception as e:
             print(f"Error calling DeepSeek API: {e}")
-            return f"Sorry, I encountered an error while processing your request: {str(e)}"
\ No newline at end of file
+            return f"Sorry, I encountered an error while processing your request: {str(e)}"
+    
+    def generate_response_stream(self, message, conversation_history=None, user_id=None, on_complete=None):
+        """Stream the response, yielding text deltas as they arrive from the API
+
+        The API is read by a worker thread into a shared buffer, so a slow or
+        disconnected client neither throttles nor truncates the coalesced callers.
+        Raises StreamAborted after the partial deltas if the API call fails.
+        on_complete(response) is called once with the full reply when the API call
+        completes, from the worker thread of the caller that started it.
+        """
+        messages = self._build_messages(message, conversation_history)
+        key = self._request_key(messages, stream=True, user_id=user_id)
+        shared, is_leader = self._join_inflight(key, _SharedStream)
+        if is_leader:
+            threading.Thread(target=self._pump_stream, args=(key, messages, shared, on_complete), daemon=True).start()
+        else:
+            print("Identical DeepSeek stream already in flight, sharing its output")
+        yield from shared
+    
+    def _pump_stream(self, key, messages, shared, on_complete=None):
+        """Read the upstream stream to the end into shared, holding the semaphore only for the API call"""
+        error = None
+        try:
+            print(f"Calling DeepSeek API (stream) with model: {self.model_name}")
+            print(f"Message count: {len(messages)}")
+            
+            start = time.time()
+            first_token = True
+            with self.semaphore:
+                stream = self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=messages,
+                    temperature=0.7,
+                    stream=True
+                )
+                
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if first_token:
+                            self._observe_latency("first_token", time.time() - start)
+                            first_token = False
+                        shared.append(delta)
+            self._observe_latency("response", time.time() - start)
+            if on_complete is not None:
+                on_complete("".join(shared.deltas))
+        
+        except Exception as e:
+            print(f"Error calling DeepSeek API: {e}")
+            error = e
+        finally:
+            self._leave_inflight(key)
+            shared.finish(error)
+    
+    def _observe_latency(self, name, seconds):
+        if self.metrics is not None:
+            self.metrics.observe(f"llm_{name}_seconds", seconds)
+    
+    def get_latency_stats(self):
+        """Latency histograms for full responses and time to first streamed token"""
+        if self.metrics is None:
+            return {}
+        return {
+            name: self.metrics.histogram_snapshot(f"llm_{name}_seconds")
+            for name in ("response", "first_token")
+        }
+    
+    def summarize(self, messages, previous_summary=""):
+        """Fold older messages into a rolling summary; returns None if the API call fails"""
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        prompt = (
+            "Update the summary of an ongoing role-play conversation. Keep names, facts, "
+            "promises, unresolved plot threads and the relationship between the characters. "
+            "Be concise and write in the language of the conversation.\n\n"
+            f"Previous summary:\n{previous_summary or '(none)'}\n\n"
+            f"New messages:\n{transcript}"
+        )
+        
+        try:
+            print(f"Summarizing {len(messages)} older messages with model: {self.model_name}")
+            with self.semaphore:
+                response = self.client.chat.completions.create(
+                    model=self.model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.3,
+                    stream=False
+                )
+            return response.choices[0].message.content
+        
+        except Exception as e:
+            print(f"Error summarizing conversation: {e}")
+            return None
@@ -0,0 +1,137 @@
+import time
+import uuid
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class TTSJobQueue:
+    """Run voice synthesis in background workers so /chat can return the text reply right away"""
+
+    def __init__(self, synthesize, max_workers=1, max_pending=32, job_ttl=600, input_timeout=120):
+        # synthesize(texts) consumes an iterable of texts and yields voice file paths,
+        # one per synthesized fragment
+        self.synthesize = synthesize
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        # An open job that receives no text for this long is treated as closed,
+        # so an abandoned stream cannot hold a TTS worker forever
+        self.input_timeout = input_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts")
+        self.jobs = {}
+        self.inputs = {}
+        self.lock = threading.Lock()
+        self.updated = threading.Condition(self.lock)
+
+    def submit(self, text):
+        """Queue text for synthesis and return a job id, or None if the queue is full"""
+        job_id = self.open()
+        if job_id is not None:
+            self.feed(job_id, text)
+            self.close(job_id)
+        return job_id
+
+    def open(self):
+        """Start a job whose text arrives incrementally through feed(); finish it with close()"""
+        with self.lock:
+            self._prune_jobs()
+            pending = sum(1 for job in self.jobs.values() if job["status"] in ("queued", "running"))
+            if pending >= self.max_pending:
+                print(f"TTS queue is full ({pending} pending), skipping voice generation")
+                return None
+
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {
+                "status": "queued",
+                "fragments": [],
+                "error": None,
+                "created": time.time()
+            }
+            self.inputs[job_id] = queue.Queue()
+
+        self.executor.submit(self._run_job, job_id)
+        return job_id
+
+    def feed(self, job_id, text):
+        """Append text (e.g. a completed sentence) to an open job"""
+        if job_id in self.inputs and text.strip():
+            self.inputs[job_id].put(text)
+
+    def close(self, job_id):
+        """Signal that no more text will be fed to the job"""
+        if job_id in self.inputs:
+            self.inputs[job_id].put(None)
+
+    def get_job(self, job_id):
+        """Get a copy of the job state, or None if the job is unknown or expired"""
+        with self.lock:
+            return self._copy_job(job_id)
+
+    def wait_job(self, job_id, seen_fragments=0, timeout=30):
+        """Block until the job has more than seen_fragments fragments or has finished"""
+        with self.updated:
+            self.updated.wait_for(
+                lambda: job_id not in self.jobs
+                or len(self.jobs[job_id]["fragments"]) > seen_fragments
+                or self.jobs[job_id]["status"] in ("done", "error"),
+                timeout=timeout
+            )
+            return self._copy_job(job_id)
+
+    def stats(self):
+        """Number of tracked jobs per status"""
+        with self.lock:
+            counts = {"queued": 0, "running": 0, "done": 0, "error": 0}
+            for job in self.jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def _copy_job(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job = dict(job)
+        job["fragments"] = list(job["fragments"])
+        return job
+
+    def _iter_input(self, job_id):
+        texts = self.inputs[job_id]
+        while True:
+            try:
+                text = texts.get(timeout=self.input_timeout)
+            except queue.Empty:
+                print(f"TTS job {job_id} received no text for {self.input_timeout}s, closing it")
+                return
+            if text is None:
+                return
+            yield text
+
+    def _run_job(self, job_id):
+        self._update_job(job_id, status="running")
+        try:
+            for voice_file in self.synthesize(self._iter_input(job_id)):
+                with self.updated:
+                    if job_id in self.jobs:
+                        self.jobs[job_id]["fragments"].append(voice_file)
+                    self.updated.notify_all()
+            self._update_job(job_id, status="done")
+        except Exception as e:
+            print(f"Error generating voice for job {job_id}: {e}")
+            self._update_job(job_id, status="error", error=str(e))
+        finally:
+            self.inputs.pop(job_id, None)
+
+    def _update_job(self, job_id, **fields):
+        with self.updated:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(fields)
+            self.updated.notify_all()
+
+    def _prune_jobs(self):
+        """Drop finished jobs older than job_ttl so the job table does not grow forever"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["status"] in ("done", "error") and now - job["created"] > self.job_ttl
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
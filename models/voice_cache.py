@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import soundfile as sf
+
+class VoiceCache:
+    """Content-addressed cache of synthesized audio, stored as wav files with size- and age-based LRU eviction"""
+
+    def __init__(self, cache_dir="voice/cache", max_bytes=512 * 1024 * 1024, max_age=7 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def normalize_text(text):
+        """Collapse whitespace so trivially different spellings of a line share one entry"""
+        return " ".join(text.split())
+
+    def make_key(self, text, **params):
+        """Hash the normalized text together with everything else that changes the audio"""
+        payload = json.dumps(
+            {"text": self.normalize_text(text), "params": params},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    def get(self, key):
+        """Return the cached wav path for key, or None on a miss"""
+        path = self._get_path(key)
+        with self.lock:
+            if os.path.exists(path) and time.time() - os.path.getmtime(path) <= self.max_age:
+                # Touch the file so eviction treats it as recently used
+                os.utime(path, None)
+                self.hits += 1
+                return path
+            self.misses += 1
+            return None
+
+    def put(self, key, audio, sample_rate):
+        """Write audio (float array) for key and return its path"""
+        path = self._get_path(key)
+        # A unique temp file per writer, so two workers voicing the same line never
+        # write into the same file and cannot publish a partial wav
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f"{key}.", suffix=".tmp.wav")
+        os.close(fd)
+        try:
+            sf.write(tmp_path, audio, sample_rate)
+            os.replace(tmp_path, path)
+        except Exception:
+            self._remove(tmp_path)
+            raise
+        with self.lock:
+            self._evict()
+        return path
+
+    def _evict(self):
+        """Drop expired entries, then the least recently used ones until the cache fits in max_bytes"""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".wav") or name.endswith(".tmp.wav"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                self._remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Error removing cached voice {path}: {e}")
+
+    def stats(self):
+        """Hit/miss counters and current disk usage"""
+        with self.lock:
+            sizes = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".wav") or name.endswith(".tmp.wav"):
+                    continue
+                try:
+                    sizes.append(os.path.getsize(os.path.join(self.cache_dir, name)))
+                except OSError:
+                    # Evicted or replaced between listdir and getsize
+                    continue
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(sizes),
+                "bytes": sum(sizes)
+            }
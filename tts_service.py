@@ -1,10 +1,15 @@
 import os
+import re
 import sys
+import time
+import importlib
+import threading
 import torch
 import numpy as np
 import datetime
 import soundfile as sf
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # 设置G2PW模型路径和环境变量
 g2pw_zip_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 
@@ -33,17 +38,75 @@ os.environ['G2PW_MODEL_DIR'] = g2pw_model_dir
 print(f"G2PW模型目录: {g2pw_model_dir}")
 
 # 修改导入语句，使用正确的函数名
-from inference_webui import get_tts_wav, change_sovits_weights as load_sovits_model, change_gpt_weights as load_gpt_model
+import inference_webui
+from inference_webui import splits, cut5, merge_short_text_in_array, get_tts_wav, get_ref_feature, get_hash_of_file, change_sovits_weights as load_sovits_model, load_gpt_weights, apply_gpt_weights
+from models.voice_cache import VoiceCache
+from tts_metrics import record_cache
+
+# 参考音频设置（使用绝对路径），固定不变，启动时预先提取特征
+_base_dir = os.path.dirname(os.path.abspath(__file__))
+_ref_audio = os.path.join(_base_dir, "Referance_voice", "【开心_happy】仪式开始前的这段时间尽可自由支配，好好休息吧…我也要花些时间整理思绪。回头见了，朋友们。.wav")
+_ref_text = "仪式开始前的这段时间尽可自由支配，好好休息吧…我也要花些时间整理思绪。回头见了，朋友们。"
+
+# 参考音频列表（使用绝对路径）
+_ref_audios = [
+    os.path.join(_base_dir, "Referance_voice", "【开心_happy】趁着天色正好，两位不如多走走看看吧。不打扰你们，回头见了。.wav"),
+    os.path.join(_base_dir, "Referance_voice", "【开心_happy】…不过，一直讨论这么苦大仇深的话题也属实扫兴。好像还是我起的头，真难为情。.wav"),
+    os.path.join(_base_dir, "Referance_voice", "【开心_happy】仪式开始前的这段时间尽可自由支配，好好休息吧…我也要花些时间整理思绪。回头见了，朋友们。.wav")
+]
+
+# 合成参数，同时作为语音缓存键的一部分；seed为-1时不固定随机种子
+_tts_params = {
+    "top_k": 15,
+    "top_p": 1,
+    "temperature": 1,
+    "speed": 0.85,
+    "seed": -1
+}
+
+# 已合成语音的缓存：相同文本+参考音频+模型+参数直接复用，不再重跑T2S和VITS
+voice_cache = VoiceCache(
+    cache_dir=os.path.join("voice", "cache"),
+    max_bytes=int(os.getenv("VOICE_CACHE_MAX_MB", 512)) * 1024 * 1024,
+    max_age=int(os.getenv("VOICE_CACHE_MAX_AGE_DAYS", 7)) * 24 * 3600
+)
 
 # 全局变量，保存已加载的模型
 _sovits_model = None
 _gpt_model = None
 _hps = None
 _dict_language = None
+_init_lock = threading.Lock()
+_startup_thread = None
+# 模型加载失败的原因；记录后不再重试，后续合成任务直接失败而不是每次重新加载
+_load_error = None
+
+# 启动状态：starting -> loading -> warming_up -> ready（模型加载失败时为 failed）
+_status = {"state": "starting", "ready": False, "tts": False, "startup_seconds": None, "error": None}
+
+# 预热用的短句，触发各模型首次推理时的内存分配和算子初始化
+_warmup_text = "你好，欢迎来到奥赫玛。"
+
+
+def _preload_text_frontend():
+    """提前导入中文前端（G2PW ONNX、jieba词典等），避免首个请求时才加载"""
+    importlib.import_module("text.chinese2")
+
 
 def init_models():
-    """初始化并加载模型，只需执行一次"""
-    global _sovits_model, _gpt_model, _hps, _dict_language
+    """初始化并加载模型，只需执行一次；加载失败时抛出 RuntimeError，之后的调用不再重试"""
+    global _load_error
+    with _init_lock:
+        if _load_error is None:
+            _init_models()
+            if _sovits_model is None or _gpt_model is None:
+                _load_error = _load_error or "模型未能加载"
+        if _load_error is not None:
+            raise RuntimeError(f"TTS模型加载失败: {_load_error}")
+
+
+def _init_models():
+    global _sovits_model, _gpt_model, _hps, _dict_language, _load_error
     
     if _sovits_model is not None and _gpt_model is not None:
         return  # 模型已加载，无需重复加载
@@ -81,8 +144,15 @@ def init_models():
                 break
     
     try:
+        # SoVITS、GPT权重与中文前端互不依赖，并行加载；
+        # GPT只在这里构建模型，等SoVITS确定version后再启用并写入weight.json
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            sovits_future = executor.submit(load_sovits_model, sovits_path)
+            gpt_future = executor.submit(load_gpt_weights, gpt_path)
+            frontend_future = executor.submit(_preload_text_frontend)
+        
         # 加载SoVITS模型
-        sovits_result = load_sovits_model(sovits_path)
+        sovits_result = sovits_future.result()
         print(f"sovits_result类型: {type(sovits_result)}")
         # 处理SoVITS模型加载结果
         if sovits_result is None:
@@ -97,7 +167,7 @@ def init_models():
             _hps = None
             
         # 加载GPT模型
-        gpt_result = load_gpt_model(gpt_path)
+        gpt_result = apply_gpt_weights(gpt_path, *gpt_future.result(), weight_version=inference_webui.version)
         print(f"gpt_result类型: {type(gpt_result)}")
             
         # 处理GPT模型加载结果
@@ -112,7 +182,12 @@ def init_models():
             _gpt_model = gpt_result
             _dict_language = None
             
+        frontend_future.result()
         print("TTS模型加载完成")
+
+        # 预先提取参考音频特征（命中磁盘缓存时直接加载），之后的请求直接复用
+        get_ref_feature(_ref_audio, _ref_audios)
+        print("参考音频特征已就绪")
         
     except Exception as e:
         print(f"加载模型时发生错误: {e}")
@@ -122,6 +197,163 @@ def init_models():
         _gpt_model = None
         _hps = None
         _dict_language = None
+        _load_error = str(e)
+
+
+def startup(warmup=True):
+    """
+    服务启动流程：并行加载全部模型，提取参考音频特征，再跑一句短文本预热。
+    完成后 get_status()["ready"] 为 True，app 才开始接受请求；模型加载失败时保持 False，状态为 failed。
+    """
+    start = time.time()
+    _status["state"] = "loading"
+    try:
+        init_models()
+    except RuntimeError as e:
+        print(f"{e}，语音功能不可用")
+        _status["state"] = "failed"
+        _status["error"] = str(e)
+        _status["startup_seconds"] = round(time.time() - start, 3)
+        return
+    
+    _status["tts"] = True
+    if warmup:
+        _status["state"] = "warming_up"
+        try:
+            for _ in _run_tts(_warmup_text, how_to_cut="不切"):
+                pass
+            print("TTS预热完成")
+        except Exception as e:
+            print(f"TTS预热失败: {e}")
+    _status["state"] = "ready"
+    
+    _status["startup_seconds"] = round(time.time() - start, 3)
+    _status["ready"] = True
+    print(f"TTS服务启动完成，用时 {_status['startup_seconds']} 秒")
+
+
+def start_background(warmup=True):
+    """在后台线程中执行 startup；多次调用（如应用被重复导入）只启动一次"""
+    global _startup_thread
+    with _init_lock:
+        if _startup_thread is None:
+            _startup_thread = threading.Thread(target=startup, kwargs={"warmup": warmup}, daemon=True)
+            _startup_thread.start()
+    return _startup_thread
+
+
+def get_status():
+    """启动/就绪状态，供 /ready 接口使用"""
+    return dict(_status)
+
+
+def _run_tts(text, how_to_cut, return_fragment=False):
+    """用固定的参考音频和采样参数调用GPT-SoVITS，返回音频生成器"""
+    if _tts_params["seed"] != -1:
+        torch.manual_seed(_tts_params["seed"])
+    return get_tts_wav(
+        ref_wav_path=_ref_audio,
+        prompt_text=_ref_text,
+        prompt_language="中文",
+        text=text,
+        text_language="中文",
+        how_to_cut=how_to_cut,
+        top_k=_tts_params["top_k"],
+        top_p=_tts_params["top_p"],
+        temperature=_tts_params["temperature"],
+        ref_free=False,
+        speed=_tts_params["speed"],
+        if_freeze=False,
+        inp_refs=_ref_audios,
+        return_fragment=return_fragment
+    )
+
+
+def _voice_cache_key(text, how_to_cut):
+    """缓存键：规范化文本 + 参考音频内容哈希 + 模型权重哈希 + 合成参数"""
+    return voice_cache.make_key(
+        text,
+        how_to_cut=how_to_cut,
+        ref_audio=get_hash_of_file(_ref_audio),
+        ref_audios=[get_hash_of_file(path) for path in _ref_audios],
+        ref_text=_ref_text,
+        sovits=inference_webui.sovits_hash,
+        gpt=inference_webui.gpt_hash,
+        # int8量化的结果和fp32不同，分开缓存；fp32不加这一项，已有缓存保持有效
+        **({"precision": "int8"} if inference_webui.is_int8 else {}),
+        **_tts_params
+    )
+
+
+def _voice_cache_get(key):
+    """查语音缓存，命中/未命中计入 tts_cache_requests_total{cache="voice"}"""
+    voice_file = voice_cache.get(key)
+    record_cache("voice", voice_file is not None)
+    return voice_file
+
+
+def _synthesize_cached(text, how_to_cut):
+    """查缓存，未命中则合成并写入缓存，返回wav路径"""
+    key = _voice_cache_key(text, how_to_cut)
+    voice_file = _voice_cache_get(key)
+    if voice_file is not None:
+        print(f"语音缓存命中: {voice_file}")
+        return voice_file
+
+    sample_rate, audio_data = None, None
+    for sample_rate, audio_data in _run_tts(text, how_to_cut=how_to_cut):
+        pass
+    if audio_data is None or len(audio_data) == 0:
+        raise RuntimeError("未获取到有效的音频数据")
+    return voice_cache.put(key, _to_float_audio(audio_data), sample_rate)
+
+
+def _to_float_audio(audio_data):
+    # 如果是整数类型，转换为浮点数并归一化
+    if np.issubdtype(audio_data.dtype, np.integer):
+        return audio_data.astype(np.float32) / 32768.0
+    return np.array(audio_data, dtype=np.float32)
+
+
+class SentenceSplitter:
+    """把LLM流式输出的token拼成整句：用与inference_webui相同的splits标点断句，
+    标点后出现新文字且当前句不短于min_len时切出一句"""
+
+    def __init__(self, min_len=5):
+        self.min_len = min_len
+        self.buffer = ""
+
+    def feed(self, token):
+        sentences = []
+        for char in token:
+            if self.buffer and self.buffer[-1] in splits and char not in splits \
+                    and len(self.buffer.strip()) >= self.min_len \
+                    and not (self.buffer[-1] == "." and char.isdigit() and self.buffer[-2:-1].isdigit()):
+                sentences.append(self.buffer)
+                self.buffer = ""
+            self.buffer += char
+        return sentences
+
+    def flush(self):
+        sentence, self.buffer = self.buffer, ""
+        return [sentence] if sentence.strip() else []
+
+
+def generate_voice_stream(texts):
+    """逐句生成AI语音：texts可以是整段文本，也可以是LLM流式生成中陆续到达的句子。
+    每段先按标点切句（与get_tts_wav的cut5+短句合并一致），逐句查缓存或合成，
+    每得到一句就yield其wav路径，前端可以边收边播，首段语音不必等整段回复合成完"""
+    init_models()
+
+    if isinstance(texts, str):
+        texts = [texts]
+    for text in texts:
+        sentences = [item for item in cut5(text.strip("\n")).split("\n") if item.strip()]
+        for sentence in merge_short_text_in_array(sentences, 5):
+            # 只有标点/空白的片段（如单独的“……”）无法合成，直接跳过
+            if not re.sub(r"[\W_]", "", sentence):
+                continue
+            yield _synthesize_cached(sentence, how_to_cut="不切")
 
 
 def generate_voice(text, save_dir="voice"):
@@ -129,27 +361,25 @@ def generate_voice(text, save_dir="voice"):
     # 确保模型已加载
     init_models()
     
+    # 相同文本和参数已合成过则直接返回缓存
+    key = _voice_cache_key(text, "凑四句一切")
+    voice_file = _voice_cache_get(key)
+    if voice_file is not None:
+        print(f"语音缓存命中: {voice_file}")
+        return voice_file
+    
     # 确保保存目录存在
     os.makedirs(save_dir, exist_ok=True)
     
     # 生成唯一文件名 - 确保在函数开头就定义 filepath
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    # 带微秒，避免多个TTS工作线程同一秒内生成时文件名冲突
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
     filename = f"voice_{timestamp}.wav"
     filepath = os.path.join(save_dir, filename)
     
-    # 使用绝对路径
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # 参考音频设置（使用绝对路径）
-    ref_audio = os.path.join(base_dir, "Referance_voice", "【开心_happy】仪式开始前的这段时间尽可自由支配，好好休息吧…我也要花些时间整理思绪。回头见了，朋友们。.wav")
-    ref_text = "仪式开始前的这段时间尽可自由支配，好好休息吧…我也要花些时间整理思绪。回头见了，朋友们。"
-    
-    # 参考音频列表（使用绝对路径）
-    ref_audios = [
-        os.path.join(base_dir, "Referance_voice", "【开心_happy】趁着天色正好，两位不如多走走看看吧。不打扰你们，回头见了。.wav"),
-        os.path.join(base_dir, "Referance_voice", "【开心_happy】…不过，一直讨论这么苦大仇深的话题也属实扫兴。好像还是我起的头，真难为情。.wav"),
-        os.path.join(base_dir, "Referance_voice", "【开心_happy】仪式开始前的这段时间尽可自由支配，好好休息吧…我也要花些时间整理思绪。回头见了，朋友们。.wav")
-    ]
+    ref_audio = _ref_audio
+    ref_text = _ref_text
+    ref_audios = _ref_audios
     
     # 检查引用文件是否存在
     print(f"主参考音频存在: {os.path.exists(ref_audio)}")
@@ -161,21 +391,7 @@ def generate_voice(text, save_dir="voice"):
         print(f"开始生成语音，使用参考音频: {ref_audio}")
         print(f"参考音频文件存在: {os.path.exists(ref_audio)}")
         
-        wav_generator = get_tts_wav(
-            ref_wav_path=ref_audio,
-            prompt_text=ref_text,
-            prompt_language="中文",
-            text=text,
-            text_language="中文",
-            how_to_cut="凑四句一切",
-            top_k=15,
-            top_p=1,
-            temperature=1,
-            ref_free=False,
-            speed=0.85,
-            if_freeze=False,
-            inp_refs=ref_audios
-        )
+        wav_generator = _run_tts(text, how_to_cut="凑四句一切")
         
         # 从生成器获取音频数据
         print("从生成器获取音频数据...")
@@ -191,14 +407,8 @@ def generate_voice(text, save_dir="voice"):
         if audio_data is not None:
             print(f"获取到音频数据，类型: {type(audio_data)}")
             
-            # 如果是整数类型，转换为浮点数并归一化
-            if np.issubdtype(audio_data.dtype, np.integer):
-                audio_array = audio_data.astype(np.float32) / 32768.0
-            else:
-                audio_array = np.array(audio_data, dtype=np.float32)
-                
-            # 使用已经定义的filepath保存
-            sf.write(filepath, audio_array, sample_rate)
+            # 写入缓存目录，下次相同文本直接命中
+            filepath = voice_cache.put(key, _to_float_audio(audio_data), sample_rate)
             print(f"音频已保存到: {filepath}")
             return filepath
         else: